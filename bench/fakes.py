@@ -0,0 +1,469 @@
+"""
+In-memory stand-ins for DynamoDB, GitHub and Discord, so the bot's handlers can be driven without a network.
+Every downstream call is counted in ``Sandbox.calls``.
+"""
+import asyncio
+import copy
+import datetime
+import itertools
+import re
+import time
+from collections import Counter
+from decimal import Decimal
+from types import SimpleNamespace
+
+import disnake
+from botocore.exceptions import ClientError
+from github.Issue import Issue
+
+import lib.db as ddb
+from lib.github import GitHubClient, IssueStateCache
+from lib.leaderboard import Leaderboard
+from lib.render import EmbedRenderScheduler
+from lib.reports import Report, report_links
+
+# the PartiQL lib.db.query_many sends: SELECT * FROM "table"."index" WHERE "key" IN [?, ...] AND "attr" = ? ...
+PARTIQL_SELECT_RE = re.compile(r'SELECT \* FROM "(?P<table>[^"]+)"(?:\."[^"]+")? '
+                               r'WHERE "(?P<key>\w+)" IN \[(?P<values>[?, ]*)](?P<rest>.*)$')
+PARTIQL_EQUAL_RE = re.compile(r' AND "(\w+)" = \?')
+ISSUE_URL_RE = re.compile(r"/repos/(?P<repo>[^/]+/[^/]+)/issues/(?P<num>\d+)(?P<comments>/comments)?$")
+_MISSING = object()
+
+
+def to_dynamo(value):
+    """Converts a value the way boto3's resource layer returns it: every number becomes a Decimal."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: to_dynamo(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_dynamo(v) for v in value]
+    return value
+
+
+def evaluate(condition, item):
+    """Evaluates a boto3.dynamodb.conditions expression against an item."""
+    expr = condition.get_expression()
+    operator, values = expr['operator'], expr['values']
+    if operator == 'AND':
+        return all(evaluate(v, item) for v in values)
+    if operator == 'OR':
+        return any(evaluate(v, item) for v in values)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+
+    actual = item.get(values[0].name, _MISSING)
+    if operator == 'attribute_exists':
+        return actual is not _MISSING
+    if operator == 'attribute_not_exists':
+        return actual is _MISSING
+    if actual is _MISSING:
+        return False
+    if operator == '=':
+        return actual == values[1]
+    if operator == '<>':
+        return actual != values[1]
+    if operator == '<':
+        return actual < values[1]
+    if operator == '<=':
+        return actual <= values[1]
+    if operator == '>':
+        return actual > values[1]
+    if operator == '>=':
+        return actual >= values[1]
+    if operator == 'contains':
+        return values[1] in actual
+    if operator == 'begins_with':
+        return actual.startswith(values[1])
+    raise NotImplementedError(f"Unsupported condition operator {operator}")
+
+
+class FakeTable:
+    """A dict-backed DynamoDB table supporting the calls this bot makes."""
+
+    def __init__(self, sandbox, name, hash_key, indexes=None, range_key=None):
+        self.sandbox = sandbox
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}  # index name -> attribute names
+        self.items = {}
+
+    def key(self, item):
+        """The key an item is stored under in self.items."""
+        if self.range_key is None:
+            return item[self.hash_key]
+        return item[self.hash_key], item[self.range_key]
+
+    def _count(self, op):
+        self.sandbox.calls[f"dynamo.{op}"] += 1
+
+    def get_item(self, Key, **_):
+        self._count("get_item")
+        item = self.items.get(self.key(Key))
+        if item is None:
+            return {}
+        return {"Item": copy.deepcopy(item)}
+
+    def put_item(self, Item, ConditionExpression=None, **_):
+        self._count("put_item")
+        current = self.items.get(self.key(Item), {})
+        if ConditionExpression is not None and not evaluate(ConditionExpression, current):
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "condition failed"}},
+                              "PutItem")
+        self.items[self.key(Item)] = to_dynamo(copy.deepcopy(Item))
+        return {}
+
+    def delete_item(self, Key, **_):
+        self._count("delete_item")
+        self.items.pop(self.key(Key), None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, **_):
+        self._count("update_item")
+        values = ExpressionAttributeValues or {}
+        item = self.items.setdefault(self.key(Key), to_dynamo(dict(Key)))
+        action, _, clause = UpdateExpression.partition(" ")
+        if action == "ADD":
+            name, placeholder = clause.split()
+            item[name] = item.get(name, 0) + to_dynamo(values[placeholder])
+        elif action == "SET":
+            for assignment in clause.split(","):
+                name, placeholder = (part.strip() for part in assignment.split("="))
+                item[name] = to_dynamo(values[placeholder])
+        elif action == "REMOVE":
+            name, index = re.match(r"(\w+)\[(\d+)]", clause.strip()).groups()
+            del item[name][int(index)]
+        else:
+            raise NotImplementedError(f"Unsupported update expression {UpdateExpression}")
+        return {"Attributes": copy.deepcopy(item)}
+
+    def query(self, KeyConditionExpression, IndexName=None, **_):
+        self._count("query")
+        items = [copy.deepcopy(i) for i in self.items.values() if evaluate(KeyConditionExpression, i)]
+        return {"Items": items, "Count": len(items)}
+
+    def scan(self, FilterExpression=None, ExclusiveStartKey=None, **_):
+        self._count("scan")
+        items = [copy.deepcopy(i) for i in self.items.values()
+                 if FilterExpression is None or evaluate(FilterExpression, i)]
+        return {"Items": items, "Count": len(items)}
+
+
+class FakeDynamo:
+    """Stands in for the boto3 dynamodb resource, for multi-table calls."""
+
+    def __init__(self, sandbox, tables):
+        self.sandbox = sandbox
+        self.tables = {table.name: table for table in tables}
+        self.meta = SimpleNamespace(client=self)  # client calls (values already converted, as boto3 does) land here
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **_):
+        self.sandbox.calls["dynamo.batch_get_item"] += 1
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.tables[name]
+            responses[name] = [copy.deepcopy(table.items[table.key(key)]) for key in request['Keys']
+                               if table.key(key) in table.items]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def execute_statement(self, Statement, Parameters, **_):
+        self.sandbox.calls["dynamo.execute_statement"] += 1
+        match = PARTIQL_SELECT_RE.match(Statement)
+        if match is None:
+            raise NotImplementedError(f"Unsupported statement {Statement}")
+        table = self.tables[match.group('table')]
+        values = to_dynamo(Parameters)
+        n_in = match.group('values').count("?")
+        keys, equal = values[:n_in], dict(zip(PARTIQL_EQUAL_RE.findall(match.group('rest')), values[n_in:]))
+        return {"Items": [copy.deepcopy(item) for item in table.items.values()
+                          if item.get(match.group('key'), _MISSING) in keys
+                          and all(item.get(name, _MISSING) == value for name, value in equal.items())]}
+
+    def batch_write_item(self, RequestItems, **_):
+        self.sandbox.calls["dynamo.batch_write_item"] += 1
+        for name, requests in RequestItems.items():
+            table = self.tables[name]
+            for request in requests:
+                if "PutRequest" in request:
+                    item = request["PutRequest"]["Item"]
+                    table.items[table.key(item)] = to_dynamo(copy.deepcopy(item))
+                else:
+                    table.items.pop(table.key(request["DeleteRequest"]["Key"]), None)
+        return {"UnprocessedItems": {}}
+
+
+# ==== github ====
+class FakeRequester:
+    """Answers the PyGithub requests made against lazy Issues (edits and comments) from the sandbox's issues."""
+
+    def __init__(self, sandbox):
+        self.sandbox = sandbox
+
+    def check_me(self, _):
+        pass
+
+    def requestJsonAndCheck(self, verb, url, parameters=None, headers=None, input=None):
+        self.sandbox.sleep_sync()
+        match = ISSUE_URL_RE.search(url)
+        repo_name, num = match.group('repo'), int(match.group('num'))
+        issue = self.sandbox.issues[(repo_name, num)]
+        if match.group('comments'):
+            self.sandbox.calls["github.create_comment"] += 1
+            issue['comments'] += 1
+            return {}, {"id": next(self.sandbox.ids), "body": input['body']}
+
+        self.sandbox.calls["github.edit_issue"] += 1
+        for key, value in input.items():
+            if key == 'labels':
+                value = [{"name": name} for name in value]
+            issue[key] = value
+        issue['updated_at'] = self.sandbox.timestamp()
+        return {}, copy.deepcopy(issue)
+
+
+class FakeRepo:
+    def __init__(self, sandbox, full_name):
+        self.sandbox = sandbox
+        self.full_name = full_name
+        self.url = f"https://api.github.com/repos/{full_name}"
+        self.owner = SimpleNamespace(login=full_name.split('/')[0])
+        self._requester = sandbox.requester
+
+    def get_issue(self, number):
+        self.sandbox.sleep_sync()
+        self.sandbox.calls["github.get_issue"] += 1
+        return Issue(self._requester, {}, copy.deepcopy(self.sandbox.issues[(self.full_name, number)]), completed=True)
+
+    def create_issue(self, title, body, labels=None):
+        self.sandbox.sleep_sync()
+        self.sandbox.calls["github.create_issue"] += 1
+        data = self.sandbox.add_issue(self.full_name, title, body, labels or [])
+        return Issue(self._requester, {}, copy.deepcopy(data), completed=True)
+
+
+# ==== discord ====
+def not_found():
+    return disnake.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown")
+
+
+class FakeMessage:
+    def __init__(self, sandbox, channel, message_id, embed=None, components=None):
+        self.sandbox = sandbox
+        self.channel = channel
+        self.id = message_id
+        self.embed = embed
+        self.components = components
+        self.deleted = False
+
+    @property
+    def jump_url(self):
+        return f"https://discord.com/channels/{self.channel.guild.id}/{self.channel.id}/{self.id}"
+
+    async def edit(self, embed=None, **_):
+        await self.sandbox.sleep()
+        self.sandbox.calls["discord.edit_message"] += 1
+        if self.deleted:
+            raise not_found()
+        self.embed = embed
+        return self
+
+    async def fetch(self):
+        return await self.channel.fetch_message(self.id)
+
+    async def delete(self):
+        await self.sandbox.sleep()
+        self.sandbox.calls["discord.delete_message"] += 1
+        if self.deleted:
+            raise not_found()
+        self.deleted = True
+
+    async def add_reaction(self, _):
+        await self.sandbox.sleep()
+        self.sandbox.calls["discord.add_reaction"] += 1
+
+    async def pin(self):
+        self.sandbox.calls["discord.pin"] += 1
+
+
+class FakeGuild:
+    def __init__(self, sandbox, guild_id=1):
+        self.sandbox = sandbox
+        self.id = guild_id
+
+    def get_member(self, member_id):
+        return self.sandbox.members.get(member_id)
+
+
+class FakeChannel:
+    def __init__(self, sandbox, channel_id):
+        self.sandbox = sandbox
+        self.id = channel_id
+        self.guild = sandbox.guild
+        self.messages = {}
+
+    async def send(self, content=None, embed=None, embeds=None, components=None, **_):
+        await self.sandbox.sleep()
+        self.sandbox.calls["discord.send"] += 1
+        message = FakeMessage(self.sandbox, self, next(self.sandbox.ids), embed or embeds, components)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.sandbox.sleep()
+        self.sandbox.calls["discord.fetch_message"] += 1
+        message = self.messages.get(message_id)
+        if message is None or message.deleted:
+            raise not_found()
+        return message
+
+    def get_partial_message(self, message_id):
+        message = self.messages.get(message_id)
+        if message is None:  # a handle to a message that doesn't exist
+            message = FakeMessage(self.sandbox, self, message_id)
+            message.deleted = True
+        return message
+
+    def get_thread(self, _):
+        return None
+
+    async def trigger_typing(self):
+        pass
+
+
+class FakeMember:
+    def __init__(self, sandbox, member_id, bot=False):
+        self.sandbox = sandbox
+        self.id = member_id
+        self.bot = bot
+        self.guild = sandbox.guild
+        self.roles = []
+
+    async def send(self, content=None, embed=None, **_):
+        await self.sandbox.sleep()
+        self.sandbox.calls["discord.dm"] += 1
+
+    def __str__(self):
+        return f"member{self.id}"
+
+
+class FakeBot:
+    def __init__(self, sandbox):
+        self.sandbox = sandbox
+        self.channels = {}
+        self.user = FakeMember(sandbox, 0, bot=True)
+
+    @property
+    def loop(self):
+        return asyncio.get_event_loop()
+
+    def get_channel(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(self.sandbox, channel_id)
+        return self.channels[channel_id]
+
+    def get_partial_messageable(self, channel_id, type=None):
+        return self.get_channel(channel_id)
+
+    async def fetch_channel(self, channel_id):
+        await self.sandbox.sleep()
+        self.sandbox.calls["discord.fetch_channel"] += 1
+        raise not_found()
+
+    def get_all_members(self):
+        return iter(self.sandbox.members.values())
+
+    def get_user(self, user_id):
+        return self.sandbox.members.get(user_id)
+
+    def get_guild(self, _):
+        return self.sandbox.guild
+
+
+class Sandbox:
+    """
+    Installs the stand-ins in place of the storage tables and the GitHub client for the duration of a with block.
+    ``latency`` simulates the round trip of each downstream call, in seconds.
+    """
+
+    def __init__(self, latency=0, repos=("avrae/avrae", "avrae/avrae-data-entry")):
+        self.latency = latency
+        self.calls = Counter()
+        self.ids = itertools.count(1000)
+        self.issues = {}  # (repo, num) -> issue json
+        self.guild = FakeGuild(self)
+        self.members = {}
+        self.bot = FakeBot(self)
+
+        self.reports = FakeTable(self, 'taine.reports', 'report_id', indexes={
+            'message_id': ('message',), 'github_issue': ('github_issue', 'github_repo')})
+        self.reportnums = FakeTable(self, 'taine.reportnums', 'identifier')
+        self.deliveries = FakeTable(self, 'taine.deliveries', 'delivery_id')
+        self.leases = FakeTable(self, 'taine.leases', 'lease_id')
+        self.checkpoints = FakeTable(self, 'taine.checkpoints', 'job', range_key='item_id')
+        self.dynamo = FakeDynamo(self, [self.reports, self.reportnums, self.deliveries, self.leases,
+                                        self.checkpoints])
+
+        self.requester = FakeRequester(self)
+        self.github = GitHubClient.__new__(GitHubClient)
+        self.github.client = None
+        self.github.repos = {name: FakeRepo(self, name) for name in repos}
+        self.github.issue_cache = IssueStateCache()
+        self._saved = None
+
+    def __enter__(self):
+        self._saved = (ddb.dynamo, ddb.reports, ddb.reportnums, ddb.deliveries, ddb.leases, ddb.checkpoints,
+                       GitHubClient._instance, Report.render_scheduler, Report.leaderboard, Report.leases)
+        ddb.dynamo, ddb.reports, ddb.reportnums, ddb.deliveries, ddb.leases, ddb.checkpoints = \
+            self.dynamo, self.reports, self.reportnums, self.deliveries, self.leases, self.checkpoints
+        GitHubClient._instance = self.github
+        Report.render_scheduler = EmbedRenderScheduler(on_missing=Report.forget_message)
+        Report.leaderboard = Leaderboard()
+        Report.leases = None  # a test that wants leases sets them up on self.leases
+        Report.message_cache.clear()
+        Report.embed_cache.clear()
+        Report.thread_cache.clear()
+        report_links.clear()
+        return self
+
+    def __exit__(self, *_):
+        ddb.dynamo, ddb.reports, ddb.reportnums, ddb.deliveries, ddb.leases, ddb.checkpoints, \
+            GitHubClient._instance, Report.render_scheduler, Report.leaderboard, Report.leases = self._saved
+        Report.message_cache.clear()
+        Report.embed_cache.clear()
+        Report.thread_cache.clear()
+        report_links.clear()
+
+    async def sleep(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def sleep_sync(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def timestamp():
+        return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def add_member(self, member_id):
+        self.members[member_id] = FakeMember(self, member_id)
+        return self.members[member_id]
+
+    def add_issue(self, repo_name, title, body, labels, number=None):
+        """Adds an issue (or PR) to the fake GitHub, returning its json."""
+        number = number or next(self.ids)
+        self.issues[(repo_name, number)] = data = {
+            "number": number, "title": title, "body": body, "state": "open", "comments": 0,
+            "labels": [{"name": name} for name in labels], "updated_at": self.timestamp(),
+            "url": f"https://api.github.com/repos/{repo_name}/issues/{number}"
+        }
+        return data
+
+    def reset_counts(self):
+        self.calls.clear()
@@ -0,0 +1,129 @@
+"""
+Measures how fast stored reports are turned into Report objects and how much memory they hold, over a synthetic
+dataset shaped like a full scan of the reports table (numbers come back from DynamoDB as Decimals).
+
+Usage: python -m bench.reports [-n 50000] [--seed 0] [--repeat 3]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from decimal import Decimal
+
+from lib.leaderboard import Leaderboard
+from lib.reports import Report
+
+IDENTIFIERS = ("AVR", "AFR", "WEB", "API", "TAI")
+WORDS = ("the", "init", "attack", "spell", "crashes", "when", "using", "a", "homebrew", "monster", "alias",
+         "character", "sheet", "import", "fails", "with", "damage", "roll", "advantage", "lair")
+
+
+def make_dataset(n, seed=0):
+    """Returns n report items as a table scan would: every number a Decimal."""
+    rng = random.Random(seed)
+
+    def text(words):
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+    items = []
+    for i in range(n):
+        is_bug = rng.random() < 0.6
+        identifier = rng.choice(IDENTIFIERS[0::2] if is_bug else IDENTIFIERS[1::2])
+        attachments = [{"author": Decimal(rng.getrandbits(60)), "message": text(rng.randint(5, 30)) or None,
+                        "veri": Decimal(rng.choice((-2, -1, 0, 1, 2)))}
+                       for _ in range(min(int(rng.expovariate(1 / 4)), 50))]
+        items.append({
+            "reporter": Decimal(rng.getrandbits(60)), "report_id": f"{identifier}-{i + 1}",
+            "title": text(rng.randint(3, 12)), "severity": Decimal(rng.choice((-1, 0, 1, 2, 3, 4, 5, 6))),
+            "verification": Decimal(rng.randint(-3, 5)), "upvotes": Decimal(rng.randint(0, 40)),
+            "downvotes": Decimal(rng.randint(0, 10)), "attachments": attachments,
+            "message": Decimal(rng.getrandbits(60)), "github_issue": Decimal(rng.randint(0, 2000)),
+            "github_repo": "avrae/avrae",
+            "subscribers": [Decimal(rng.getrandbits(60)) for _ in range(rng.randint(1, 5))],
+            "is_bug": is_bug, "is_automation": False, "pending": rng.random() < 0.02,
+            "thread_id": Decimal(0), "automation_name": None,
+            "voters": {str(a["author"]): a["veri"] for a in attachments if a["veri"]},
+        })
+    return items
+
+
+def load(items):
+    return [Report.from_dict(item) for item in items]
+
+
+def top_requests(reports, n=10):
+    """The /top workload: rank open feature requests by score."""
+    requests = (r for r in reports if not r.is_bug and r.severity >= 0)
+    return sorted(requests, key=lambda r: r.upvotes - r.downvotes, reverse=True)[:n]
+
+
+def run(n=50000, seed=0, repeat=3):
+    load_time = float('inf')
+    for _ in range(repeat):  # best of a few loads, each from freshly scanned items
+        reports = items = None
+        items = make_dataset(n, seed)
+        gc.collect()
+        start = time.perf_counter()
+        reports = load(items)
+        load_time = min(load_time, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    top_requests(reports)
+    top_time = time.perf_counter() - start
+
+    # /top now reads the leaderboard, which is loaded once and then kept current by commits
+    leaderboard = Leaderboard()
+    start = time.perf_counter()
+    leaderboard.load(entry for report in reports if (entry := report.get_leaderboard_entry()) is not None)
+    leaderboard_load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    leaderboard.top(10)
+    leaderboard_top_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for report in reports:
+        report.to_dict()
+    dump_time = time.perf_counter() - start
+
+    # memory held by a fresh load once the scanned items are gone, counting anything the reports kept from them
+    del reports, items
+    gc.collect()
+    tracemalloc.start()
+    items = make_dataset(n, seed)
+    reports = load(items)
+    del items
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        "reports": n,
+        "load_per_s": n / load_time,
+        "top_ms": top_time * 1000,
+        "leaderboard_load_ms": leaderboard_load_time * 1000,
+        "leaderboard_top_ms": leaderboard_top_time * 1000,
+        "to_dict_per_s": n / dump_time,
+        "held_mb": held / 1024 / 1024,
+        "bytes_per_report": held / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=50000, help="number of reports")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="loads to take the best time of")
+    args = parser.parse_args()
+
+    result = run(args.n, args.seed, args.repeat)
+    print(f"== {result['reports']} reports")
+    print(f"  load          {result['load_per_s']:>12,.0f} reports/s")
+    print(f"  /top (scan)   {result['top_ms']:>12,.1f} ms")
+    print(f"  /top (board)  {result['leaderboard_top_ms']:>12,.3f} ms, {result['leaderboard_load_ms']:,.1f} ms to load")
+    print(f"  to_dict       {result['to_dict_per_s']:>12,.0f} reports/s")
+    print(f"  memory held   {result['held_mb']:>12,.1f} MiB ({result['bytes_per_report']:,.0f} B/report)")
+
+
+if __name__ == '__main__':
+    main()
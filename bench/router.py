@@ -0,0 +1,87 @@
+"""
+Measures how many gateway messages per second the on_message listeners get through on a busy server, where almost
+none of the messages are meant for the bot. Runs against the in-memory stand-ins in bench.fakes.
+
+Usage: python -m bench.router [-n 100000] [--relevant 0.02]
+"""
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+import constants
+from bench.fakes import Sandbox
+from cogs.inline import Inline
+from cogs.reports import Reports
+
+CHATTER = (
+    "lol",
+    "has anyone tried the new homebrew?",
+    "!init add 12 Goblin -p",
+    "what's the best build for a level 5 paladin in #builds",
+    "```py\nprint('hello world')\n```",
+)
+# messages in listened-to channels that still aren't reports or submissions
+DISCUSSION = (
+    "is this a bug or intended?",
+    "feature requests go in the other channel",
+    "**Note:** this only happens on mobile",
+)
+
+
+def make_messages(sandbox, n, relevant=0.02, seed=0):
+    """Builds n messages; a ``relevant`` fraction are posted in listened-to channels or threads."""
+    rng = random.Random(seed)
+    author = SimpleNamespace(id=next(sandbox.ids), bot=False, display_name="bench")
+    listen_ids = [chan['id'] for chan in constants.BUG_LISTEN_CHANS]
+    forum_ids = [chan['id'] for chan in getattr(constants, "AUTOMATION_LISTEN_CHANS", [])]
+    messages = []
+    for _ in range(n):
+        if rng.random() < relevant:
+            if forum_ids and rng.random() < 0.5:
+                channel = SimpleNamespace(id=rng.getrandbits(60), parent_id=rng.choice(forum_ids))
+            else:
+                channel = SimpleNamespace(id=rng.choice(listen_ids))
+            content = rng.choice(DISCUSSION)
+        else:
+            channel = SimpleNamespace(id=rng.getrandbits(60))
+            if rng.random() < 0.3:  # threads elsewhere on the server
+                channel.parent_id = rng.getrandbits(60)
+            content = rng.choice(CHATTER)
+        messages.append(SimpleNamespace(author=author, channel=channel, content=content, attachments=[]))
+    return messages
+
+
+async def run(cogs, messages):
+    """Returns {cog name: messages per second} for each cog's on_message over messages."""
+    results = {}
+    for cog in cogs:
+        start = time.perf_counter()
+        for message in messages:
+            await cog.on_message(message)
+        elapsed = time.perf_counter() - start
+        results[type(cog).__name__] = len(messages) / elapsed if elapsed else 0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=100000, help="number of messages")
+    parser.add_argument("--relevant", type=float, default=0.02,
+                        help="fraction of messages posted in listened-to channels")
+    args = parser.parse_args()
+
+    with Sandbox() as sandbox:
+        cogs = [Reports(sandbox.bot), Inline(sandbox.bot)]
+        messages = make_messages(sandbox, args.n, args.relevant)
+        results = asyncio.run(run(cogs, messages))
+        print(f"== {args.n} messages, {args.relevant:.0%} in listened-to channels")
+        for name, rate in results.items():
+            print(f"  {name:<10} {rate:>12,.0f} messages/s")
+        print(f"  router      {cogs[0].router.stats()}")
+        print(f"  downstream  {dict(sandbox.calls)}")
+
+
+if __name__ == '__main__':
+    main()
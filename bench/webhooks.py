@@ -0,0 +1,238 @@
+"""
+Replays synthetic or recorded GitHub webhooks against the Web cog's aiohttp app, with Discord, DynamoDB and GitHub
+replaced by the in-memory stand-ins in bench.fakes. Reports throughput, handler latency percentiles and downstream
+call counts per scenario.
+
+Usage: python -m bench.webhooks [--scenario NAME] [-n 80] [--rate 0] [--latency 0] [--replay events.jsonl]
+"""
+import argparse
+import asyncio
+import copy
+import itertools
+import json
+import time
+import uuid
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import constants
+from bench.fakes import FakeMessage, Sandbox
+from lib.reports import Attachment, Report
+from web.web import Web
+
+BUG_REPO = "avrae/avrae"
+AUTOMATION_REPO = "avrae/avrae-data-entry"
+USER_AGENT = "GitHub-Hookshot/bench"
+# the coalescing window used while benchmarking, so runs don't wait on the production window
+BENCH_ISSUE_EVENT_WINDOW = 0.05
+
+
+def percentile(values, p):
+    """Returns the nearest-rank p-th percentile of values, or 0 if there are none."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+# ==== seeding ====
+def seed_report(sandbox, report_id, is_bug=True, is_automation=False, labels=("bug",)):
+    """Creates a tracked report with a GitHub issue/PR and a tracker message."""
+    repo = AUTOMATION_REPO if is_automation else BUG_REPO
+    issue = sandbox.add_issue(repo, f"{report_id} Synthetic report", "Body", list(labels))
+    reporter = sandbox.add_member(next(sandbox.ids))
+    report = Report(reporter.id, report_id, "Synthetic report", 6, 0, [Attachment(reporter.id, "Body")], None,
+                    github_issue=issue['number'], github_repo=repo, subscribers=[reporter.id], is_bug=is_bug,
+                    is_automation=is_automation, thread_id=next(sandbox.ids) if is_automation else None,
+                    automation_name="Synthetic Automation" if is_automation else None)
+    if not is_automation:
+        channel = report.get_channel(sandbox.bot)
+        message = FakeMessage(sandbox, channel, next(sandbox.ids))
+        channel.messages[message.id] = message
+        report.message = message.id
+    report.commit()
+    return issue
+
+
+def issue_event(sandbox, repo, number, action, sender="octocat"):
+    return "issues", {
+        "action": action, "issue": copy.deepcopy(sandbox.issues[(repo, number)]),
+        "repository": {"full_name": repo}, "sender": {"login": sender}
+    }
+
+
+def comment_event(sandbox, repo, number, body, user="octocat"):
+    return "issue_comment", {
+        "action": "created", "issue": copy.deepcopy(sandbox.issues[(repo, number)]),
+        "comment": {"body": body, "user": {"login": user}},
+        "repository": {"full_name": repo}, "sender": {"login": user}
+    }
+
+
+# ==== scenarios: each seeds the sandbox and returns the events to replay ====
+def scenario_relabel(sandbox, n):
+    """A triage pass: three labels are applied one by one to each of n bug reports."""
+    events = []
+    for i in range(n):
+        issue = seed_report(sandbox, f"AVR-{i + 1:03}")
+        for label in ("P2: High", "longterm", "help wanted"):
+            issue['labels'].append({"name": label})
+            events.append(issue_event(sandbox, BUG_REPO, issue['number'], "labeled"))
+    return events
+
+
+def scenario_release(sandbox, n):
+    """A release closing n issues at once."""
+    issues = [seed_report(sandbox, f"AVR-{i + 1:03}") for i in range(n)]
+    events = []
+    for issue in issues:
+        issue['state'] = "closed"
+        events.append(issue_event(sandbox, BUG_REPO, issue['number'], "closed", sender=constants.OWNER_GITHUB))
+    return events
+
+
+def scenario_open(sandbox, n):
+    """n new issues opened on GitHub, each followed by its labeled event."""
+    events = []
+    for i in range(n):
+        issue = sandbox.add_issue(BUG_REPO, f"Synthetic issue {i}", "Body", ["bug"])
+        events.append(issue_event(sandbox, BUG_REPO, issue['number'], "opened"))
+        events.append(issue_event(sandbox, BUG_REPO, issue['number'], "labeled"))
+    return events
+
+
+def scenario_comments(sandbox, n):
+    """n comments spread over tracked bug reports."""
+    issues = [seed_report(sandbox, f"AVR-{i + 1:03}") for i in range(max(n // 4, 1))]
+    return [comment_event(sandbox, BUG_REPO, issue['number'], f"Comment {i}")
+            for i, issue in zip(range(n), itertools.cycle(issues))]
+
+
+def scenario_automation(sandbox, n):
+    """n CI result comments on automation submission PRs."""
+    issues = [seed_report(sandbox, f"AUT-{i + 1:03}", is_bug=False, is_automation=True, labels=("automation",))
+              for i in range(n)]
+    return [comment_event(sandbox, AUTOMATION_REPO, issue['number'],
+                          "AUTOMATION_TEST_RESULT: FAIL\nReason: damage without a target", user="github-actions")
+            for issue in issues]
+
+
+SCENARIOS = {
+    "relabel": scenario_relabel,
+    "release": scenario_release,
+    "open": scenario_open,
+    "comments": scenario_comments,
+    "automation": scenario_automation,
+}
+
+
+def load_replay(sandbox, path):
+    """Loads recorded events from a JSONL file of {"event": ..., "payload": ...} lines."""
+    events = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            payload = record['payload']
+            if 'issue' in payload:  # make the issue known to the fake GitHub
+                key = (payload['repository']['full_name'], payload['issue']['number'])
+                sandbox.issues.setdefault(key, copy.deepcopy(payload['issue']))
+            events.append((record['event'], payload))
+    return events
+
+
+# ==== driver ====
+async def replay(sandbox, events, rate=0):
+    """
+    POSTs events to a fresh Web cog's app, ``rate`` per second (0 sends them all at once), then waits for
+    coalesced issue events to be reconciled. Returns the result dict.
+    """
+    cog = Web(sandbox.bot)
+    cog.issue_events.window = BENCH_ISSUE_EVENT_WINDOW
+    reconcile_times = []
+    reconcile = cog.issue_events.handler
+
+    async def timed_reconcile(key, burst):
+        start = time.perf_counter()
+        await reconcile(key, burst)
+        reconcile_times.append(time.perf_counter() - start)
+
+    cog.issue_events.handler = timed_reconcile
+
+    latencies = {}
+    statuses = []
+    async with TestClient(TestServer(cog.app)) as client:
+        async def post(event_type, payload):
+            headers = {"User-Agent": USER_AGENT, "X-GitHub-Event": event_type,
+                       "X-GitHub-Delivery": str(uuid.uuid4())}
+            start = time.perf_counter()
+            resp = await client.post("/github", json=payload, headers=headers)
+            latencies.setdefault(event_type, []).append(time.perf_counter() - start)
+            statuses.append(resp.status)
+
+        sandbox.reset_counts()
+        start = time.perf_counter()
+        tasks = []
+        for event_type, payload in events:
+            tasks.append(asyncio.ensure_future(post(event_type, payload)))
+            if rate:
+                await asyncio.sleep(1 / rate)
+        await asyncio.gather(*tasks)
+        await asyncio.sleep(BENCH_ISSUE_EVENT_WINDOW)
+        await cog.issue_events.flush_all()
+        await Report.render_scheduler.flush_all()
+        elapsed = time.perf_counter() - start
+
+    if reconcile_times:
+        latencies["issues (reconcile)"] = reconcile_times
+    return {
+        "events": len(events),
+        "errors": sum(1 for status in statuses if status >= 400),
+        "elapsed": elapsed,
+        "throughput": len(events) / elapsed if elapsed else 0,
+        "latency_ms": {event_type: {f"p{p}": percentile(values, p) * 1000 for p in (50, 95, 99)}
+                       for event_type, values in latencies.items()},
+        "calls": dict(sorted(sandbox.calls.items())),
+    }
+
+
+def run_scenario(name, n=80, rate=0, latency=0, replay_path=None):
+    with Sandbox(latency=latency) as sandbox:
+        if replay_path:
+            events = load_replay(sandbox, replay_path)
+        else:
+            events = SCENARIOS[name](sandbox, n)
+        return asyncio.run(replay(sandbox, events, rate))
+
+
+def format_result(name, result):
+    lines = [f"== {name}: {result['events']} events in {result['elapsed']:.2f}s "
+             f"({result['throughput']:.1f} events/s, {result['errors']} errors)"]
+    for event_type, pcts in result['latency_ms'].items():
+        lines.append(f"  {event_type:<20} " + "  ".join(f"{p}={ms:.1f}ms" for p, ms in pcts.items()))
+    for call, count in result['calls'].items():
+        lines.append(f"  {call:<28} {count}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    parser.add_argument("-n", type=int, default=80, help="scenario size (issues or events)")
+    parser.add_argument("--rate", type=float, default=0, help="events per second (0 floods)")
+    parser.add_argument("--latency", type=float, default=0, help="simulated downstream round trip, seconds")
+    parser.add_argument("--replay", help="JSONL file of recorded events to replay instead of a scenario")
+    args = parser.parse_args()
+
+    if args.replay:
+        print(format_result(args.replay, run_scenario(None, rate=args.rate, latency=args.latency,
+                                                      replay_path=args.replay)))
+        return
+    names = SCENARIOS if args.scenario == "all" else [args.scenario]
+    for name in names:
+        print(format_result(name, run_scenario(name, args.n, args.rate, args.latency)))
+
+
+if __name__ == '__main__':
+    main()
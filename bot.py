@@ -12,7 +12,7 @@ from disnake.ext.commands import CheckFailure, CommandInvokeError, CommandNotFou
 
 import constants
 from lib.github import GitHubClient
-from lib.reports import ReportException
+from lib.reports import Report, ReportException
 
 ORG_NAME = os.environ.get("ORG_NAME", "avrae")
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
@@ -23,6 +23,10 @@ class Taine(commands.AutoShardedBot):
     def __init__(self, *args, **kwargs):
         super(Taine, self).__init__(*args, **kwargs)
 
+    async def close(self):
+        await Report.render_scheduler.flush_all()  # don't drop the latest votes on the floor
+        await super(Taine, self).close()
+
 
 intents = Intents.all()
 bot = Taine(
@@ -3,10 +3,11 @@ import re
 from disnake.ext import commands
 
 import constants
-from lib.reports import Report, ReportException
+from lib.reports import Report
 
 REPORT_ID_RE = re.compile(r'#(\w{3}-\d{3,})')  # e.g. #AVR-001, #AFR-120
 ISSUE_NUM_RE = re.compile(r'##(\d+)')  # e.g. ##1127, ##100
+MAX_EMBEDS = 10  # the most embeds discord allows in one message
 
 
 class Inline(commands.Cog):
@@ -15,29 +16,33 @@ class Inline(commands.Cog):
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author.bot:
+        if message.author.bot or '#' not in message.content:
             return
 
-        for match in REPORT_ID_RE.finditer(message.content):
-            try:
-                report = Report.from_id(match.group(1))
-            except ReportException:
-                return
-            await self.send_report(message.channel, report)
+        reports = self.find_reports(message.content)
+        if reports:
+            await message.channel.send(embeds=[self.get_inline_embed(report) for report in reports[:MAX_EMBEDS]])
 
-        for match in ISSUE_NUM_RE.finditer(message.content):
-            try:
-                report = Report.from_github(constants.DEFAULT_REPO, int(match.group(1)))
-            except ReportException:
-                return
-            await self.send_report(message.channel, report)
+    @staticmethod
+    def find_reports(content):
+        """Returns the reports mentioned in content, in order of mention. Unknown reports are skipped."""
+        report_ids = [match.group(1).upper() for match in REPORT_ID_RE.finditer(content)]
+        found = Report.from_ids(report_ids) if report_ids else {}
+        reports = {report_id: found[report_id] for report_id in report_ids if report_id in found}
+
+        issue_nums = list(dict.fromkeys(int(match.group(1)) for match in ISSUE_NUM_RE.finditer(content)))
+        found = Report.from_github_many(constants.DEFAULT_REPO, issue_nums) if issue_nums else {}
+        for issue_num in issue_nums:
+            if issue_num in found:
+                reports.setdefault(found[issue_num].report_id, found[issue_num])
+        return list(reports.values())
 
     @staticmethod
-    async def send_report(channel, report):
+    def get_inline_embed(report):
         embed = report.get_embed()
-        embed.set_footer()  # clear it - cannot vote with reactions in inline messages
+        embed.remove_footer()  # clear it - cannot vote from inline messages
         embed.description = report.attachments[0].message
-        await channel.send(embed=embed)
+        return embed
 
 
 def setup(bot):
@@ -1,5 +1,4 @@
 import copy
-import time
 
 import disnake
 from boto3.dynamodb.conditions import Attr
@@ -7,7 +6,10 @@ from disnake.ext import commands
 
 import constants
 from lib import db, checks
+from lib.bulk import BulkJob
 from lib.db import query
+from lib.monitor import monitor
+from lib.release import release_reports
 from lib.reports import Report, ReportException, get_next_report_num
 from utils import DiscordEmbedTextPaginator
 
@@ -16,22 +18,28 @@ class Owner(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        monitor.start()
+
+    def cog_unload(self):
+        monitor.stop()
+
     @commands.command(aliases=['close'])
     @checks.is_owner()
     async def resolve(self, ctx, _id, *, msg=''):
         """Owner only - Resolves a report."""
-        report = Report.from_id(_id)
-        await report.resolve(ctx, msg)
-        report.commit()
+        async with Report.locked(_id) as report:
+            await report.resolve(ctx, msg)
+            report.commit()
         await ctx.send(f"Resolved `{report.report_id}`: {report.title}.")
 
     @commands.command(aliases=['open'])
     @checks.is_owner()
     async def unresolve(self, ctx, _id, *, msg=''):
         """Owner only - Unresolves a report."""
-        report = Report.from_id(_id)
-        await report.unresolve(ctx, msg)
-        report.commit()
+        async with Report.locked(_id) as report:
+            await report.unresolve(ctx, msg)
+            report.commit()
         await ctx.send(f"Unresolved `{report.report_id}`: {report.title}.")
 
     @commands.command(aliases=['reassign'])
@@ -42,18 +50,20 @@ class Owner(commands.Cog):
         identifier = identifier.upper()
         id_num = get_next_report_num(identifier)
 
-        report = Report.from_id(report_id)
-        new_report = copy.copy(report)
-        await report.resolve(ctx, f"Reassigned as `{identifier}-{id_num}`.", False)
-        report.commit()
+        async with Report.locked(report_id) as report:
+            new_report = copy.copy(report)
+            await report.resolve(ctx, f"Reassigned as `{identifier}-{id_num}`.", False)
+            report.commit()
 
         new_report.report_id = f"{identifier}-{id_num}"
-        msg = await new_report.setup_message(self.bot)
-        new_report.message = msg.id
-        if new_report.github_issue:
-            await new_report.update_labels()
-            await new_report.edit_title(new_report.title)
-        new_report.commit()
+        new_report.lease_token = 0  # it's written under its own leases from now on
+        async with Report.locked(new_report.report_id, new=new_report):
+            msg = await new_report.setup_message(self.bot)
+            new_report.message = msg.id
+            if new_report.github_issue:
+                await new_report.update_labels()
+                await new_report.edit_title(new_report.title)
+            new_report.commit()
         await ctx.send(f"Reassigned {report.report_id} as {new_report.report_id}.")
 
     @commands.command()
@@ -61,29 +71,28 @@ class Owner(commands.Cog):
     async def rename(self, ctx, report_id, *, name):
         """Owner only - Changes the title of a report."""
 
-        report = Report.from_id(report_id)
-        if report.github_issue:
-            await report.edit_title(name)
-        else:
-            report.title = name
-        await report.update(ctx)
-        report.commit()
+        async with Report.locked(report_id) as report:
+            if report.github_issue:
+                await report.edit_title(name)
+            else:
+                report.title = name
+            await report.update(ctx)
+            report.commit()
         await ctx.send(f"Renamed {report.report_id} as {report.title}.")
 
     @commands.command(aliases=['pri'])
     @checks.is_owner()
     async def priority(self, ctx, _id, pri: int, *, msg=''):
         """Owner only - Changes the priority of a report."""
-        report = Report.from_id(_id)
-
-        report.severity = pri
-        if msg:
-            await report.addnote(ctx.message.author.id, f"Priority changed to {pri} - {msg}", ctx)
+        async with Report.locked(_id) as report:
+            report.severity = pri
+            if msg:
+                await report.addnote(ctx.message.author.id, f"Priority changed to {pri} - {msg}", ctx)
 
-        if report.github_issue:
-            await report.update_labels()
-        await report.update(ctx)
-        report.commit()
+            if report.github_issue:
+                await report.update_labels()
+            await report.update(ctx)
+            report.commit()
         await ctx.send(f"Changed priority of `{report.report_id}`: {report.title} to P{pri}.")
 
     @commands.group(aliases=['pend'], invoke_without_command=True)
@@ -93,13 +102,12 @@ class Owner(commands.Cog):
         not_found = 0
         for _id in reports:
             try:
-                report = Report.from_id(_id.strip(', '))
+                async with Report.locked(_id.strip(', ')) as report:
+                    report.pend()
+                    await report.update(ctx)
+                    report.commit()
             except ReportException:
                 not_found += 1
-                continue
-            report.pend()
-            await report.update(ctx)
-            report.commit()
         if not not_found:
             await ctx.send(f"Marked {len(reports)} reports as patch pending.")
         else:
@@ -122,27 +130,30 @@ class Owner(commands.Cog):
         not_found = 0
         for _id in reports:
             try:
-                report = Report.from_id(_id.strip(', '))
+                async with Report.locked(_id.strip(', ')) as report:
+                    report.unpend()
+                    await report.update(ctx)
+                    report.commit()
             except ReportException:
                 not_found += 1
-                continue
-            report.unpend()
-            await report.update(ctx)
-            report.commit()
         if not not_found:
             await ctx.send(f"Unpended {len(reports)} reports.")
         else:
             await ctx.send(f"Unpended {len(reports) - not_found} reports. {not_found} reports were not found.")
 
-    async def _generate_changelog(self, build_id, msg, coro_for_each=None):
-        """Generates a changelog, optionally running a coro for each report with the report as the sole arg."""
-        changelog = DiscordEmbedTextPaginator()
-
+    @staticmethod
+    async def _pending_reports():
+        reports = []
         async for report_data in query(db.reports, Attr("pending").eq(True)):  # find all pending=True reports
-            report = Report.from_dict(report_data)
-            if coro_for_each:
-                await coro_for_each(report)
+            reports.append(Report.from_dict(report_data))
+        return reports
+
+    @staticmethod
+    def _generate_changelog(build_id, msg, reports):
+        """Generates a changelog of the given reports."""
+        changelog = DiscordEmbedTextPaginator()
 
+        for report in reports:
             action = "Fixed"
             if not report.is_bug:
                 action = "Added"
@@ -161,45 +172,88 @@ class Owner(commands.Cog):
     @checks.is_owner()
     async def update(self, ctx, build_id, *, msg=""):
         """Owner only - To be run after an update. Resolves all -P2 reports."""
-
-        async def resolver(report):
-            await report.resolve(ctx, ignore_closed=True)
-            report.pending = False
-            report.commit()
-
-        embed = await self._generate_changelog(build_id, msg, resolver)
-        await ctx.send(embed=embed)
+        result = await release_reports(ctx, await self._pending_reports())
+        # only what was actually released goes in the changelog; the rest is still pending for the next build
+        await ctx.send(embed=self._generate_changelog(build_id, msg, result.released))
+        if result.failures:
+            failed = '\n'.join(f"`{report_id}`: {e!r}" for report_id, e in sorted(result.failures.items()))
+            await ctx.author.send(f"Released {len(result.released)} reports of build {build_id}. "
+                                  f"These could not be resolved and are still pending:\n{failed}"[:2000])
         await ctx.message.delete()
 
     @commands.command()
     @checks.is_owner()
     async def dryrun(self, ctx, build_id, *, msg=""):
         """Owner only - changelog dryrun."""
-        embed = await self._generate_changelog(build_id, msg)
-        await ctx.send(embed=embed)
+        await ctx.send(embed=self._generate_changelog(build_id, msg, await self._pending_reports()))
 
     @commands.command()
     @checks.is_owner()
     async def reset_messages(self, ctx, yes):
-        """Owner only - recreate all report messages. Takes some time! Pass "yes" as first arg."""
-
-        if yes != 'yes':
+        """
+        Owner only - recreate all report messages. Takes some time! Pass "yes" as first arg.
+        If an earlier run was interrupted, this resumes it; pass "restart" instead to start over.
+        """
+        if yes not in ('yes', 'restart'):
             return
 
         await ctx.trigger_typing()
 
-        start = time.monotonic()
         reports = []
         async for data in query(db.reports, Attr("severity").gte(0)):
             reports.append(Report.from_dict(data))
+        reports.sort(key=lambda r: r.report_id)
+
+        status = await ctx.send(f"Recreating {len(reports)} report messages...")
+
+        async def reset_message(item):
+            async with Report.locked(item.report_id) as report:
+                await report.setup_message(self.bot)
+                report.commit()
+
+        async def show_progress(progress):
+            await status.edit(content=f"Recreating report messages: {progress.format()}")
+
+        job = BulkJob("reset_messages", reset_message, item_id=lambda r: r.report_id,
+                      key=lambda r: r.get_channel(self.bot).id, on_progress=show_progress)
+        if yes == 'restart':
+            job.checkpoint.clear()
+        progress = await job.run(reports)
+
+        out = f"Done, recreated {progress.done} messages in {progress.elapsed:.1f} seconds"
+        if progress.resumed:
+            out = f"{out} ({progress.resumed} were already done by an earlier run)"
+        if job.failures:
+            failed = ', '.join(f"`{report_id}`" for report_id in sorted(job.failures)[:20])
+            if len(job.failures) > 20:
+                failed = f"{failed}, ..."
+            out = f"{out}. {len(job.failures)} failed and will be retried on the next run: {failed}"
+        await status.edit(content=f"Recreating report messages: {progress.format()}")
+        await ctx.send(out)
 
-        for report in sorted(reports, key=lambda r: r.report_id):
-            await report.setup_message(self.bot)
-            report.commit()
-
-        end = time.monotonic()
-        t = end - start
-        await ctx.send(f'done, setup {len(reports)} messages in {t} seconds')
+    @commands.command()
+    @checks.is_owner()
+    async def stalls(self, ctx, n='5'):
+        """Owner only - Shows where the event loop was blocked the longest. Pass "reset" to start counting over."""
+        if n == 'reset':
+            monitor.reset()
+            return await ctx.send("Cleared the event loop stall stats.")
+        if not n.isdigit() or int(n) < 1:
+            return await ctx.send("Usage: `~stalls [number of sites|reset]`")
+
+        stats = monitor.stats()
+        embed = disnake.Embed(title="Event Loop Stalls")
+        paginator = DiscordEmbedTextPaginator()
+        paginator.add(f"{stats['stalls']} stalls over {monitor.threshold * 1000:.0f} ms "
+                      f"({stats['stalled_s']:.1f} s blocked) in {stats['samples']} samples.\n"
+                      f"Lag: p50 {stats['lag_p50_s'] * 1000:.1f} ms, p99 {stats['lag_p99_s'] * 1000:.1f} ms, "
+                      f"max {stats['lag_max_s'] * 1000:.0f} ms.")
+        for site in monitor.top_sites(min(int(n), 8)):  # embeds top out at 6000 characters
+            stack = '\n'.join(site.stack[-3:])[-400:]
+            paginator.add(f"**`{site.site}`**: {site.count} stalls, {site.total * 1000:.0f} ms total, "
+                          f"{site.max * 1000:.0f} ms max\n```\n{stack}\n```")
+        paginator.write_to(embed)
+        await ctx.send(embed=embed)
 
 
 def setup(bot):
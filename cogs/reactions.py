@@ -4,8 +4,10 @@ import disnake
 from disnake.ext import commands
 
 import constants
+from lib import db
 from lib.misc import ContextProxy
-from lib.reports import DOWNVOTE_REACTION, INFO_REACTION, Report, ReportException, THREAD_REACTION, UPVOTE_REACTION
+from lib.reports import DOWNVOTE_ACTION, DOWNVOTE_REACTION, INFO_ACTION, INFO_REACTION, Report, ReportException, \
+    ReportNotFound, THREAD_ACTION, THREAD_REACTION, UPVOTE_ACTION, UPVOTE_REACTION, parse_button_id
 
 README_MSG_ID = 590642451266535461
 BUG_HUNTER_REACTION_ID = 454031039375867925
@@ -13,6 +15,12 @@ BUG_HUNTER_ROLE_ID = 469137394742853642
 ACCEPT_REACTION_ID = 434140566834511872
 ACCEPT_ROLE_ID = 641756218955792394
 NO_REPORTS_ROLE_ID = 513457946366312478
+REACTION_ACTIONS = {
+    UPVOTE_REACTION: UPVOTE_ACTION,
+    DOWNVOTE_REACTION: DOWNVOTE_ACTION,
+    INFO_REACTION: INFO_ACTION,
+    THREAD_REACTION: THREAD_ACTION,
+}
 log = logging.getLogger(__name__)
 
 
@@ -30,7 +38,8 @@ class Reactions(commands.Cog):
         member = server.get_member(event.user_id)
         emoji = event.emoji
 
-        await self.handle_reaction(msg_id, member, emoji)
+        with db.operation("reaction"):
+            await self.handle_reaction(msg_id, member, emoji)
 
     async def handle_reaction(self, msg_id, member, emoji):
         if msg_id == README_MSG_ID:
@@ -39,7 +48,9 @@ class Reactions(commands.Cog):
             elif emoji.id == ACCEPT_REACTION_ID:
                 return await self.toggle_role(member, id=ACCEPT_ROLE_ID)
 
-        if emoji.name not in (UPVOTE_REACTION, DOWNVOTE_REACTION, INFO_REACTION, THREAD_REACTION):
+        # tracker messages posted before they had buttons are still voted on with reactions
+        action = REACTION_ACTIONS.get(emoji.name)
+        if action is None:
             return
 
         try:
@@ -50,33 +61,86 @@ class Reactions(commands.Cog):
         if member.bot:
             return
 
+        if action == INFO_ACTION:
+            await member.send(embed=report.get_embed(True, guild=member.guild))
+        elif action == THREAD_ACTION:
+            await self.ensure_report_thread(report, msg_id, member)
+        else:
+            _, error = await self.vote(report.report_id, member, upvote=action == UPVOTE_ACTION)
+            if error:
+                await member.send(error)
+
+    @commands.Cog.listener()
+    async def on_button_click(self, inter):
+        with db.operation("button"):
+            await self.handle_button(inter)
+
+    async def handle_button(self, inter):
+        parsed = parse_button_id(inter.component.custom_id)
+        if parsed is None:
+            return
+        action, report_id = parsed
+
+        if action in (UPVOTE_ACTION, DOWNVOTE_ACTION):
+            await inter.response.defer(ephemeral=True)  # voting can reach GitHub, which may outlast the 3s deadline
+            upvote = action == UPVOTE_ACTION
+            try:
+                report, error = await self.vote(report_id, inter.author, upvote=upvote)
+            except ReportNotFound:
+                return await inter.followup.send("This report no longer exists.", ephemeral=True)
+            except ReportException as e:  # e.g. it's being changed elsewhere
+                return await inter.followup.send(str(e), ephemeral=True)
+            if inter.author.id in constants.OWNER_IDS:
+                done = "Accepted" if upvote else "Denied"
+            else:
+                done = "Upvoted" if upvote else "Downvoted"
+            return await inter.followup.send(error or f"{done} `{report.report_id}`.", ephemeral=True)
+
         try:
-            if emoji.name == UPVOTE_REACTION:
-                if member.id in constants.OWNER_IDS:
-                    await report.force_accept(ContextProxy(self.bot))
-                else:
-                    await report.upvote(member.id, '', ContextProxy(self.bot))
-            elif emoji.name == DOWNVOTE_REACTION:
-                if member.id in constants.OWNER_IDS:
-                    log.info(f"Force denying {report.title}")
-                    await report.force_deny(ContextProxy(self.bot), member.id)
-                    report.commit()
-                    return
+            report = await Report.load(report_id)
+        except ReportNotFound:
+            return await inter.response.send_message("This report no longer exists.", ephemeral=True)
+
+        if action == INFO_ACTION:
+            await inter.response.send_message(embed=report.get_embed(True, guild=inter.guild), ephemeral=True)
+        elif action == THREAD_ACTION:
+            await inter.response.defer(ephemeral=True)
+            thread = await self.ensure_report_thread(report, inter.message.id, inter.author)
+            if thread is None:
+                return await inter.followup.send(f"Couldn't open a thread for `{report.report_id}`, try again later.",
+                                                 ephemeral=True)
+            await inter.followup.send(f"Discuss `{report.report_id}` in {thread.mention}.", ephemeral=True)
+
+    async def vote(self, report_id, member, upvote):
+        """
+        Upvotes or downvotes a report as a member, subscribing them to it; owners force accept or deny it instead.
+        Returns the report and why the vote wasn't counted, or None if it was. Raises ReportException if the report
+        can't be loaded.
+        """
+        async with Report.locked(report_id) as report:
+            error = None
+            try:
+                if upvote:
+                    if member.id in constants.OWNER_IDS:
+                        await report.force_accept(ContextProxy(self.bot))
+                    else:
+                        await report.upvote(member.id, '', ContextProxy(self.bot))
                 else:
-                    await report.downvote(member.id, '', ContextProxy(self.bot))
-            elif emoji.name == INFO_REACTION:
-                await member.send(embed=report.get_embed(True, guild=member.guild))
-                return
-            elif emoji.name == THREAD_REACTION:
-                await self.ensure_report_thread(report, msg_id, member)
-                return
-        except ReportException as e:
-            await member.send(str(e))
-
-        if member.id not in report.subscribers and member.id not in constants.OWNER_IDS:
-            report.subscribers.append(member.id)
-        report.commit()
-        await report.update(ContextProxy(self.bot))
+                    if member.id in constants.OWNER_IDS:
+                        log.info(f"Force denying {report.title}")
+                        await report.force_deny(ContextProxy(self.bot), member.id)
+                        report.commit()
+                        return report, None
+                    else:
+                        await report.downvote(member.id, '', ContextProxy(self.bot))
+            except ReportException as e:
+                error = str(e)
+
+            if member.id not in report.subscribers and member.id not in constants.OWNER_IDS:
+                report.subscribers.append(member.id)
+            report.commit()
+            await report.update(ContextProxy(self.bot))
+        return report, error
 
     @staticmethod
     async def toggle_role(member, **kwargs):
@@ -93,15 +157,18 @@ class Reactions(commands.Cog):
     async def ensure_report_thread(self, report, message_id, member):
         """
         Ensures that a public thread exists on the given message, and the given member is a member of that thread.
-        Deletes any "thread created" system messages.
+        Deletes any "thread created" system messages. Returns the thread, or None if it couldn't be created.
         """
         thread = await report.get_thread(self.bot, unarchive=True, create=True, message_id=message_id)
+        if thread is None:
+            return None
 
         try:
             # add the user
             await thread.add_user(member)
         except disnake.HTTPException:
             pass
+        return thread
 
 
 def setup(bot):
@@ -1,34 +1,29 @@
-import json
 import random
 import logging
 import re
-import yaml
 from typing import Any, Awaitable, Callable, Optional, Protocol
 
 import cachetools
 import disnake
-from automation_common import validation
-from automation_common.validation.utils import format_validation_error
 from boto3.dynamodb.conditions import Attr
 from disnake.ext import commands
-from pydantic import ValidationError
 
 import constants
-from lib import db
+from lib import db, dedup, metrics
 from lib.db import query, query_sync
 from lib.misc import ContextProxy, search_and_select
-from lib.reports import Attachment, Report, get_next_report_num
+from lib.reports import Attachment, Report, ReportNotFound, get_next_report_num
+from lib.routing import MessageRouter
+from lib.submissions import MAX_SUBMISSION_BYTES, SubmissionTooLarge, SubmissionValidator, read_attachment
 
 
 BUG_RE = re.compile(r"\**What is the [Bb]ug\?\**:?\s*(.+?)(\n|$)")
 FEATURE_RE = re.compile(r"\**Feature [Rr]equest\**:?\s*(.+?)(\n|$)")
+REPORT_PREFIXES = ("What is the ", "Feature ")
 AUTOMATION_HEADER_RE = re.compile(r"^\**Automation [Ss]ubmission\**:?\s*$")
 CODE_BLOCK_RE = re.compile(r"^```(?:json|yaml|yml)?\s*\n?|\n?```$", re.IGNORECASE)
-# Strips the trailing "(type=...)" machine-readable detail from each validation error line,
-# leaving the human-readable message. Anchored to end-of-line and greedy so nested parens
-# in the error context (e.g. permitted=('a', 'b')) are consumed too.
-VALIDATION_TYPE_RE = re.compile(r"\s*\(type=[^\n]*\)\s*$", re.MULTILINE)
-VALID_ATTACHMENT_EXTENSIONS = ('.json', '.yaml', '.yml', '.txt')
+VALID_ATTACHMENT_EXTENSIONS = ('.json', '.yaml', '.yml', '.txt', '.zip')
+PUSHED_SUBMISSION_CACHE_SIZE = 1000
 
 
 # ==== typing ====
@@ -81,207 +76,346 @@ class Reports(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.router = MessageRouter()
+        for chan in constants.BUG_LISTEN_CHANS:
+            self.router.add(chan['id'], self.on_report_message, chan)
+        # forum posts each get their own channel ID, so match on the parent channel
+        for chan in getattr(constants, "AUTOMATION_LISTEN_CHANS", []):
+            self.router.add(chan['id'], self.on_automation_message, chan, threads=True)
+        metrics.register("message_router", self.router.stats)
+        self.validator = SubmissionValidator()
+        # an automation's own submission branch -> content hash of the file last pushed for it, to its own PR or a
+        # batch's; only consulted while that PR is open
+        self.pushed_submissions = cachetools.LRUCache(maxsize=PUSHED_SUBMISSION_CACHE_SIZE)
+        metrics.register("automation_validation", self.validator.stats)
+
+    def cog_unload(self):
+        self.validator.shutdown()
 
     # ==== event listeners ====
     @commands.Cog.listener()
     async def on_message(self, message):
         if message.author.bot:
             return
-        
-        identifier = None
-        repo = None
-        is_bug = None
+        await self.router.dispatch(message)
+
+    # keep Report.thread_cache in step with threads created, (un)archived or deleted elsewhere
+    @commands.Cog.listener()
+    async def on_thread_create(self, thread):
+        Report.remember_thread(thread)
+
+    @commands.Cog.listener()
+    async def on_raw_thread_update(self, thread):
+        Report.remember_thread(thread)
 
-        feature_match = FEATURE_RE.match(message.content)
-        bug_match = BUG_RE.match(message.content)
-        match = None
+    @commands.Cog.listener()
+    async def on_raw_thread_delete(self, payload):
+        Report.forget_thread(payload.thread_id)
 
-        if feature_match:
+    async def on_report_message(self, message, chan):
+        """Opens a bug report or feature request from a message in one of the BUG_LISTEN_CHANS."""
+        # cheap guard: both patterns start with optional asterisks, then one of these prefixes
+        if not message.content.lstrip('*').startswith(REPORT_PREFIXES):
+            return
+        if feature_match := FEATURE_RE.match(message.content):
             match = feature_match
             is_bug = False
-        elif bug_match:
+        elif bug_match := BUG_RE.match(message.content):
             match = bug_match
             is_bug = True
+        else:
+            return
+        identifier = chan['identifier']
+        repo = chan['repo']
 
-        # --- Check for regular bug/feature channels ---
-        for chan in constants.BUG_LISTEN_CHANS:
-            if message.channel.id == chan['id']:
-                identifier = chan['identifier']
-                repo = chan['repo']
+        title = match.group(1).strip(" *.\n")
+        report_num = get_next_report_num(identifier)
+        report_id = f"{identifier}-{report_num}"
+        attach = "\n" + '\n'.join(f"\n{'!' if item.url.lower().endswith(('.png', '.jpg', '.gif')) else ''}"
+                                  f"[{item.filename}]({item.url})" for item in message.attachments)
 
-        # --- Check for new Automation submissions ---
-        for chan in getattr(constants, "AUTOMATION_LISTEN_CHANS", []):
+        report = await Report.new(
+            message.author.id, report_id, title,
+            [Attachment(message.author.id, message.content + attach)], is_bug=is_bug, repo=repo)
+
+        async with Report.locked(report_id, new=report):
+            await report.setup_message(self.bot)
+            report.commit()
+        await message.add_reaction(random.choice(constants.REACTIONS))
+
+    async def on_automation_message(self, message, chan):
+        """Handles an automation submission posted in a thread of one of the AUTOMATION_LISTEN_CHANS."""
+        # Check if this is an automation submission (header on first line)
+        lines = message.content.strip().split('\n', 1)
+        first_line = lines[0].strip()
+
+        # If first line doesn't match header, it's discussion - but it may still be a report
+        if not AUTOMATION_HEADER_RE.match(first_line):
+            await self.on_report_message(message, chan)
+            return
+
+        # Header matched - this is a submission attempt, validate the content
+        static_errors = []
+        content = lines[1].strip() if len(lines) > 1 else ""
+        archive = None  # the bytes of a zip attachment
+        content_source = "message"  # Track where content came from for error messages
+
+        # Strip code block markers if present (```json, ```yaml, ```, etc.)
+        if content:
+            content = CODE_BLOCK_RE.sub("", content).strip()
 
-            # Forum threads channel id is randomly generated per thread, so we need to check against the parent ID if it exists.
-            channel_compare_id = message.channel.id
-            if hasattr(message.channel, 'parent_id'):
-                channel_compare_id = message.channel.parent_id
-
-            if channel_compare_id == chan["id"]:
-                identifier = chan["identifier"]
-                repo = chan["repo"]
-
-                # Check if this is an automation submission (header on first line)
-                lines = message.content.strip().split('\n', 1)
-                first_line = lines[0].strip()
-                
-                # If first line doesn't match header, ignore (allow discussion)
-                if not AUTOMATION_HEADER_RE.match(first_line):
-                    continue
-
-                # Header matched - this is a submission attempt, validate the content
-                static_errors = []
-                data = None
-                content = lines[1].strip() if len(lines) > 1 else ""
-                content_source = "message"  # Track where content came from for error messages
-
-                # Strip code block markers if present (```json, ```yaml, ```, etc.)
-                if content:
-                    content = CODE_BLOCK_RE.sub("", content).strip()
-
-                # If no content in message, check for attachments
-                if not content and message.attachments:
-                    for attachment in message.attachments:
-                        if attachment.filename.lower().endswith(VALID_ATTACHMENT_EXTENSIONS):
-                            try:
-                                file_bytes = await attachment.read()
-                                content = file_bytes.decode('utf-8').strip()
-                                content_source = f"attachment ({attachment.filename})"
-                                break
-                            except Exception as e:
-                                static_errors.append(f"Failed to read attachment {attachment.filename}: {e}")
-                    
-                    # If we had attachments but none were valid
-                    if not content and not static_errors:
-                        static_errors.append(
-                            f"No valid attachment found. Supported formats: {', '.join(VALID_ATTACHMENT_EXTENSIONS)}"
-                        )
-
-                if not content and not static_errors:
-                    static_errors.append(
-                        "Missing automation content. Expected format in JSON or YAML:\n"
-                        "```\n"
-                        "**Automation Submission**\n"
-                        "{\"name\": \"...\", \"automation\": ...}\n"
-                        "```\n"
-                        "You can also attach a .json, .yaml, or .txt file."
-                    )
-                elif content and not static_errors:
+        # If no content in message, check for attachments
+        if not content and message.attachments:
+            for attachment in message.attachments:
+                if attachment.filename.lower().endswith(VALID_ATTACHMENT_EXTENSIONS):
                     try:
-                        data = yaml.safe_load(content)
-                        if not isinstance(data, dict):
-                            static_errors.append(f"Submission from {content_source} must be valid JSON or YAML that parses to an object. (Got {type(data).__name__})")
-                            data = None
+                        file_bytes = await read_attachment(attachment)
+                        if attachment.filename.lower().endswith(".zip"):
+                            archive = file_bytes
                         else:
-                            parsed_format = "json" if content.lstrip().startswith("{") else "yaml"
-                    except yaml.YAMLError as exc:
-                        static_errors.append(f"Submission from {content_source} must be valid JSON or YAML. ({exc})")
-
-                # Require both name and automation keys
-                automation_title = None
-                if data is not None and not static_errors:
-                    automation_title = data.get("name")
-                    if not automation_title:
-                        static_errors.append("Submission must include a 'name' field.")
-                    if not data.get("automation"):
-                        static_errors.append("Submission must include an 'automation' field.")
-
-                # Validate the automation against the avrae automation-common schema
-                if data is not None and not static_errors:
-                    try:
-                        validation.validate(data["automation"])
-                    except ValidationError as exc:
-                        formatted = VALIDATION_TYPE_RE.sub("", format_validation_error(exc))
-                        static_errors.append(
-                            f"Submission from {content_source} has invalid automation:\n"
-                            f"```\n{formatted}\n```"
-                        )
+                            content = file_bytes.decode('utf-8').strip()
+                        content_source = f"attachment ({attachment.filename})"
+                        break
+                    except SubmissionTooLarge:
+                        static_errors.append(f"Attachment {attachment.filename} is too large "
+                                             f"(max {MAX_SUBMISSION_BYTES // 1024} KiB).")
+                    except Exception as e:
+                        static_errors.append(f"Failed to read attachment {attachment.filename}: {e}")
+
+            # If we had attachments but none were valid
+            if not content and archive is None and not static_errors:
+                static_errors.append(
+                    f"No valid attachment found. Supported formats: {', '.join(VALID_ATTACHMENT_EXTENSIONS)}"
+                )
 
-                is_valid = data is not None and not static_errors
+        submission = None
+        if not content and archive is None and not static_errors:
+            static_errors.append(
+                "Missing automation content. Expected format in JSON or YAML:\n"
+                "```\n"
+                "**Automation Submission**\n"
+                "{\"name\": \"...\", \"automation\": ...}\n"
+                "```\n"
+                "To submit several automations at once, send a JSON list of them or several YAML documents. "
+                "You can also attach a .json, .yaml, .txt or .zip file."
+            )
+        elif not static_errors:
+            # parsing and validation run in worker processes, with size and time limits
+            if archive is not None:
+                submission = await self.validator.validate_archive(archive, content_source)
+            else:
+                submission = await self.validator.validate(content, content_source)
+            static_errors.extend(submission.errors)
+            if len(submission.items) == 1:  # a single automation is accepted or rejected as a whole
+                static_errors.extend(submission.items[0].errors)
+
+        if static_errors:
+            try:
+                await message.reply(
+                    (f"Your automation could not be accepted:\n"
+                     + "\n".join(static_errors))[:2000],
+                    mention_author=False,
+                )
+            except Exception:
+                pass
+            return
 
-                if static_errors:
-                    try:
-                        await message.reply(
-                            (f"Your automation could not be accepted:\n"
-                             + "\n".join(static_errors))[:2000],
-                            mention_author=False,
-                        )
-                    except Exception:
-                        pass
-                    return
-                
-                
-                if is_valid and not static_errors:
-                    thread_id = message.channel.id
-                    file_content = json.dumps([data], indent=2)
-
-                    existing = await Report.find_existing_submission(
-                        repo, thread_id, message.author.id, automation_title)
-
-                    if existing is not None:
-                        await existing.update_pr(ContextProxy(self.bot), file_content)
-                        await existing.notify_thread(
-                            self.bot, f"↻ Updated your **{automation_title}** submission with the latest version.")
-                        await message.add_reaction(random.choice(constants.REACTIONS))
-                        return
-
-                    title = f"User Automation: '{automation_title}' by {message.author.display_name}"
-                    report_num = get_next_report_num(identifier)
-                    report_id = f"{identifier}-{report_num}"
-                    attach = "\n" + "\n".join(
-                        f"\n{'!' if item.url.lower().endswith(('.png', '.jpg', '.gif')) else ''}"
-                        f"[{item.filename}]({item.url})"
-                        for item in message.attachments
-                    )
-
-                    desc = (
-                        f"### User Submitted Automation\n"
-                        f"**Automation Name:** {automation_title}\n"
-                        f"**Submitted by:** [{message.author.display_name}]({message.jump_url})\n\n"
-                        f"```{parsed_format}\n{content}\n```\n"
-                    )
-
-                    desc += "\n\n**Attachments:**\n" + attach if message.attachments else ""
-
-                    report = await Report.new(
-                        message.author.id,
-                        report_id,
-                        title,
-                        [Attachment(message.author.id, desc)],
-                        is_bug=False,
-                        is_automation=True,
-                        repo=repo,
-                        thread_id=thread_id,
-                        automation_name=automation_title,
-                    )
-
-                    # Post in thread, to avoid this remove channel kwarg and uncomment the separate AUTOMATION_TRACKER_CHAN constant and get_channel logic in Report.get_channel
-                    await report.setup_message(self.bot, channel=message.channel)
-                    await report.setup_pr(ContextProxy(self.bot), file_content)
-                    report.commit()
+        if len(submission.items) == 1:
+            item = submission.items[0]
+            if content:
+                await self.submit_automation(message, chan, item, content, submission.parsed_format)
+            else:  # from an archive
+                await self.submit_automation(message, chan, item, item.file_content, "json")
+        else:
+            await self.submit_batch(message, chan, submission)
+
+    async def submit_automation(self, message, chan, item, content, parsed_format):
+        """Commits a single validated automation to its own branch and PR, tracked by its own report."""
+        automation_title = item.name
+        file_content = item.file_content
+        thread_id = message.channel.id
+        repo = chan["repo"]
+
+        branch = dedup.branch_name(thread_id, message.author.id, automation_title)
+        file_hash = dedup.content_hash(file_content)
+        found, _ = await self.find_submissions(repo, thread_id, message.author.id, [automation_title])
+        existing = found.get(automation_title)
+
+        if existing is not None:  # on its own PR, or on the PR of a batch it was submitted in
+            # unless it's a repost of what's already on the open PR's branch, which needs no push
+            if self.pushed_submissions.get(branch) != file_hash:
+                await self.update_submission(existing, {automation_title: file_content})
+            await message.add_reaction(random.choice(constants.REACTIONS))
+            return
 
-                    await message.add_reaction(random.choice(constants.REACTIONS))
-                    return
+        title = f"User Automation: '{automation_title}' by {message.author.display_name}"
+        report_num = get_next_report_num(chan["identifier"])
+        report_id = f"{chan['identifier']}-{report_num}"
+        desc = (
+            f"### User Submitted Automation\n"
+            f"**Automation Name:** {automation_title}\n"
+            f"**Submitted by:** [{message.author.display_name}]({message.jump_url})\n\n"
+            f"```{parsed_format}\n{content}\n```\n"
+        )
+        desc += self.get_attachment_links(message)
+
+        report = await Report.new(
+            message.author.id,
+            report_id,
+            title,
+            [Attachment(message.author.id, desc)],
+            is_bug=False,
+            is_automation=True,
+            repo=repo,
+            thread_id=thread_id,
+            automation_name=automation_title,
+        )
+
+        async with Report.locked(report_id, new=report):
+            # Post in thread, to avoid this remove channel kwarg and uncomment the separate AUTOMATION_TRACKER_CHAN constant and get_channel logic in Report.get_channel
+            await report.setup_message(self.bot, channel=message.channel)
+            await report.setup_pr(ContextProxy(self.bot), {automation_title: file_content})
+            report.commit()
+        self.remember_pushed(report, {automation_title: file_content})
+
+        await message.add_reaction(random.choice(constants.REACTIONS))
+
+    async def submit_batch(self, message, chan, submission):
+        """
+        Commits the valid automations of a batch submission - each to the PR it was submitted in before, if any, and
+        the rest together to one branch and PR tracked by one report - and replies with the result of each automation.
+        """
+        accepted = {item.name: item.file_content for item in submission.items if not item.errors}
+        if accepted:
+            await self.push_batch(message, chan, accepted)
+            await message.add_reaction(random.choice(constants.REACTIONS))
 
-        if match and identifier:
-            title = match.group(1).strip(" *.\n")
-            report_num = get_next_report_num(identifier)
-            report_id = f"{identifier}-{report_num}"
-            attach = "\n" + '\n'.join(f"\n{'!' if item.url.lower().endswith(('.png', '.jpg', '.gif')) else ''}"
-                                      f"[{item.filename}]({item.url})" for item in message.attachments)
+        results = []
+        for i, item in enumerate(submission.items, 1):
+            name = item.name or f"Automation {i}"
+            if item.errors:
+                results.append(f"\u274c **{name}**: " + " ".join(item.errors))
+            else:
+                results.append(f"\u2705 **{name}**")
+        summary = f"Accepted {len(accepted)} of {len(submission.items)} automations:\n"
+        try:
+            await message.reply((summary + "\n".join(results))[:2000], mention_author=False)
+        except disnake.HTTPException:
+            pass
+
+    async def push_batch(self, message, chan, files):
+        """
+        Pushes each automation of a batch to the open PR it was submitted in before, whether on its own or in a batch,
+        and the rest to the author's open batch PR in the thread, or a new one. Reposts of what's already on an open
+        PR aren't pushed again.
+        """
+        thread_id = message.channel.id
+        author_id = message.author.id
+        found, batch = await self.find_submissions(chan["repo"], thread_id, author_id, files)
+        updates = {}  # report ID -> (report, the files to push to its PR)
+        new_files = {}
+        for name, content in files.items():
+            if name in found:
+                branch = dedup.branch_name(thread_id, author_id, name)
+                if self.pushed_submissions.get(branch) == dedup.content_hash(content):
+                    continue  # a repost of what's already on its open PR
+                existing = found[name]
+            else:
+                existing = batch
+            if existing is None:
+                new_files[name] = content
+            else:
+                updates.setdefault(existing.report_id, (existing, {}))[1][name] = content
 
-            report = await Report.new(
-                message.author.id, report_id, title,
-                [Attachment(message.author.id, message.content + attach)], is_bug=is_bug, repo=repo)
+        for existing, report_files in updates.values():
+            await self.update_submission(existing, report_files)
+        if new_files:
+            await self.open_batch(message, chan, new_files)
 
-            await report.setup_message(self.bot)
+    @staticmethod
+    async def find_submissions(repo, thread_id, author_id, names):
+        """
+        Returns the open submission report of each of an author's automations in a thread (name -> Report), whether
+        it went out on its own or in a batch, and the author's open batch report in the thread, or None.
+        Automations that haven't been submitted are left out.
+        """
+        batch = await Report.find_existing_submission(repo, dedup.batch_branch_name(thread_id, author_id))
+        found = {}
+        for name in names:
+            existing = await Report.find_existing_submission(repo, dedup.branch_name(thread_id, author_id, name))
+            if existing is None and batch is not None and batch.has_automation(name):
+                existing = batch
+            if existing is not None:
+                found[name] = existing
+        return found, batch
+
+    async def update_submission(self, report, files):
+        """Pushes new versions of automations (name -> file) to a submission's open PR, adding any new to a batch."""
+        async with Report.locked(report.report_id) as report:
+            await report.update_pr(ContextProxy(self.bot), files)
+            if report.automation_names:
+                added = [name for name in files if not report.has_automation(name)]
+                if added:
+                    report.automation_names = report.automation_names + added
+                    report.commit()
+        self.remember_pushed(report, files)
+        if report.automation_names:
+            await report.notify_thread(
+                self.bot, f"↻ Updated {len(files)} automations of your batch submission with the latest versions.")
+        else:
+            await report.notify_thread(
+                self.bot, f"↻ Updated your **{report.automation_name}** submission with the latest version.")
+
+    def remember_pushed(self, report, files):
+        for name, content in files.items():
+            branch = dedup.branch_name(report.thread_id, report.reporter, name)
+            self.pushed_submissions[branch] = dedup.content_hash(content)
+
+    async def open_batch(self, message, chan, files):
+        """Opens a batch PR for automations (name -> file), tracked by a new report."""
+        title = f"User Automations: {len(files)} automations by {message.author.display_name}"
+        report_num = get_next_report_num(chan["identifier"])
+        report_id = f"{chan['identifier']}-{report_num}"
+        desc = (
+            f"### User Submitted Automations\n"
+            f"**Submitted by:** [{message.author.display_name}]({message.jump_url})\n\n"
+            + "\n".join(f"- {name}" for name in files)
+            + "\n"
+        )
+        desc += self.get_attachment_links(message)
+
+        report = await Report.new(
+            message.author.id,
+            report_id,
+            title,
+            [Attachment(message.author.id, desc)],
+            is_bug=False,
+            is_automation=True,
+            repo=chan["repo"],
+            thread_id=message.channel.id,
+            automation_names=list(files),
+        )
+        async with Report.locked(report_id, new=report):
+            await report.setup_message(self.bot, channel=message.channel)
+            await report.setup_pr(ContextProxy(self.bot), files)
             report.commit()
-            await message.add_reaction(random.choice(constants.REACTIONS))
+        self.remember_pushed(report, files)
+
+    @staticmethod
+    def get_attachment_links(message):
+        if not message.attachments:
+            return ""
+        attach = "\n" + "\n".join(
+            f"\n{'!' if item.url.lower().endswith(('.png', '.jpg', '.gif')) else ''}"
+            f"[{item.filename}]({item.url})"
+            for item in message.attachments
+        )
+        return "\n\n**Attachments:**\n" + attach
 
     # ==== message commands ====
     async def common_note_impl(self, ctx, report_id, msg, report_method_getter: Callable[[Report], ReportNoteMethodT]):
-        report = Report.from_id(report_id)
-        await self.add_vote_to_report(ctx, report, msg, method=report_method_getter(report))
+        async with Report.locked(report_id) as report:
+            await self.add_vote_to_report(ctx, report, msg, method=report_method_getter(report))
         if ctx.channel.id == report.message:  # do not confirm in a thread
             return
         await ctx.send(f"Ok, I've added a note to `{report.report_id}` - {report.title}.")
@@ -314,13 +448,12 @@ class Reports(commands.Cog):
     @commands.command(name="report")
     async def viewreport(self, ctx, _id):
         """Gets the detailed status of a report."""
-        await ctx.send(embed=Report.from_id(_id).get_embed(True, ctx.guild))
+        await ctx.send(embed=(await Report.load(_id)).get_embed(True, ctx.guild))
 
     @commands.command(aliases=['sub'])
     async def subscribe(self, ctx, report_id):
         """Subscribes to a report."""
-        report = Report.from_id(report_id)
-        is_subscribed = await self.toggle_report_subscription(ctx, report)
+        report, is_subscribed = await self.toggle_report_subscription(ctx, report_id)
         if is_subscribed:
             await ctx.send(f"OK, subscribed to `{report.report_id}` - {report.title}.")
         else:
@@ -329,7 +462,7 @@ class Reports(commands.Cog):
     @commands.command()
     async def unsuball(self, ctx):
         """Unsubscribes from all reports."""
-        num_unsubbed = await self.unsubscribe_from_all(ctx.author.id)
+        num_unsubbed = await self.unsubscribe_from_all(ctx)
         await ctx.send(f"OK, unsubscribed from {num_unsubbed} reports.")
 
     @commands.command()
@@ -360,7 +493,9 @@ class Reports(commands.Cog):
     ):
         # noinspection PyTypeChecker
         await inter.response.defer()
-        await self.add_vote_to_report(inter, report, msg, method=report_method_getter(report))
+        # the converter's copy may be stale by the time this report's earlier changes are done
+        async with Report.locked(report.report_id) as report:
+            await self.add_vote_to_report(inter, report, msg, method=report_method_getter(report))
         await inter.send(f"Ok, I've added a note to `{report.report_id}` - {report.title}.",
                          ephemeral=inter.channel.id == report.message)
 
@@ -430,7 +565,7 @@ class Reports(commands.Cog):
         report: Any = report_param("The report to subscribe to.")
     ):
         """Subscribes to a report."""
-        is_subscribed = await self.toggle_report_subscription(inter, report)
+        report, is_subscribed = await self.toggle_report_subscription(inter, report.report_id)
         if is_subscribed:
             await inter.send(
                 f"OK, subscribed to `{report.report_id}` - {report.title}.",
@@ -443,7 +578,7 @@ class Reports(commands.Cog):
     @commands.slash_command(name="unsuball")
     async def unsuball(self, inter: disnake.ApplicationCommandInteraction):
         """Unsubscribes from all reports."""
-        num_unsubbed = await self.unsubscribe_from_all(inter.author.id)
+        num_unsubbed = await self.unsubscribe_from_all(inter)
         await inter.send(f"OK, unsubscribed from {num_unsubbed} reports.", ephemeral=True)
 
     @commands.slash_command(name="top")
@@ -470,41 +605,36 @@ class Reports(commands.Cog):
         report.commit()
 
     @staticmethod
-    async def toggle_report_subscription(ctx, report):
-        if ctx.author.id in report.subscribers:
-            report.unsubscribe(ctx)
-            report.commit()
-            return False
-        else:
-            report.subscribe(ctx)
+    async def toggle_report_subscription(ctx, report_id):
+        """
+        Subscribes the author to a report, or unsubscribes them if they already were.
+        Returns the report and whether they're now subscribed.
+        """
+        async with Report.locked(report_id) as report:
+            is_subscribed = ctx.author.id not in report.subscribers
+            if is_subscribed:
+                report.subscribe(ctx)
+            else:
+                report.unsubscribe(ctx)
             report.commit()
-            return True
+        return report, is_subscribed
 
     @staticmethod
-    async def unsubscribe_from_all(user_id):
+    async def unsubscribe_from_all(ctx):
+        """Unsubscribes the author from every report they're subscribed to. Returns how many that was."""
         num_unsubbed = 0
-        sentinel = lek = object()
-
-        fe = Attr("subscribers").contains(user_id)
-        while lek is not None:
-            if lek is sentinel:
-                response = db.reports.scan(
-                    FilterExpression=fe
-                )
-            else:
-                response = db.reports.scan(
-                    FilterExpression=fe,
-                    ExclusiveStartKey=lek
-                )
-
-            lek = response.get('LastEvaluatedKey')
-            for report in response['Items']:
-                i = report['subscribers'].index(user_id)
-                num_unsubbed += 1
-                db.reports.update_item(
-                    Key={"report_id": report['report_id']},
-                    UpdateExpression=f"REMOVE subscribers[{i}]"
-                )
+        fe = Attr("subscribers").contains(ctx.author.id)
+        report_ids = [item['report_id'] for item in db.query_sync(db.reports, fe)]
+        for report_id in report_ids:
+            try:
+                async with Report.locked(report_id) as report:
+                    if ctx.author.id not in report.subscribers:  # changed since the scan
+                        continue
+                    report.unsubscribe(ctx)
+                    report.commit()
+            except ReportNotFound:
+                continue
+            num_unsubbed += 1
         return num_unsubbed
 
     @staticmethod
@@ -513,18 +643,17 @@ class Reports(commands.Cog):
         embed.title = f"Top {n} Open Feature Requests"
         embed.description = "Click a report to jump to its tracker message."
 
-        reports = []
-        async for fr_data in query(db.reports, Attr("is_bug").eq(False) and Attr("severity").gte(0)):
-            reports.append(Report.from_dict(fr_data))
-        sorted_reports = sorted(reports, key=lambda r: r.score, reverse=True)[:n]
+        if not Report.leaderboard.loaded:
+            await Reports.load_leaderboard()
         last_field = []
 
-        for report in sorted_reports:
-            message = await report.get_message(ctx)
-            if message is not None:
-                report_str = f"`{report.score:+}` [`{report.report_id}` {report.title}]({message.jump_url})"
+        for entry in Report.leaderboard.top(n):
+            if entry.message_id and Report.message_cache.get(entry.message_id, entry.channel_id) is not None:
+                channel = ctx.bot.get_channel(entry.channel_id) or ctx.bot.get_partial_messageable(entry.channel_id)
+                jump_url = channel.get_partial_message(entry.message_id).jump_url
+                report_str = f"`{entry.score:+}` [`{entry.report_id}` {entry.title}]({jump_url})"
             else:
-                report_str = f"`{report.score:+}` `{report.report_id}` {report.title}"
+                report_str = f"`{entry.score:+}` `{entry.report_id}` {entry.title}"
 
             if len(report_str) + sum(len(s) + 1 for s in last_field) > 1024:
                 embed.add_field(name='** **', value='\n'.join(last_field), inline=False)
@@ -534,6 +663,16 @@ class Reports(commands.Cog):
         embed.add_field(name='** **', value='\n'.join(last_field), inline=False)
         return embed
 
+    @staticmethod
+    async def load_leaderboard():
+        """Fills the leaderboard from a scan of the open feature requests; after that, commits keep it up to date."""
+        entries = []
+        async for fr_data in query(db.reports, Attr("is_bug").eq(False) & Attr("severity").gte(0)):
+            entry = Report.from_dict(fr_data).get_leaderboard_entry()
+            if entry is not None:
+                entries.append(entry)
+        Report.leaderboard.load(entries)
+
 
 def setup(bot):
     bot.add_cog(Reports(bot))
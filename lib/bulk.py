@@ -0,0 +1,158 @@
+"""
+Bounded-concurrency bulk jobs over many items (e.g. re-posting every tracker message), with progress reporting and a
+checkpoint in the taine.checkpoints table so that a job interrupted by a crash or restart (or a redeploy onto a new
+host) resumes where it stopped instead of starting over.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+
+from boto3.dynamodb.conditions import Key
+
+import lib.db as ddb
+
+# how many items a job works on at once, and how many of those may share a key (e.g. a Discord channel)
+BULK_CONCURRENCY = 8
+BULK_KEY_CONCURRENCY = 2
+# the least time between two progress callbacks, in seconds
+PROGRESS_INTERVAL = 10
+
+log = logging.getLogger(__name__)
+
+
+class BulkProgress:
+    """A running tally of a bulk job, with its throughput and an estimate of the time left."""
+
+    def __init__(self, total, resumed=0):
+        self.total = total
+        self.resumed = resumed  # items finished by an earlier run of the job
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    @property
+    def remaining(self):
+        return self.total - self.resumed - self.done - self.failed
+
+    @property
+    def rate(self):
+        """Items finished per second in this run."""
+        elapsed = self.elapsed
+        return (self.done + self.failed) / elapsed if elapsed else 0
+
+    @property
+    def eta(self):
+        """Seconds until the job is done at the current rate, or None if nothing has finished yet."""
+        rate = self.rate
+        return self.remaining / rate if rate else None
+
+    def format(self):
+        finished = self.resumed + self.done
+        out = f"{finished}/{self.total} done"
+        if self.failed:
+            out = f"{out}, {self.failed} failed"
+        out = f"{out} ({self.rate:.1f}/s"
+        if self.remaining and (eta := self.eta) is not None:
+            out = f"{out}, about {eta:.0f}s left"
+        return f"{out})"
+
+    def to_dict(self):
+        return {"total": self.total, "resumed": self.resumed, "done": self.done, "failed": self.failed,
+                "elapsed": self.elapsed, "rate": self.rate, "eta": self.eta}
+
+
+class Checkpoint:
+    """
+    The (string) IDs of the items a job has finished, stored as each finishes - so a crash loses at most the items in
+    flight - and read back by a later run of the same job so it can skip them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.done = set()
+        query = dict(KeyConditionExpression=Key("job").eq(name))
+        while query:
+            response = ddb.checkpoints.query(**query)
+            self.done.update(item['item_id'] for item in response['Items'])
+            query = dict(query, ExclusiveStartKey=response['LastEvaluatedKey']) \
+                if 'LastEvaluatedKey' in response else None
+
+    def __contains__(self, item_id):
+        return item_id in self.done
+
+    def add(self, item_id):
+        ddb.checkpoints.put_item(Item={"job": self.name, "item_id": item_id})
+        self.done.add(item_id)
+
+    def clear(self):
+        ddb.batch_delete(ddb.checkpoints, [{"job": self.name, "item_id": item_id} for item_id in self.done])
+        self.done.clear()
+
+
+class BulkJob:
+    """
+    Runs ``handler(item)`` over items, at most ``concurrency`` at a time and at most ``key_concurrency`` at a time for
+    items sharing ``key(item)`` - so one busy channel's rate limit doesn't hold up every worker. Finished items are
+    checkpointed by ``item_id(item)``; an item whose handler raises is logged, counted as failed and left out of the
+    checkpoint, so it's retried when the job is run again. Once every item has succeeded, the checkpoint is removed.
+    """
+
+    def __init__(self, name, handler, item_id, key=None, concurrency=BULK_CONCURRENCY,
+                 key_concurrency=BULK_KEY_CONCURRENCY, on_progress=None, progress_interval=PROGRESS_INTERVAL):
+        self.name = name
+        self.handler = handler
+        self.item_id = item_id
+        self.key = key
+        self.concurrency = concurrency
+        self.key_concurrency = key_concurrency
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.checkpoint = Checkpoint(name)
+        self.progress = None
+        self.failures = {}  # item id -> exception
+
+    async def run(self, items):
+        """Runs the job over items (skipping any checkpointed ones). Returns the final BulkProgress."""
+        items = list(items)
+        todo = [item for item in items if self.item_id(item) not in self.checkpoint]
+        self.progress = BulkProgress(len(items), resumed=len(items) - len(todo))
+        if self.progress.resumed:
+            log.info(f"Resuming bulk job {self.name}: {self.progress.resumed} of {len(items)} items already done")
+
+        limit = asyncio.Semaphore(self.concurrency)
+        key_limits = {}
+        last_progress = time.monotonic()
+
+        async def run_one(item):
+            nonlocal last_progress
+            if self.key is None:
+                key_limit = contextlib.nullcontext()
+            else:
+                key_limit = key_limits.setdefault(self.key(item), asyncio.Semaphore(self.key_concurrency))
+            # wait for the key before taking a worker, so items queued on one busy key don't hog the workers
+            async with key_limit, limit:
+                try:
+                    await self.handler(item)
+                except Exception as e:
+                    self.progress.failed += 1
+                    self.failures[self.item_id(item)] = e
+                    log.warning(f"Bulk job {self.name} failed on {self.item_id(item)}: {e!r}")
+                else:
+                    self.progress.done += 1
+                    self.checkpoint.add(self.item_id(item))
+            if self.on_progress is not None and time.monotonic() - last_progress >= self.progress_interval:
+                last_progress = time.monotonic()
+                try:
+                    await self.on_progress(self.progress)
+                except Exception as e:  # e.g. the status message was deleted; the job itself is fine
+                    log.warning(f"Bulk job {self.name} couldn't report its progress: {e!r}")
+
+        await asyncio.gather(*(run_one(item) for item in todo))
+        if not self.failures:
+            self.checkpoint.clear()
+        return self.progress
@@ -0,0 +1,100 @@
+"""Debounced per-key event coalescing, used to collapse bursts of GitHub webhooks into one reconciliation."""
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class EventCoalescer:
+    """
+    Collects events by key and hands each burst to ``handler(key, events)`` once the key has been quiet for
+    ``window`` seconds (or ``max_delay`` seconds after the first event, whichever comes first).
+    Bursts for the same key are handled serially and in order.
+    """
+
+    def __init__(self, handler, window=5, max_delay=30):
+        self.handler = handler
+        self.window = window
+        self.max_delay = max_delay
+        self._pending = {}  # key -> list of events
+        self._last_seen = {}  # key -> loop time of the latest event
+        self._timers = {}  # key -> flush task
+        self._inflight = {}  # key -> handler task for the previous burst
+        self._done = {}  # key -> future of the current burst, set once it has been handled
+        self.events_received = 0
+        self.events_flushed = 0
+        self.bursts_flushed = 0
+
+    def submit(self, key, event):
+        """
+        Adds an event to the key's current burst, scheduling a flush if one isn't already pending. Returns a future
+        that is set once the burst has been handled: True, or False if the handler raised.
+        """
+        loop = asyncio.get_event_loop()
+        self.events_received += 1
+        self._pending.setdefault(key, []).append(event)
+        self._last_seen[key] = loop.time()
+        if key not in self._done:
+            self._done[key] = loop.create_future()
+        if key not in self._timers:
+            self._timers[key] = loop.create_task(self._flush_later(key))
+        return self._done[key]
+
+    async def _flush_later(self, key):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.max_delay
+        while True:
+            now = loop.time()
+            quiet_at = self._last_seen[key] + self.window
+            if now >= quiet_at or now >= deadline:
+                break
+            await asyncio.sleep(min(quiet_at, deadline) - now)
+        await self._flush(key)
+
+    async def _flush(self, key):
+        events = self._pending.pop(key, None)
+        done = self._done.pop(key, None)
+        self._last_seen.pop(key, None)
+        self._timers.pop(key, None)
+        if not events:
+            return
+
+        previous = self._inflight.get(key)
+        task = asyncio.ensure_future(self._run_handler(key, events, previous, done))
+        self._inflight[key] = task
+        try:
+            await task
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    async def _run_handler(self, key, events, previous, done):
+        if previous is not None:
+            await asyncio.wait([previous])
+        self.events_flushed += len(events)
+        self.bursts_flushed += 1
+        handled = False
+        try:
+            await self.handler(key, events)
+            handled = True
+        except Exception:
+            log.exception(f"Error handling coalesced events for {key}")
+        finally:
+            if done is not None and not done.done():
+                done.set_result(handled)
+
+    async def flush_all(self):
+        """Immediately flushes every pending burst, e.g. on shutdown."""
+        for key, timer in list(self._timers.items()):
+            timer.cancel()
+        await asyncio.gather(*(self._flush(key) for key in list(self._pending)))
+        if self._inflight:
+            await asyncio.wait(list(self._inflight.values()))
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def stats(self):
+        return {"events_received": self.events_received, "bursts_flushed": self.bursts_flushed,
+                "events_saved": self.events_flushed - self.bursts_flushed, "pending": self.pending}
@@ -1,13 +1,202 @@
+import contextlib
+import contextvars
 import os
+import sys
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
 
 import boto3
 
+from lib import metrics
+
 DYNAMODB_URL = os.environ.get("DYNAMODB_URL", "http://localhost:8000")
+BATCH_GET_SIZE = 100  # the most keys dynamo accepts in one BatchGetItem
+BATCH_WRITE_SIZE = 25  # the most requests dynamo accepts in one BatchWriteItem
+PARTIQL_IN_SIZE = 50  # the most partition keys one PartiQL IN clause may list
+# bucket bounds for histograms of the capacity units one call consumed
+CAPACITY_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+READ_CALLS = frozenset(("get_item", "query", "scan", "batch_get_item", "execute_statement"))
+
+# the logical operation storage calls are being made for, if one was given (see operation())
+current_operation = contextvars.ContextVar("db_operation", default=None)
+
+
+# ==== instrumentation ====
+def item_size(value):
+    """Estimates the stored size of an item or attribute value in bytes, the way DynamoDB measures it for capacity."""
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        return (len(str(value)) + 1) // 2 + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode()) + item_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 3 + sum(item_size(v) + 1 for v in value)
+    return len(str(value))
+
+
+class OperationUsage:
+    __slots__ = ("calls", "errors", "read_units", "write_units", "items", "bytes", "latency", "capacity", "by_call")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.read_units = 0
+        self.write_units = 0
+        self.items = 0
+        self.bytes = 0
+        self.latency = metrics.Histogram()
+        self.capacity = metrics.Histogram(CAPACITY_BUCKETS)
+        self.by_call = Counter()  # "table.method" -> calls
+
+    @property
+    def units(self):
+        return self.read_units + self.write_units
+
+    def to_dict(self):
+        return {"calls": self.calls, "errors": self.errors, "read_units": self.read_units,
+                "write_units": self.write_units, "items": self.items, "bytes": self.bytes,
+                "latency_s": self.latency.to_dict(), "capacity_units": self.capacity.to_dict(),
+                "by_call": dict(self.by_call)}
+
+
+class StorageUsage:
+    """
+    The latency and capacity of storage calls, by the operation they were made for: the logical operation if one is
+    set (see operation()), followed by the code that made the call.
+    """
+
+    def __init__(self):
+        self.operations = {}  # tag -> OperationUsage
+        self._lock = threading.Lock()  # reports are loaded from executor threads too
+
+    def record(self, tag, call, latency, response=None, written=None):
+        """Records one call ("table.method"); response is None if it failed, written is what it wrote, if anything."""
+        if response is not None:
+            consumed = response.get('ConsumedCapacity') or ()
+            if isinstance(consumed, dict):
+                consumed = (consumed,)
+            units = sum(float(c.get('CapacityUnits', 0)) for c in consumed)
+            if 'Item' in response:
+                returned = [response['Item']]
+            elif 'Items' in response:
+                returned = response['Items']
+            else:
+                returned = [item for items in response.get('Responses', {}).values() for item in items]
+            items = len(returned) if written is None else len(written)
+            size = sum(item_size(item) for item in (returned if written is None else written))
+
+        with self._lock:
+            if (usage := self.operations.get(tag)) is None:
+                usage = self.operations[tag] = OperationUsage()
+            usage.calls += 1
+            usage.by_call[call] += 1
+            usage.latency.observe(latency)
+            if response is None:
+                usage.errors += 1
+                return
+            if call.rpartition('.')[2] in READ_CALLS:
+                usage.read_units += units
+            else:
+                usage.write_units += units
+            usage.capacity.observe(units)
+            usage.items += items
+            usage.bytes += size
+
+    def stats(self):
+        with self._lock:
+            ranked = sorted(self.operations.items(), key=lambda op: op[1].units, reverse=True)
+            return {tag: usage.to_dict() for tag, usage in ranked}
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+
+
+usage = StorageUsage()
+metrics.register("dynamodb", usage.stats)
+
+
+@contextlib.contextmanager
+def operation(name):
+    """Tags the storage calls made inside the block (and in tasks started from it) as being for an operation."""
+    token = current_operation.set(name)
+    try:
+        yield
+    finally:
+        current_operation.reset(token)
+
+
+def _tag():
+    """The operation a storage call is for, named after the first caller outside this module."""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        site = "unknown"
+    else:
+        code = frame.f_code
+        site = f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+    op = current_operation.get()
+    return f"{op}: {site}" if op else site
+
+
+def _instrumented(tag, call, fn, written=None, **kwargs):
+    kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    start = time.perf_counter()
+    try:
+        response = fn(**kwargs)
+    except Exception:
+        usage.record(tag, call, time.perf_counter() - start)
+        raise
+    usage.record(tag, call, time.perf_counter() - start, response, written)
+    return response
+
+
+class InstrumentedTable:
+    """A boto3 Table whose item calls also record their latency and consumed capacity (see StorageUsage)."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getattr__(self, name):
+        return getattr(self._table, name)
+
+    def _call(self, method, kwargs, written=None):
+        return _instrumented(_tag(), f"{self._table.name}.{method}", getattr(self._table, method), written, **kwargs)
+
+    def get_item(self, **kwargs):
+        return self._call("get_item", kwargs)
+
+    def query(self, **kwargs):
+        return self._call("query", kwargs)
+
+    def scan(self, **kwargs):
+        return self._call("scan", kwargs)
+
+    def put_item(self, **kwargs):
+        return self._call("put_item", kwargs, written=[kwargs['Item']])
+
+    def update_item(self, **kwargs):
+        return self._call("update_item", kwargs, written=[kwargs.get('ExpressionAttributeValues', {})])
+
+    def delete_item(self, **kwargs):
+        return self._call("delete_item", kwargs, written=[])
+
 
 # for use imported elsewhere
 dynamo = boto3.resource('dynamodb', endpoint_url=DYNAMODB_URL, region_name='us-east-1')
-reports = dynamo.Table('taine.reports')
-reportnums = dynamo.Table('taine.reportnums')
+reports = InstrumentedTable(dynamo.Table('taine.reports'))
+reportnums = InstrumentedTable(dynamo.Table('taine.reportnums'))
+deliveries = InstrumentedTable(dynamo.Table('taine.deliveries'))
+leases = InstrumentedTable(dynamo.Table('taine.leases'))
+checkpoints = InstrumentedTable(dynamo.Table('taine.checkpoints'))
 
 
 async def query(table, filter_exp=None):
@@ -36,6 +225,80 @@ def query_sync(table, filter_exp=None):
             yield report_data
 
 
+def batch_get(table, keys):
+    """
+    Gets many items from a table by primary key, in as few BatchGetItem calls as possible.
+    Keys must be unique; items that don't exist are left out of the returned list.
+    """
+    keys = list(keys)
+    items = []
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request = {table.name: {"Keys": keys[i:i + BATCH_GET_SIZE]}}
+        while request:
+            response = _instrumented(_tag(), f"{table.name}.batch_get_item", dynamo.batch_get_item,
+                                     RequestItems=request)
+            items.extend(response['Responses'].get(table.name, []))
+            request = response.get('UnprocessedKeys')
+    return items
+
+
+def batch_delete(table, keys):
+    """Deletes many items from a table by primary key, in as few BatchWriteItem calls as possible."""
+    keys = list(keys)
+    for i in range(0, len(keys), BATCH_WRITE_SIZE):
+        request = {table.name: [{"DeleteRequest": {"Key": key}} for key in keys[i:i + BATCH_WRITE_SIZE]]}
+        while request:
+            response = _instrumented(_tag(), f"{table.name}.batch_write_item", dynamo.batch_write_item, [],
+                                     RequestItems=request)
+            request = response.get('UnprocessedItems')
+
+
+def query_many(table, index, hash_key, values, **equal):
+    """
+    Gets the items of a table index whose hash key is any of values (and whose given attributes are equal to the given
+    values), in as few PartiQL statements as possible instead of one Query per key.
+    """
+    values = list(values)
+    conditions = "".join(f' AND "{name}" = ?' for name in equal)
+    items = []
+    for i in range(0, len(values), PARTIQL_IN_SIZE):
+        chunk = values[i:i + PARTIQL_IN_SIZE]
+        request = dict(
+            Statement=f'SELECT * FROM "{table.name}"."{index}" '
+                      f'WHERE "{hash_key}" IN [{", ".join("?" * len(chunk))}]{conditions}',
+            Parameters=chunk + list(equal.values())
+        )
+        while request:
+            response = _instrumented(_tag(), f"{table.name}.execute_statement", dynamo.meta.client.execute_statement,
+                                     **request)
+            items.extend(response['Items'])
+            request = dict(request, NextToken=response['NextToken']) if 'NextToken' in response else None
+    return items
+
+
+# sparse index of automation reports with an open PR, by submission branch (see lib.dedup.branch_name)
+SUBMISSION_KEY_INDEX = {
+    'IndexName': 'submission_key',
+    'KeySchema': [
+        {
+            'AttributeName': 'submission_key',
+            'KeyType': 'HASH'
+        },
+        {
+            'AttributeName': 'github_repo',
+            'KeyType': 'RANGE'
+        },
+    ],
+    'Projection': {
+        'ProjectionType': 'ALL',
+    },
+    'ProvisionedThroughput': {
+        'ReadCapacityUnits': 5,
+        'WriteCapacityUnits': 5
+    }
+}
+
+
 # set up the tables
 async def _setup():
     reports_table = dynamo.create_table(
@@ -83,6 +346,7 @@ async def _setup():
                     'WriteCapacityUnits': 10
                 }
             },
+            SUBMISSION_KEY_INDEX,
         ],
         AttributeDefinitions=[
             {
@@ -101,6 +365,10 @@ async def _setup():
                 'AttributeName': 'github_repo',
                 'AttributeType': 'S'
             },
+            {
+                'AttributeName': 'submission_key',
+                'AttributeType': 'S'
+            },
         ],
         ProvisionedThroughput={
             'ReadCapacityUnits': 10,
@@ -135,6 +403,99 @@ async def _setup():
     )
     print(report_nums_table)
 
+    # schema:
+    # {
+    #     "delivery_id": "72d3162e-cc78-11e3-81ab-4c9367dc0958",
+    #     "expires": 1400000000
+    # }
+    deliveries_table = dynamo.create_table(
+        TableName='taine.deliveries',
+        KeySchema=[
+            {
+                'AttributeName': 'delivery_id',
+                'KeyType': 'HASH'  # Partition key
+            }
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'delivery_id',
+                'AttributeType': 'S'
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+    deliveries_table.wait_until_exists()
+    dynamo.meta.client.update_time_to_live(
+        TableName='taine.deliveries',
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires'}
+    )
+    print(deliveries_table)
+
+    # schema (see lib.lease; items are never deleted, so tokens keep growing):
+    # {
+    #     "lease_id": "report:AVR-123",
+    #     "owner": "host:1234:0f1e2d3c",
+    #     "token": 42,
+    #     "expires": 1400000000000
+    # }
+    leases_table = dynamo.create_table(
+        TableName='taine.leases',
+        KeySchema=[
+            {
+                'AttributeName': 'lease_id',
+                'KeyType': 'HASH'  # Partition key
+            }
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'lease_id',
+                'AttributeType': 'S'
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+    print(leases_table)
+
+    # schema (see lib.bulk; one item per finished item of a bulk job, deleted once the whole job is done):
+    # {
+    #     "job": "reset_messages",
+    #     "item_id": "AVR-123"
+    # }
+    checkpoints_table = dynamo.create_table(
+        TableName='taine.checkpoints',
+        KeySchema=[
+            {
+                'AttributeName': 'job',
+                'KeyType': 'HASH'  # Partition key
+            },
+            {
+                'AttributeName': 'item_id',
+                'KeyType': 'RANGE'  # Sort key
+            }
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'job',
+                'AttributeType': 'S'
+            },
+            {
+                'AttributeName': 'item_id',
+                'AttributeType': 'S'
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+    print(checkpoints_table)
+
 
 if __name__ == '__main__':
     import asyncio
@@ -1,10 +1,11 @@
-"""Deterministic submission-key / branch-name derivation for user-submitted automations."""
+"""Deterministic submission-key / branch-name / content-hash derivation for user-submitted automations."""
 import hashlib
 import re
 
 BRANCH_PREFIX = "user-automation"
 SLUG_MAX_LEN = 50
 HASH_LEN = 12
+BATCH_KEY = "*batch*"  # hashed in place of an automation name for batch branches
 
 
 def slugify(automation_name: str) -> str:
@@ -15,15 +16,39 @@ def slugify(automation_name: str) -> str:
     return slug[:SLUG_MAX_LEN]
 
 
+def normalize_name(automation_name: str) -> str:
+    """Returns the form of an automation name that submissions are told apart by."""
+    return automation_name.strip().lower()
+
+
 def submission_hash(thread_id, user_id, automation_name: str) -> str:
     """Returns the first HASH_LEN hex chars of sha256 over (thread_id, user_id, normalized name)."""
-    normalized_name = automation_name.strip().lower()
+    normalized_name = normalize_name(automation_name)
     digest = hashlib.sha256(f"{thread_id}:{user_id}:{normalized_name}".encode()).hexdigest()
     return digest[:HASH_LEN]
 
 
+def submission_slug(thread_id, user_id, automation_name: str) -> str:
+    """Returns `<slug>-<hash>`, which names both an automation's branch and its file on any branch."""
+    return f"{slugify(automation_name)}-{submission_hash(thread_id, user_id, automation_name)}"
+
+
 def branch_name(thread_id, user_id, automation_name: str) -> str:
     """Returns the deterministic submission branch name: `user-automation/<slug>-<hash>`."""
-    slug = slugify(automation_name)
-    digest = submission_hash(thread_id, user_id, automation_name)
-    return f"{BRANCH_PREFIX}/{slug}-{digest}"
+    return f"{BRANCH_PREFIX}/{submission_slug(thread_id, user_id, automation_name)}"
+
+
+def batch_branch_name(thread_id, user_id) -> str:
+    """Returns the deterministic branch for a user's batch submissions in a thread: `user-automation/batch-<hash>`."""
+    digest = hashlib.sha256(f"{thread_id}:{user_id}:{BATCH_KEY}".encode()).hexdigest()
+    return f"{BRANCH_PREFIX}/batch-{digest[:HASH_LEN]}"
+
+
+def content_hash(content) -> str:
+    """
+    Returns the sha256 hex digest of submission content. Text is compared ignoring line endings and surrounding
+    whitespace; bytes (e.g. an archive) are hashed as-is.
+    """
+    if isinstance(content, str):
+        content = content.replace("\r\n", "\n").strip().encode()
+    return hashlib.sha256(content).hexdigest()
@@ -0,0 +1,62 @@
+"""Idempotency store for GitHub webhook deliveries, keyed on the X-GitHub-Delivery header."""
+import os
+import time
+
+from botocore.exceptions import ClientError
+from cachetools import LRUCache
+
+# how long a persisted delivery ID is remembered; GitHub only redelivers recent deliveries
+DELIVERY_TTL = 3 * 24 * 60 * 60
+# whether seen delivery IDs are also recorded in dynamo, so redeliveries are caught across restarts
+PERSIST_DELIVERIES = bool(os.environ.get("PERSIST_WEBHOOK_DELIVERIES"))
+
+
+class DeliveryCache:
+    """
+    A bounded set of seen delivery IDs. Lookups are served from memory; if a DynamoDB table is given,
+    first sightings are also recorded there with a conditional write so redeliveries are caught across restarts.
+    """
+
+    def __init__(self, maxsize=10000, table=None, ttl=DELIVERY_TTL):
+        self._seen = LRUCache(maxsize=maxsize)
+        self.table = table
+        self.ttl = ttl
+        self.received = 0
+        self.duplicates = 0
+
+    def add(self, delivery_id):
+        """Records a delivery. Returns True if it is new, or False if it is a duplicate."""
+        self.received += 1
+        if delivery_id in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen[delivery_id] = True
+
+        if self.table is not None:
+            try:
+                self.table.put_item(
+                    Item={"delivery_id": delivery_id, "expires": int(time.time()) + self.ttl},
+                    ConditionExpression="attribute_not_exists(delivery_id)"
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                self.duplicates += 1
+                return False
+        return True
+
+    def discard(self, delivery_id):
+        """Forgets a delivery, e.g. if processing it failed and a redelivery should be processed."""
+        self._seen.pop(delivery_id, None)
+        if self.table is not None:
+            self.table.delete_item(Key={"delivery_id": delivery_id})
+
+    @property
+    def duplicate_rate(self):
+        if not self.received:
+            return 0
+        return self.duplicates / self.received
+
+    def stats(self):
+        return {"received": self.received, "duplicates": self.duplicates, "duplicate_rate": self.duplicate_rate,
+                "size": len(self._seen)}
@@ -0,0 +1,100 @@
+"""Durable local queue of webhook events, shared by the ingest process (producer) and the bot (consumer)."""
+import json
+import sqlite3
+import time
+from collections import namedtuple
+
+QueuedEvent = namedtuple("QueuedEvent", "id delivery_id event_type data received_at")
+
+
+class EventQueue:
+    """
+    A FIFO of GitHub events stored in a SQLite database in WAL mode, so one process can enqueue while another
+    consumes. Events stay in the queue until they are acked, so a consumer crash redelivers them. Events that couldn't
+    be processed are moved to a dead-letter table, where they're kept for inspection.
+    """
+
+    def __init__(self, path, maxsize=10000):
+        self.path = path
+        self.maxsize = maxsize
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "delivery_id TEXT UNIQUE, "
+            "event_type TEXT NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "received_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_events ("
+            "id INTEGER PRIMARY KEY, "
+            "delivery_id TEXT, "
+            "event_type TEXT NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "received_at REAL NOT NULL, "
+            "failed_at REAL NOT NULL, "
+            "error TEXT)"
+        )
+
+    def put(self, event_type, payload, delivery_id=None):
+        """Enqueues a raw JSON payload. Returns False if an event with this delivery ID is already queued."""
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO events (delivery_id, event_type, payload, received_at) VALUES (?, ?, ?, ?)",
+            (delivery_id, event_type, payload, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def get(self, limit=10, after=0):
+        """
+        Returns up to limit of the oldest unacked events, without removing them. Pass the ID of the last event already
+        taken as after to get only the ones after it, e.g. while earlier events are still being processed.
+        """
+        rows = self.conn.execute(
+            "SELECT id, delivery_id, event_type, payload, received_at FROM events WHERE id > ? ORDER BY id LIMIT ?",
+            (after, limit)
+        ).fetchall()
+        return [QueuedEvent(id_, delivery_id, event_type, json.loads(payload), received_at)
+                for id_, delivery_id, event_type, payload, received_at in rows]
+
+    def ack(self, event_id):
+        """Removes a processed event from the queue."""
+        self.conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+
+    def fail(self, event_id, error=None):
+        """Moves an event that couldn't be processed from the queue to the dead-letter table."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dead_events "
+                "SELECT id, delivery_id, event_type, payload, received_at, ?, ? FROM events WHERE id = ?",
+                (time.time(), error, event_id)
+            )
+            self.conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def dead_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM dead_events").fetchone()[0]
+
+    def depth(self):
+        return self.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def is_full(self):
+        return self.depth() >= self.maxsize
+
+    def lag(self):
+        """Returns how many seconds the oldest unconsumed event has been waiting, or 0 if the queue is empty."""
+        oldest = self.conn.execute("SELECT MIN(received_at) FROM events").fetchone()[0]
+        if oldest is None:
+            return 0
+        return max(time.time() - oldest, 0)
+
+    def stats(self):
+        return {"depth": self.depth(), "lag_seconds": self.lag(), "maxsize": self.maxsize, "dead": self.dead_count()}
+
+    def close(self):
+        self.conn.close()
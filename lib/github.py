@@ -1,8 +1,67 @@
 import asyncio
 
-from github import Github, GithubException
+from cachetools import TTLCache
+from github import Github, GithubException, InputGitTreeElement
+from github.Issue import Issue
 from github.Repository import Repository
 
+# how long issue state learned from a webhook payload or our own mutation is trusted
+ISSUE_STATE_TTL = 60
+GITHUB_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class IssueStateCache:
+    """
+    Short-lived cache of issue title, state and label names, keyed by (repo name, issue number).
+    It is fed from webhook payloads and from the issues returned by our own edits, so that label computation
+    doesn't have to fetch the issue again. Older snapshots never overwrite newer ones.
+    """
+
+    def __init__(self, maxsize=1024, ttl=ISSUE_STATE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def hydrate(self, repo_name, issue):
+        """Caches the state of an issue from a webhook payload's ``issue`` object."""
+        self._store(repo_name, issue['number'], {
+            "title": issue['title'],
+            "state": issue['state'],
+            "labels": [lab['name'] for lab in issue['labels']],
+            "updated_at": issue.get('updated_at') or ""
+        })
+
+    def hydrate_from(self, repo_name, issue: Issue):
+        """Caches the state of a fully loaded PyGithub Issue, e.g. the one returned by an edit."""
+        self._store(repo_name, issue.number, {
+            "title": issue.title,
+            "state": issue.state,
+            "labels": [lab.name for lab in issue.labels],
+            "updated_at": issue.updated_at.strftime(GITHUB_TIMESTAMP_FORMAT) if issue.updated_at else ""
+        })
+
+    def _store(self, repo_name, issue_num, state):
+        key = (repo_name, issue_num)
+        current = self._cache.get(key)
+        if current is not None and current['updated_at'] > state['updated_at']:
+            return  # out-of-order delivery, keep the newer state
+        self._cache[key] = state
+
+    def get(self, repo_name, issue_num):
+        """Returns the cached {title, state, labels, updated_at} of an issue, or None if it is not fresh."""
+        state = self._cache.get((repo_name, issue_num))
+        if state is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return state
+
+    def invalidate(self, repo_name, issue_num):
+        self._cache.pop((repo_name, issue_num), None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
 
 class GitHubClient:
     _instance = None
@@ -10,6 +69,7 @@ class GitHubClient:
     def __init__(self, access_token, org):
         self.client = Github(access_token)
         self.repos = {}
+        self.issue_cache = IssueStateCache()
         org = self.client.get_organization(org)
 
         self.bug_project = None
@@ -42,6 +102,12 @@ class GitHubClient:
     def get_repo(self, repo, default='avrae/avrae'):
         return self.repos.get(repo, self.repos.get(default))
 
+    @staticmethod
+    def _issue(repo, issue_num):
+        """Returns a lazy Issue that can be edited or commented on without the GET that repo.get_issue makes."""
+        return Issue(repo._requester, {}, {"number": issue_num, "url": f"{repo.url}/issues/{issue_num}"},
+                     completed=False)
+
     async def create_issue(self, repo, title, description, labels=None):
         if labels is None:
             labels = []
@@ -51,14 +117,16 @@ class GitHubClient:
         def _():
             return repo.create_issue(title, description, labels=labels)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _)
+        issue = await asyncio.get_event_loop().run_in_executor(None, _)
+        self.issue_cache.hydrate_from(repo.full_name, issue)
+        return issue
 
     async def add_issue_comment(self, repo, issue_num, description):
         if not isinstance(repo, Repository):
             repo = self.get_repo(repo)
 
         def _():
-            issue = repo.get_issue(issue_num)
+            issue = self._issue(repo, issue_num)
             return issue.create_comment(description)
 
         return await asyncio.get_event_loop().run_in_executor(None, _)
@@ -68,65 +136,79 @@ class GitHubClient:
             repo = self.get_repo(repo)
 
         def _():
-            issue = repo.get_issue(issue_num)
+            issue = self._issue(repo, issue_num)
             issue.edit(labels=labels)
+            return issue
 
-        return await asyncio.get_event_loop().run_in_executor(None, _)
+        issue = await asyncio.get_event_loop().run_in_executor(None, _)
+        self.issue_cache.hydrate_from(repo.full_name, issue)
 
     async def get_issue_labels(self, repo, issue_num):
-        """Gets a list of issue label names."""
+        """Gets a list of issue label names, from the issue state cache if it is fresh."""
         if not isinstance(repo, Repository):
             repo = self.get_repo(repo)
 
+        if (state := self.issue_cache.get(repo.full_name, issue_num)) is not None:
+            return list(state['labels'])
+
         def _():
-            issue = repo.get_issue(issue_num)
-            return [lab.name for lab in issue.labels]
+            return repo.get_issue(issue_num)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _)
+        issue = await asyncio.get_event_loop().run_in_executor(None, _)
+        self.issue_cache.hydrate_from(repo.full_name, issue)
+        return [lab.name for lab in issue.labels]
 
     async def close_issue(self, repo, issue_num, comment=None):
         if not isinstance(repo, Repository):
             repo = self.get_repo(repo)
 
         def _():
-            issue = repo.get_issue(issue_num)
+            issue = self._issue(repo, issue_num)
             if comment:
                 issue.create_comment(comment)
             issue.edit(state="closed")
+            return issue
 
-        return await asyncio.get_event_loop().run_in_executor(None, _)
+        issue = await asyncio.get_event_loop().run_in_executor(None, _)
+        self.issue_cache.hydrate_from(repo.full_name, issue)
 
     async def open_issue(self, repo, issue_num, comment=None):
         if not isinstance(repo, Repository):
             repo = self.get_repo(repo)
 
         def _():
-            issue = repo.get_issue(issue_num)
+            issue = self._issue(repo, issue_num)
             if comment:
                 issue.create_comment(comment)
             issue.edit(state="open")
+            return issue
 
-        return await asyncio.get_event_loop().run_in_executor(None, _)
+        issue = await asyncio.get_event_loop().run_in_executor(None, _)
+        self.issue_cache.hydrate_from(repo.full_name, issue)
 
     async def rename_issue(self, repo, issue_num, new_title):
         if not isinstance(repo, Repository):
             repo = self.get_repo(repo)
 
         def _():
-            issue = repo.get_issue(issue_num)
+            issue = self._issue(repo, issue_num)
             issue.edit(title=new_title)
+            return issue
 
-        return await asyncio.get_event_loop().run_in_executor(None, _)
+        issue = await asyncio.get_event_loop().run_in_executor(None, _)
+        self.issue_cache.hydrate_from(repo.full_name, issue)
 
     async def edit_issue_body(self, repo, issue_num, new_body):
         if not isinstance(repo, Repository):
             repo = self.get_repo(repo)
 
         def _():
-            issue = repo.get_issue(issue_num)
+            issue = self._issue(repo, issue_num)
             issue.edit(body=new_body)
+            return issue
 
-        return await asyncio.get_event_loop().run_in_executor(None, _)
+        issue = await asyncio.get_event_loop().run_in_executor(None, _)
+        self.issue_cache.hydrate_from(repo.full_name, issue)
 
     async def add_issue_to_project(self, issue_num, is_bug):
 
@@ -174,6 +256,27 @@ class GitHubClient:
 
         return await asyncio.get_event_loop().run_in_executor(None, _)
 
+    async def commit_files(self, repo, branch, files, message):
+        """
+        Commits several files to `branch` as a single commit, through the git data API: one tree and one commit
+        however many files there are, instead of a read and a write per file. `files` is a dict of path -> content.
+        """
+        if not isinstance(repo, Repository):
+            repo = self.get_repo(repo)
+
+        def _():
+            ref = repo.get_git_ref(f"heads/{branch}")
+            parent = repo.get_git_commit(ref.object.sha)
+            tree = repo.create_git_tree(
+                [InputGitTreeElement(path, "100644", "blob", content=content) for path, content in files.items()],
+                base_tree=parent.tree
+            )
+            commit = repo.create_git_commit(message, tree, [parent])
+            ref.edit(commit.sha)
+            return commit
+
+        return await asyncio.get_event_loop().run_in_executor(None, _)
+
     async def create_draft_pr(self, repo, branch, base, title, body):
         """Opens a draft PR from `branch` into `base`."""
         if not isinstance(repo, Repository):
@@ -0,0 +1,73 @@
+"""The open feature requests ranked by score, kept up to date as reports change instead of rebuilt for every /top."""
+import bisect
+import time
+from collections import namedtuple
+
+# how long a loaded leaderboard is trusted before it's reloaded, in seconds; covers reports changed outside the bot
+# (e.g. by scripts)
+LEADERBOARD_REFRESH = 60 * 60
+# the same, when other bot processes change reports too (REPORT_LEASES): their votes only show up once it's reloaded
+SHARED_LEADERBOARD_REFRESH = 60
+
+# everything a /top row shows, so reading the top N touches neither the reports table nor Discord
+LeaderboardEntry = namedtuple("LeaderboardEntry", "report_id title score channel_id message_id")
+
+
+class Leaderboard:
+    """
+    Entries by report ID plus a ranking kept sorted by (-score, report ID). A vote moves one entry in O(log n) to find
+    plus a list shift; reading the top n is a slice. Until it's loaded from a full scan, it can't answer reads.
+    """
+
+    def __init__(self, refresh=LEADERBOARD_REFRESH):
+        self.refresh = refresh
+        self._entries = {}  # report ID -> LeaderboardEntry
+        self._ranking = []  # sorted (-score, report ID)
+        self._loaded_at = None
+        self.loads = 0
+        self.updates = 0
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh
+
+    def load(self, entries):
+        """Replaces the leaderboard with the given entries (every open feature request)."""
+        self._entries = {entry.report_id: entry for entry in entries}
+        self._ranking = sorted((-entry.score, entry.report_id) for entry in self._entries.values())
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+
+    def put(self, entry):
+        """Adds or updates a report's entry."""
+        self.updates += 1
+        old = self._entries.get(entry.report_id)
+        self._entries[entry.report_id] = entry
+        if old is not None:
+            if old.score == entry.score:
+                return
+            self._unrank(old)
+        bisect.insort(self._ranking, (-entry.score, entry.report_id))
+
+    def discard(self, report_id):
+        """Removes a report (e.g. once it's resolved), if it's on the leaderboard."""
+        old = self._entries.pop(report_id, None)
+        if old is not None:
+            self.updates += 1
+            self._unrank(old)
+
+    def _unrank(self, entry):
+        key = (-entry.score, entry.report_id)
+        i = bisect.bisect_left(self._ranking, key)
+        if i < len(self._ranking) and self._ranking[i] == key:
+            del self._ranking[i]
+
+    def top(self, n):
+        """Returns the n highest scoring entries, best first."""
+        return [self._entries[report_id] for _, report_id in self._ranking[:n]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"entries": len(self), "loaded": self.loaded, "loads": self.loads, "updates": self.updates}
@@ -0,0 +1,202 @@
+"""
+Expiring leases shared between bot processes, so that several of them can change the same reports without
+overwriting each other. A lease is held by one owner at a time and lapses if its owner stops renewing it (e.g. the
+process died). Every acquisition gets a fencing token greater than the last; writes made under a lease carry it, and
+storage refuses a write whose token is older than one it has already seen, so a holder that lost its lease without
+noticing (a long GC pause, a partition) can't clobber its successor's changes.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+# whether report changes take a lease in the taine.leases table; needed once more than one process changes reports
+REPORT_LEASES = bool(os.environ.get("REPORT_LEASES"))
+# how long a lease lasts unless renewed, in seconds; holders renew it every third of that
+LEASE_DURATION = float(os.environ.get("REPORT_LEASE_DURATION", 30))
+# how long to wait for a lease someone else holds before giving up, in seconds
+LEASE_ACQUIRE_TIMEOUT = 10
+LEASE_RETRY_MIN = 0.05
+LEASE_RETRY_MAX = 1
+
+log = logging.getLogger(__name__)
+
+
+class LeaseError(Exception):
+    pass
+
+
+class LeaseTimeout(LeaseError):
+    pass
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+# ==== stores ====
+class MemoryLeaseStore:
+    """Leases in a dict, for a single process and for tests."""
+
+    def __init__(self):
+        self._leases = {}  # name -> (owner, token, expires in epoch ms)
+
+    def acquire(self, name, owner, duration):
+        """Takes the lease if it's free, lapsed or already ours. Returns its new fencing token, or None if it's held."""
+        now = _now_ms()
+        held_by, token, expires = self._leases.get(name, (None, 0, 0))
+        if held_by is not None and held_by != owner and expires > now:
+            return None
+        self._leases[name] = (owner, token + 1, now + int(duration * 1000))
+        return token + 1
+
+    def renew(self, name, owner, token, duration):
+        """Extends a lease we hold. Returns False if it's no longer ours."""
+        held_by, held_token, _ = self._leases.get(name, (None, 0, 0))
+        if held_by != owner or held_token != token:
+            return False
+        self._leases[name] = (owner, token, _now_ms() + int(duration * 1000))
+        return True
+
+    def release(self, name, owner, token):
+        held_by, held_token, _ = self._leases.get(name, (None, 0, 0))
+        if held_by == owner and held_token == token:
+            self._leases[name] = (None, token, 0)  # keep the token, so the next one is still greater
+
+
+class DynamoLeaseStore:
+    """
+    Leases as items of a DynamoDB table ({lease_id, owner, token, expires}), changed only by conditional writes on the
+    item as it was read, so two processes can't both take one. Items are never deleted: the token has to keep growing.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def _put(self, item, condition):
+        try:
+            self.table.put_item(Item=item, ConditionExpression=condition)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return False
+        return True
+
+    def acquire(self, name, owner, duration):
+        now = _now_ms()
+        current = self.table.get_item(Key={"lease_id": name}, ConsistentRead=True).get('Item')
+        if current is None:
+            token = 1
+            condition = Attr("lease_id").not_exists()
+        else:
+            if current.get('owner') not in (None, owner) and current['expires'] > now:
+                return None
+            token = int(current['token']) + 1
+            condition = Attr("token").eq(current['token']) & Attr("expires").eq(current['expires'])
+        item = {"lease_id": name, "owner": owner, "token": token, "expires": now + int(duration * 1000)}
+        return token if self._put(item, condition) else None
+
+    def renew(self, name, owner, token, duration):
+        item = {"lease_id": name, "owner": owner, "token": token, "expires": _now_ms() + int(duration * 1000)}
+        return self._put(item, Attr("owner").eq(owner) & Attr("token").eq(token))
+
+    def release(self, name, owner, token):
+        item = {"lease_id": name, "owner": None, "token": token, "expires": 0}
+        self._put(item, Attr("owner").eq(owner) & Attr("token").eq(token))
+
+
+# ==== leases ====
+class Lease:
+    def __init__(self, name, owner, token, deadline):
+        self.name = name
+        self.owner = owner
+        self.token = token
+        # when it lapses by our clock, counted from before it was last taken or renewed, so we never think we hold it
+        # longer than the store does
+        self.deadline = deadline
+        self.lost = False
+
+    @property
+    def valid(self):
+        return not self.lost and time.monotonic() < self.deadline
+
+
+class LeaseManager:
+    """
+    Takes leases from a store on behalf of this process, retrying with backoff while someone else holds one, and
+    renews each lease in the background until it's released.
+    """
+
+    def __init__(self, store, owner=None, duration=LEASE_DURATION, timeout=LEASE_ACQUIRE_TIMEOUT):
+        self.store = store
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.duration = duration
+        self.timeout = timeout
+        self._renewals = {}  # Lease -> renewal task
+        self.acquisitions = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.lost = 0
+
+    async def acquire(self, name):
+        """Takes the named lease, waiting up to the timeout for it. Raises LeaseTimeout if it stays held."""
+        deadline = time.monotonic() + self.timeout
+        delay = LEASE_RETRY_MIN
+        while True:
+            start = time.monotonic()
+            token = self.store.acquire(name, self.owner, self.duration)
+            if token is not None:
+                break
+            if time.monotonic() >= deadline:
+                self.timeouts += 1
+                raise LeaseTimeout(f"Timed out waiting for the lease on {name}")
+            self.retries += 1
+            await asyncio.sleep(min(delay * random.uniform(0.5, 1.5), max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, LEASE_RETRY_MAX)
+
+        self.acquisitions += 1
+        lease = Lease(name, self.owner, token, start + self.duration)
+        self._renewals[lease] = asyncio.ensure_future(self._renew(lease))
+        return lease
+
+    async def _renew(self, lease):
+        while True:
+            await asyncio.sleep(self.duration / 3)
+            start = time.monotonic()
+            try:
+                renewed = self.store.renew(lease.name, lease.owner, lease.token, self.duration)
+            except Exception as e:  # e.g. throttled; try again next time, the lease holds until its deadline
+                log.warning(f"Could not renew the lease on {lease.name}: {e!r}")
+                continue
+            if not renewed:
+                log.warning(f"Lost the lease on {lease.name} (token {lease.token})")
+                lease.lost = True
+                self.lost += 1
+                return
+            lease.deadline = start + self.duration
+
+    async def release(self, lease):
+        if (renewal := self._renewals.pop(lease, None)) is not None:
+            renewal.cancel()
+        if not lease.lost:
+            lease.lost = True  # nothing may be written under it any more
+            self.store.release(lease.name, lease.owner, lease.token)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, name):
+        lease = await self.acquire(name)
+        try:
+            yield lease
+        finally:
+            await self.release(lease)
+
+    def stats(self):
+        return {"held": len(self._renewals), "acquisitions": self.acquisitions, "retries": self.retries,
+                "timeouts": self.timeouts, "lost": self.lost}
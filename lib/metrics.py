@@ -0,0 +1,56 @@
+"""In-process metrics registry. Components register a provider returning a dict of their current stats."""
+import bisect
+
+# bucket upper bounds for histograms of durations, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_providers = {}
+
+
+def register(name, provider):
+    """Registers (or replaces) the stats provider for a component."""
+    _providers[name] = provider
+
+
+def snapshot():
+    """Returns {component name: stats dict} for every registered provider."""
+    return {name: provider() for name, provider in _providers.items()}
+
+
+class Histogram:
+    """
+    Counts of observed values by bucket (each bucket holds the values up to its bound and above the one before), with
+    their total and maximum. Percentiles are estimated as the bound of the bucket they fall in.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # the last bucket holds everything over the highest bound
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else 0, "max": self.max,
+            "p50": self.percentile(0.5), "p95": self.percentile(0.95), "p99": self.percentile(0.99),
+            "buckets": {**{str(bound): count for bound, count in zip(self.bounds, self.counts)},
+                        "inf": self.counts[-1]},
+        }
@@ -0,0 +1,192 @@
+"""
+Event loop stall detection. A sampler task measures how late the loop wakes it (its scheduling lag); meanwhile a
+watchdog thread notices when the sampler is overdue - the loop is stuck in some callback - and captures the loop
+thread's stack right then, so each stall is pinned on the line of our code that was blocking. Stalls are aggregated by
+that call site.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from cachetools import LRUCache
+
+from lib import metrics
+
+# how often the loop's scheduling lag is sampled, and how late a wakeup must be to count as a stall, in seconds
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", 0.25))
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", 0.1))
+# how many distinct blocking call sites to keep, how many stack frames to keep for each, and how many recent lag
+# samples the percentiles are taken over
+MAX_STALL_SITES = 200
+STALL_STACK_DEPTH = 8
+LAG_SAMPLES = 1000
+# stalls the watchdog didn't catch in the act (shorter than its polling interval)
+UNATTRIBUTED = "(unattributed)"
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+log = logging.getLogger(__name__)
+
+
+def _own_code(filename):
+    return filename.startswith(PROJECT_ROOT) and "site-packages" not in filename and filename != __file__
+
+
+def _format_frame(frame):
+    filename = frame.filename
+    if filename.startswith(PROJECT_ROOT):
+        filename = os.path.relpath(filename, PROJECT_ROOT)
+    return f"{filename}:{frame.lineno} in {frame.name}"
+
+
+def blocking_site(stack):
+    """
+    Returns the frame a stack (outermost first) is blamed on: the innermost frame of our own code, since that's the
+    line that made the blocking call, or the innermost frame if none of it is ours.
+    """
+    for frame in reversed(stack):
+        if _own_code(frame.filename):
+            return frame
+    return stack[-1]
+
+
+class StallSite:
+    __slots__ = ("site", "count", "total", "max", "stack")
+
+    def __init__(self, site):
+        self.site = site
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stack = []  # the innermost frames of the latest stall here, outermost first
+
+    def add(self, lag, stack):
+        self.count += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+        if stack:
+            self.stack = stack
+
+    def to_dict(self):
+        return {"site": self.site, "count": self.count, "total_s": self.total, "max_s": self.max, "stack": self.stack}
+
+
+class LoopMonitor:
+    """Samples the running loop's scheduling lag and attributes each stall over the threshold to a call site."""
+
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL, threshold=LOOP_STALL_THRESHOLD, max_sites=MAX_STALL_SITES):
+        self.interval = interval
+        self.threshold = threshold
+        self.sites = LRUCache(maxsize=max_sites)  # call site -> StallSite
+        self._lags = deque(maxlen=LAG_SAMPLES)
+        self.samples = 0
+        self.stalls = 0
+        self.stalled = 0.0
+        self.lag_max = 0.0
+
+        self._task = None
+        self._watchdog = None
+        self._stopping = None
+        self._loop_thread = None
+        self._lock = threading.Lock()
+        self._due = None  # when the sampler should next wake up, by time.monotonic()
+        self._captured = None  # (due, site, stack) the watchdog caught the loop blocked at
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        """Starts monitoring the running event loop. Must be called from the loop's thread."""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._stopping = threading.Event()
+        self._task = asyncio.ensure_future(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, args=(self._stopping,), name="loop-watchdog",
+                                          daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self._stopping.set()
+        self._watchdog = None
+        self._due = None
+
+    async def _sample(self):
+        while True:
+            start = time.monotonic()
+            self._due = start + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(time.monotonic() - start - self.interval, 0))
+
+    def record(self, lag):
+        """Records one scheduling lag sample, and the stall it's evidence of if it's over the threshold."""
+        self.samples += 1
+        self._lags.append(lag)
+        self.lag_max = max(self.lag_max, lag)
+        with self._lock:
+            captured, self._captured = self._captured, None
+        if lag < self.threshold:
+            return
+
+        self.stalls += 1
+        self.stalled += lag
+        _, site, stack = captured or (None, UNATTRIBUTED, [])
+        if (entry := self.sites.get(site)) is None:
+            entry = self.sites[site] = StallSite(site)
+        entry.add(lag, stack)
+        log.warning(f"Event loop blocked for {lag * 1000:.0f} ms at {site}")
+
+    def _watch(self, stopping):
+        while not stopping.wait(self.threshold / 2):
+            due = self._due
+            if due is None or time.monotonic() < due + self.threshold:
+                continue
+            with self._lock:
+                if self._captured is not None and self._captured[0] == due:  # already caught this stall
+                    continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            if not stack:
+                continue
+            site = blocking_site(stack)
+            inner = stack[-STALL_STACK_DEPTH:]
+            with self._lock:
+                self._captured = (due, _format_frame(site), [_format_frame(f) for f in inner])
+
+    def top_sites(self, n=10):
+        """The call sites that blocked the loop for longest in total, worst first."""
+        return sorted(self.sites.values(), key=lambda s: s.total, reverse=True)[:n]
+
+    def reset(self):
+        self.sites.clear()
+        self._lags.clear()
+        self.samples = 0
+        self.stalls = 0
+        self.stalled = 0.0
+        self.lag_max = 0.0
+
+    def stats(self):
+        lags = sorted(self._lags)
+
+        def percentile(p):
+            return lags[min(int(len(lags) * p), len(lags) - 1)] if lags else 0
+
+        return {"running": self.running, "samples": self.samples, "stalls": self.stalls, "stalled_s": self.stalled,
+                "lag_p50_s": percentile(0.5), "lag_p99_s": percentile(0.99), "lag_max_s": self.lag_max,
+                "sites": [site.to_dict() for site in self.top_sites()]}
+
+
+monitor = LoopMonitor()
+metrics.register("event_loop", monitor.stats)
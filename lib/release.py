@@ -0,0 +1,74 @@
+"""
+Resolving every pending report when a build is released, closing many reports at once instead of one after another.
+"""
+import asyncio
+import logging
+from collections import namedtuple
+
+from lib.reports import Report
+
+# how many reports may be closing on GitHub or Discord at once
+RELEASE_CONCURRENCY = 8
+
+# released: the reports that were resolved; failures: report ID -> exception for the ones that weren't;
+# notifying: the background task notifying the released reports' subscribers
+ReleaseResult = namedtuple("ReleaseResult", "released failures notifying")
+
+log = logging.getLogger(__name__)
+# keeps a reference to background notification tasks until they're done
+_background = set()
+
+
+async def release_reports(ctx, reports, concurrency=RELEASE_CONCURRENCY):
+    """
+    Resolves reports for a release:
+
+    1. closes each report under its lock, ``concurrency`` reports at a time: reloads it, closes its GitHub issue,
+       deletes its tracker message and saves it resolved;
+    2. notifies the released reports' subscribers in the background, so the release isn't held up by DMs.
+
+    A report that fails to close is left pending, so the next release picks it up again; one that's no longer pending
+    by the time it's reached (e.g. unpended meanwhile) is skipped. Returns a ReleaseResult.
+    """
+    limit = asyncio.Semaphore(concurrency)
+    closed = {}
+    failures = {}
+
+    async def close(report_id):
+        async with limit:
+            try:
+                async with Report.locked(report_id) as report:
+                    if not report.pending:
+                        return
+                    if report.github_issue:
+                        await report.close_github_issue()
+                    await report.delete_message(ctx)
+                    report.severity = -1
+                    report.pending = False
+                    report.commit()
+            except Exception as e:
+                log.warning(f"Could not release {report_id}: {e!r}")
+                failures[report_id] = e
+            else:
+                closed[report_id] = report
+
+    await asyncio.gather(*(close(report.report_id) for report in reports))
+    released = [closed[report.report_id] for report in reports if report.report_id in closed]
+
+    notifying = asyncio.ensure_future(notify_released(ctx, released, concurrency))
+    _background.add(notifying)
+    notifying.add_done_callback(_background.discard)
+    return ReleaseResult(released, failures, notifying)
+
+
+async def notify_released(ctx, reports, concurrency=RELEASE_CONCURRENCY):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def notify(report):
+        async with limit:
+            try:
+                await report.notify_subscribers(ctx, "Report closed.")
+            except Exception as e:
+                log.warning(f"Could not notify the subscribers of {report.report_id}: {e!r}")
+
+    await asyncio.gather(*(notify(report) for report in reports))
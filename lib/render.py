@@ -0,0 +1,80 @@
+"""Coalesces tracker embed edits, so a burst of votes on one report costs a single message edit."""
+import asyncio
+import logging
+import time
+
+import disnake
+from cachetools import TTLCache
+
+# minimum seconds between two edits of the same tracker message
+EMBED_EDIT_INTERVAL = 5
+
+log = logging.getLogger(__name__)
+
+
+class EmbedRenderScheduler:
+    """
+    Edits a message at most once per ``interval`` seconds. The first update of a quiet message is sent right away;
+    updates that arrive within the interval mark it dirty, and only the latest embed is sent when the interval ends.
+    """
+
+    def __init__(self, interval=EMBED_EDIT_INTERVAL, maxsize=10000, on_missing=None):
+        self.interval = interval
+        self.on_missing = on_missing  # called with the message ID if an edit finds the message deleted
+        self._dirty = {}  # message id -> (message, embed)
+        self._timers = {}  # message id -> flush task
+        self._last_edit = TTLCache(maxsize=maxsize, ttl=interval, timer=time.monotonic)
+        self.requested = 0
+        self.performed = 0
+        self.failed = 0
+
+    def schedule(self, message, embed):
+        """Marks a message dirty with its latest embed, editing it now or at the end of its interval."""
+        self.requested += 1
+        self._dirty[message.id] = (message, embed)
+        if message.id in self._timers:
+            return  # a flush is already scheduled and will pick up this embed
+        last = self._last_edit.get(message.id)
+        delay = 0 if last is None else max(last + self.interval - time.monotonic(), 0)
+        self._timers[message.id] = asyncio.get_event_loop().create_task(self._flush_later(message.id, delay))
+
+    def discard(self, message_id):
+        """Drops any pending edit of a message, e.g. because it is being deleted."""
+        self._dirty.pop(message_id, None)
+        timer = self._timers.pop(message_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def _flush_later(self, message_id, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        await self._flush(message_id)
+
+    async def _flush(self, message_id):
+        self._timers.pop(message_id, None)
+        pending = self._dirty.pop(message_id, None)
+        if pending is None:
+            return
+        message, embed = pending
+        self._last_edit[message_id] = time.monotonic()
+        self.performed += 1
+        try:
+            await message.edit(embed=embed)
+        except disnake.NotFound:
+            self.failed += 1
+            if self.on_missing is not None:
+                self.on_missing(message_id)
+        except disnake.HTTPException as e:
+            self.failed += 1
+            log.warning(f"Could not edit tracker message {message_id}: {e}")
+
+    async def flush_all(self):
+        """Sends every pending edit immediately, e.g. on shutdown."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        await asyncio.gather(*(self._flush(message_id) for message_id in list(self._dirty)))
+
+    def stats(self):
+        return {"requested": self.requested, "performed": self.performed, "failed": self.failed,
+                "edits_saved": self.requested - self.performed - len(self._dirty), "pending": len(self._dirty)}
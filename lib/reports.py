@@ -1,16 +1,24 @@
+import asyncio
+import contextlib
+import contextvars
 import logging
 import os
 import re
+import time
 from decimal import Decimal
 
 import disnake
-from boto3.dynamodb.conditions import Key
-from cachetools import LRUCache
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from cachetools import LRUCache, TTLCache
 
 import constants
 import lib.db as ddb
-from lib import dedup
+from lib import dedup, metrics
 from lib.github import GitHubClient
+from lib.leaderboard import LEADERBOARD_REFRESH, Leaderboard, LeaderboardEntry, SHARED_LEADERBOARD_REFRESH
+from lib.lease import DynamoLeaseStore, LeaseManager, LeaseTimeout, REPORT_LEASES
+from lib.render import EmbedRenderScheduler
 
 PRIORITY = {
     -2: "Patch Pending", -1: "Resolved",
@@ -50,6 +58,12 @@ UPVOTE_REACTION = "\U0001f44d"
 DOWNVOTE_REACTION = "\U0001f44e"
 INFO_REACTION = "\u2139"
 THREAD_REACTION = "\U0001f9f5"  # :thread:
+# tracker message buttons have the custom ID "report:<action>:<report ID>", so a click goes straight to its report
+BUTTON_ID_PREFIX = "report:"
+UPVOTE_ACTION = "upvote"
+DOWNVOTE_ACTION = "downvote"
+INFO_ACTION = "info"
+THREAD_ACTION = "thread"
 # how many upvotes a feature req needs to be added to GitHub
 GITHUB_THRESHOLD = int(os.environ.get("FR_APPROVE_THRESHOLD", 5))
 # how many downvotes a feature req needs to be closed automatically
@@ -61,10 +75,28 @@ CLOSE_THRESHOLD = int(os.environ.get("FR_DENY_THRESHOLD", -3))
 MESSAGE_SENTINEL = 0
 GITHUB_ISSUE_SENTINEL = 0
 THREAD_ID_SENTINEL = 0
+# how many tracker message handles (message ID -> channel ID) to remember; enough to cover every open report
+MESSAGE_HANDLE_CACHE_SIZE = 20000
+# how many rendered embeds to keep, and for how long - detailed embeds show member names, which can change
+EMBED_CACHE_SIZE = 1000
+EMBED_CACHE_TTL = 10 * 60
+# the number fields of a stored report (reporter and subscribers are converted separately)
+INT_FIELDS = ('severity', 'verification', 'upvotes', 'downvotes', 'message', 'github_issue', 'thread_id',
+              'lease_token')
+# how many report threads (thread ID -> Thread, or THREAD_ABSENT) to remember, and for how long; thread gateway
+# events keep entries current, the TTL covers any events missed while disconnected
+THREAD_HANDLE_CACHE_SIZE = 5000
+THREAD_HANDLE_CACHE_TTL = 60 * 60
+THREAD_ABSENT = object()
+# how long to remember which GitHub issue a report ID links to, for reports mentioned in text
+REPORT_LINK_CACHE_TTL = 5 * 60
+REPORT_ID_RE = re.compile(r"(\w{3,}-\d{3,})")
 log = logging.getLogger(__name__)
 
 
 class Attachment:
+    __slots__ = ("author", "message", "veri")
+
     def __init__(self, author, message: str = None, veri: int = 0):
         self.author = author
         self.message = message or None
@@ -72,7 +104,9 @@ class Attachment:
 
     @classmethod
     def from_dict(cls, attachment):
-        return cls(**attachment)
+        author = attachment['author']
+        return cls(int(author) if type(author) is Decimal else author, attachment.get('message'),
+                   int(attachment.get('veri', 0)))
 
     def to_dict(self):
         return {"author": self.author, "message": self.message, "veri": self.veri}
@@ -94,13 +128,99 @@ class Attachment:
         return cls(author, msg, -1)
 
 
+# report ID -> (repo, issue number) or None, shared by everything that links report IDs to GitHub
+report_links = TTLCache(maxsize=10000, ttl=REPORT_LINK_CACHE_TTL)
+
+
+class _ReportLock:
+    __slots__ = ("lock", "holders", "report", "lease")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.holders = 0  # tasks holding or waiting for the lock
+        self.report = None  # the report the holders share, once the first of them has loaded it
+        self.lease = None  # the holders' lease on the report, if other processes change reports too
+
+
+class ReportLocks:
+    """
+    One asyncio lock per report ID, created when a task first asks for it and dropped once no task holds or waits for
+    it, so there are only ever as many locks as reports being worked on. Tasks queued on the same report share the
+    Report its first holder loaded, each seeing the changes of the ones before it.
+    """
+
+    def __init__(self):
+        self._locks = {}  # report ID -> _ReportLock
+        self.acquisitions = 0
+        self.contended = 0  # acquisitions that had to wait for another holder
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @contextlib.asynccontextmanager
+    async def hold(self, report_id):
+        entry = self._locks.get(report_id)
+        if entry is None:
+            entry = self._locks[report_id] = _ReportLock()
+        entry.holders += 1
+        try:
+            if entry.lock.locked():
+                self.contended += 1
+                start = time.monotonic()
+                await entry.lock.acquire()
+                waited = time.monotonic() - start
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            else:
+                await entry.lock.acquire()
+            self.acquisitions += 1
+            try:
+                yield entry
+            finally:
+                entry.lock.release()
+        finally:
+            entry.holders -= 1
+            if not entry.holders:
+                del self._locks[report_id]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def stats(self):
+        return {"held": len(self), "acquisitions": self.acquisitions, "contended": self.contended,
+                "wait_total_s": self.wait_total, "wait_max_s": self.wait_max}
+
+
 class Report:
-    message_cache = LRUCache(maxsize=100)
+    __slots__ = ("reporter", "report_id", "title", "severity", "_attachments", "_stored_attachments", "message",
+                 "subscribers", "repo", "github_issue", "is_bug", "is_automation", "verification", "upvotes",
+                 "downvotes", "pending", "thread_id", "automation_name", "submission_key", "automation_names",
+                 "_voters", "lease_token", "_lease")
+    # message ID -> ID of the channel it was posted in, or None if the message is known to be gone
+    message_cache = LRUCache(maxsize=MESSAGE_HANDLE_CACHE_SIZE)
+    render_scheduler = EmbedRenderScheduler()
+    # (report ID, embed version, detailed, guild ID) -> embed dict
+    embed_cache = TTLCache(maxsize=EMBED_CACHE_SIZE, ttl=EMBED_CACHE_TTL)
+    embed_cache_hits = 0
+    embed_cache_misses = 0
+    # thread ID -> Thread, or THREAD_ABSENT if there is no such thread; holds the threads the gateway cache doesn't
+    thread_cache = TTLCache(maxsize=THREAD_HANDLE_CACHE_SIZE, ttl=THREAD_HANDLE_CACHE_TTL)
+    thread_cache_hits = 0
+    thread_cache_misses = 0
+    # the open feature requests by score, for /top
+    leaderboard = Leaderboard(refresh=SHARED_LEADERBOARD_REFRESH if REPORT_LEASES else LEADERBOARD_REFRESH)
+    locks = ReportLocks()
+    # leases on reports shared with other bot processes, or None if this is the only one
+    leases = LeaseManager(DynamoLeaseStore(ddb.leases)) if REPORT_LEASES else None
+    # report ID -> the in-flight read of that report, which every concurrent load of it waits on
+    _loading = {}
+    loads = 0
+    shared_loads = 0
 
     def __init__(self, reporter, report_id: str, title: str, severity: int, verification: int, attachments: list,
                  message, upvotes: int = 0, downvotes: int = 0, github_issue: int = None, github_repo: str = None,
                  subscribers: list = None, is_bug: bool = True, is_automation: bool = False, pending: bool = False,
-                 thread_id: int = None, automation_name: str = None):
+                 thread_id: int = None, automation_name: str = None, submission_key: str = None,
+                 automation_names: list = None, voters: dict = None, lease_token: int = 0):
         if subscribers is None:
             subscribers = []
         if github_repo is None:
@@ -133,16 +253,28 @@ class Report:
 
         self.thread_id = int(thread_id)
         self.automation_name = automation_name
+        # the submission branch of an automation with an open PR, indexed so resubmissions find this report
+        self.submission_key = submission_key
+        # the names of the automations in a batch submission (automation_name is None for batches)
+        self.automation_names = automation_names or []
+        # str(author) -> veri of everyone who has voted on or verified this report, so repeat votes are caught without
+        # going through the attachments; None until it's loaded or built from them. Only the keys are ever read, so
+        # stored veris are left as Decimals
+        self._voters = voters
+        # the fencing token of the last lease this report was written under (see lib.lease), and the lease it's held
+        # under now, if any
+        self.lease_token = lease_token
+        self._lease = None
 
     @classmethod
     async def new(cls, reporter, report_id: str, title: str, attachments: list, is_bug=True, is_automation=False,
-                 repo=None, thread_id=None, automation_name=None):
+                 repo=None, thread_id=None, automation_name=None, automation_names=None):
         subscribers = None
         if isinstance(reporter, (int, Decimal)):
             subscribers = [reporter]
         inst = cls(reporter, report_id, title, 6, 0, attachments, None, subscribers=subscribers, is_bug=is_bug,
                    is_automation=is_automation, github_repo=repo, thread_id=thread_id,
-                   automation_name=automation_name)
+                   automation_name=automation_name, automation_names=automation_names)
         return inst
 
     @classmethod
@@ -166,18 +298,78 @@ class Report:
 
     @classmethod
     def from_dict(cls, report_dict):
-        report_dict['attachments'] = [Attachment.from_dict(a) for a in report_dict['attachments']]
-        return cls(**report_dict)
+        """
+        Loads a report from its stored dict, which is left unmodified. DynamoDB returns every number as a Decimal;
+        they're converted to ints here, once, so nothing downstream does slow Decimal arithmetic on them. The
+        attachments stay as the stored dicts until something reads them, since most loads (scans, searches,
+        rankings) never do.
+        """
+        data = {**report_dict, 'attachments': None}
+        for field in INT_FIELDS:
+            if type(value := data.get(field)) is Decimal:
+                data[field] = int(value)
+        if type(data['reporter']) is Decimal:
+            data['reporter'] = int(data['reporter'])
+        data['subscribers'] = [int(s) for s in data.get('subscribers', ())]
+        report = cls(**data)
+        report._stored_attachments = report_dict['attachments']
+        return report
+
+    @property
+    def attachments(self):
+        if self._stored_attachments is not None:
+            self._attachments = [Attachment.from_dict(a) for a in self._stored_attachments]
+            self._stored_attachments = None
+        return self._attachments
+
+    @attachments.setter
+    def attachments(self, value):
+        self._attachments = value
+        self._stored_attachments = None
+
+    @property
+    def voters(self):
+        if self._voters is None:  # stored before reports kept voters
+            if self._stored_attachments is not None:
+                votes = ((a['author'], a.get('veri', 0)) for a in self._stored_attachments)
+            else:
+                votes = ((a.author, a.veri) for a in self._attachments)
+            self._voters = {}
+            for author, veri in votes:
+                if veri:
+                    self._voters.setdefault(str(author), int(veri))
+        return self._voters
+
+    def has_voted(self, author):
+        return str(author) in self.voters
+
+    @property
+    def attachment_count(self):
+        if self._stored_attachments is not None:
+            return len(self._stored_attachments)
+        return len(self._attachments)
 
     def to_dict(self):
-        return {
+        if self._stored_attachments is not None:
+            attachments = self._stored_attachments
+        else:
+            attachments = [a.to_dict() for a in self._attachments]
+        out = {
             'reporter': self.reporter, 'report_id': self.report_id, 'title': self.title, 'severity': self.severity,
             'verification': self.verification, 'upvotes': self.upvotes, 'downvotes': self.downvotes,
-            'attachments': [a.to_dict() for a in self.attachments], 'message': self.message,
+            'attachments': attachments, 'message': self.message,
             'github_issue': self.github_issue, 'github_repo': self.repo, 'subscribers': self.subscribers,
             'is_bug': self.is_bug, 'is_automation': self.is_automation, 'pending': self.pending,
-            'thread_id': self.thread_id, 'automation_name': self.automation_name
+            'thread_id': self.thread_id, 'automation_name': self.automation_name, 'voters': self.voters
         }
+        # index keys can't be null; leaving the attribute out keeps the report out of the sparse index
+        if self.submission_key is not None:
+            out['submission_key'] = self.submission_key
+        if self.automation_names:
+            out['automation_names'] = self.automation_names
+        if self.lease_token:
+            out['lease_token'] = self.lease_token
+        return out
 
     @classmethod
     def from_id(cls, report_id):
@@ -187,7 +379,93 @@ class Report:
         try:
             return cls.from_dict(response['Item'])
         except KeyError:
-            raise ReportException("Report not found.")
+            raise ReportNotFound("Report not found.")
+
+    @classmethod
+    async def load(cls, report_id):
+        """
+        Loads a report without blocking the event loop. Concurrent loads of the same report share one read; each
+        caller still gets its own Report.
+        """
+        report_id = report_id.upper()
+        loading = cls._loading.get(report_id)
+        if loading is None:
+            cls.loads += 1
+
+            # under a lease, the report must be read as the last holder left it
+            consistent = cls.leases is not None
+
+            def _():
+                return ddb.reports.get_item(Key={"report_id": report_id}, ConsistentRead=consistent).get('Item')
+
+            # in the caller's context, so the read is counted under its db.operation()
+            loading = cls._loading[report_id] = asyncio.get_event_loop().run_in_executor(
+                None, contextvars.copy_context().run, _)
+            loading.add_done_callback(lambda _: cls._loading.pop(report_id, None))
+        else:
+            cls.shared_loads += 1
+        item = await asyncio.shield(loading)
+        if item is None:
+            raise ReportNotFound("Report not found.")
+        return cls.from_dict(item)
+
+    @classmethod
+    @contextlib.asynccontextmanager
+    async def locked(cls, report_id, new=None):
+        """
+        Loads a report to change it, holding its lock so that concurrent changes to the report (a vote, a command and
+        a webhook, say) apply one after another instead of overwriting each other. Commit inside the block.
+
+        Pass a report that hasn't been saved yet as ``new`` to hold its lock while it's set up: anything that reaches
+        it in the meantime (e.g. a click on its freshly posted tracker message) waits until it's committed.
+
+        If reports are leased, the lease is taken before loading the report and held until no task in this process is
+        waiting on the report, and commits inside the block are fenced by it.
+        """
+        report_id = report_id.upper()
+        async with cls.locks.hold(report_id) as entry:
+            if cls.leases is not None and (entry.lease is None or not entry.lease.valid):
+                if entry.lease is not None:  # lapsed; another process may have changed the report since
+                    await cls.leases.release(entry.lease)
+                    entry.report = None
+                try:
+                    entry.lease = await cls.leases.acquire(f"report:{report_id}")
+                except LeaseTimeout:
+                    raise ReportException("This report is being changed elsewhere, try again in a moment.")
+            try:
+                if new is not None:
+                    entry.report = new
+                elif entry.report is None:
+                    entry.report = await cls.load(report_id)
+                entry.report._lease = entry.lease
+                try:
+                    yield entry.report
+                except BaseException:
+                    entry.report = None  # it may be half changed; the next holder reads it again
+                    raise
+            finally:
+                if entry.lease is not None and entry.holders == 1:  # nobody here is waiting to change it next
+                    await cls.leases.release(entry.lease)
+                    entry.lease = None
+                    entry.report = None
+
+    @classmethod
+    def lock_stats(cls):
+        return {**cls.locks.stats(), "loads": cls.loads, "shared_loads": cls.shared_loads}
+
+    @classmethod
+    def from_ids(cls, report_ids):
+        """Loads many reports in one batched read. Returns a dict of report ID -> Report; missing IDs are left out."""
+        keys = list(dict.fromkeys(report_id.upper() for report_id in report_ids))
+        reports = {}
+        for item in ddb.batch_get(ddb.reports, [{"report_id": report_id} for report_id in keys]):
+            report = cls.from_dict(item)
+            report_links[report.report_id] = report.get_link_target()
+            reports[report.report_id] = report
+        for report_id in keys:
+            if report_id not in reports:
+                report_links[report_id] = None
+        return reports
 
     @classmethod
     def from_message_id(cls, message_id):
@@ -198,7 +476,7 @@ class Report:
         try:
             return cls.from_dict(response['Items'][0])
         except IndexError:
-            raise ReportException("Report not found.")
+            raise ReportNotFound("Report not found.")
 
     @classmethod
     def from_github(cls, repo_name, issue_num):
@@ -209,12 +487,36 @@ class Report:
         try:
             return cls.from_dict(response['Items'][0])
         except IndexError:
-            raise ReportException("Report not found.")
+            raise ReportNotFound("Report not found.")
+
+    @classmethod
+    def from_github_many(cls, repo_name, issue_nums):
+        """
+        Loads the reports tracking many issues of a repo in one batched read. Returns a dict of issue number -> Report;
+        issues without a report are left out.
+        """
+        issue_nums = list(dict.fromkeys(issue_nums))
+        reports = {}
+        for item in ddb.query_many(ddb.reports, "github_issue", "github_issue", issue_nums, github_repo=repo_name):
+            reports.setdefault(int(item['github_issue']), cls.from_dict(item))
+        return reports
 
     @classmethod
-    async def find_existing_submission(cls, repo, thread_id, user_id, automation_name):
-        """Returns the Report for an existing open PR for this submission key, or None if there isn't one."""
-        branch = dedup.branch_name(thread_id, user_id, automation_name)
+    async def find_existing_submission(cls, repo, branch):
+        """
+        Returns the Report for an existing open PR for this submission branch (see lib.dedup), or None if there
+        isn't one.
+        """
+        try:
+            response = ddb.reports.query(
+                KeyConditionExpression=Key("submission_key").eq(branch) & Key("github_repo").eq(repo),
+                IndexName="submission_key"
+            )
+        except ClientError as e:  # e.g. the index doesn't exist yet or is still backfilling
+            log.warning(f"Could not query the submission_key index, falling back to GitHub: {e}")
+        else:
+            return next((cls.from_dict(item) for item in response['Items']), None)
+
         pr = await GitHubClient.get_instance().find_open_pr_for_branch(repo, branch)
         if pr is None:
             return None
@@ -253,48 +555,149 @@ class Report:
                 return chan["target_folder"], chan["base_branch"]
         raise ReportException(f"No automation config found for repo {self.repo}.")
 
-    def _get_branch_and_path(self):
-        """Returns the (branch, file path) for this report's submission branch."""
+    def get_submission_branch(self):
+        """Returns this report's submission branch: its automation's own branch, or the batch branch for a batch."""
+        if self.automation_names:
+            return dedup.batch_branch_name(self.thread_id, self.reporter)
+        return dedup.branch_name(self.thread_id, self.reporter, self.automation_name)
+
+    def has_automation(self, automation_name):
+        """Returns whether this automation submission (on its own or a batch) includes the named automation."""
+        name = dedup.normalize_name(automation_name)
+        names = self.automation_names or [self.automation_name]
+        return any(n is not None and dedup.normalize_name(n) == name for n in names)
+
+    def get_submission_path(self, automation_name):
+        """Returns the path of an automation's file, which is the same whether it was submitted alone or in a batch."""
         target_folder, _ = self._get_automation_config()
-        branch = dedup.branch_name(self.thread_id, self.reporter, self.automation_name)
-        path = target_folder + branch.split("/")[-1] + ".json"
-        return branch, path
+        return f"{target_folder}{dedup.submission_slug(self.thread_id, self.reporter, automation_name)}.json"
 
-    async def setup_pr(self, ctx, file_content):
-        """Opens a draft PR on a new branch for this automation submission."""
+    async def setup_pr(self, ctx, files):
+        """Opens a draft PR on a new branch for this automation submission. `files` maps automation name -> file."""
         _, base_branch = self._get_automation_config()
-        branch, path = self._get_branch_and_path()
+        branch = self.get_submission_branch()
         gh = GitHubClient.get_instance()
         await gh.get_or_create_branch(self.repo, branch, base_branch)
-        await gh.create_or_update_file(self.repo, branch, path, file_content,
-                                       f"Add user-submitted automation: {self.automation_name}")
+        await self.push_files(files, "Add")
         # github_issue is reused here to store the PR number for automations
         pr = await gh.create_draft_pr(self.repo, branch, base_branch, f"{self.report_id} {self.title}",
                                       self.get_github_desc(ctx))
         self.github_issue = pr.number
+        self.submission_key = branch
 
-    async def update_pr(self, ctx, file_content):
-        """Pushes an updated submission file to this report's existing PR branch."""
-        branch, path = self._get_branch_and_path()
-        await GitHubClient.get_instance().create_or_update_file(
-            self.repo, branch, path, file_content, f"Update user-submitted automation: {self.automation_name}")
+    async def update_pr(self, ctx, files):
+        """Pushes updated submission files to this report's existing PR branch."""
+        await self.push_files(files, "Update")
+
+    async def push_files(self, files, verb):
+        """Commits the files of a submission (automation name -> file content) to its branch in one commit."""
+        branch = self.get_submission_branch()
+        gh = GitHubClient.get_instance()
+        if len(files) == 1:
+            (name, content), = files.items()
+            await gh.create_or_update_file(self.repo, branch, self.get_submission_path(name), content,
+                                           f"{verb} user-submitted automation: {name}")
+        else:
+            message = f"{verb} {len(files)} user-submitted automations\n\n" + "\n".join(f"- {name}" for name in files)
+            await gh.commit_files(self.repo, branch,
+                                  {self.get_submission_path(name): content for name, content in files.items()},
+                                  message)
 
     async def setup_message(self, bot, channel=None):
         if channel is None:
             channel = self.get_channel(bot)
-        report_message = await channel.send(embed=self.get_embed())
+        report_message = await channel.send(embed=self.get_embed(), components=self.get_components())
         self.message = report_message.id
-        if not self.is_bug and not self.is_automation:
-            await report_message.add_reaction(UPVOTE_REACTION)
-            await report_message.add_reaction(DOWNVOTE_REACTION)
-        await report_message.add_reaction(INFO_REACTION)
-        await report_message.add_reaction(THREAD_REACTION)
+        Report.message_cache[report_message.id] = channel.id
         return report_message
 
+    def get_components(self):
+        """Returns the buttons of this report's tracker message."""
+        actions = [(INFO_ACTION, INFO_REACTION), (THREAD_ACTION, THREAD_REACTION)]
+        if not self.is_bug and not self.is_automation:
+            actions = [(UPVOTE_ACTION, UPVOTE_REACTION), (DOWNVOTE_ACTION, DOWNVOTE_REACTION)] + actions
+        return [disnake.ui.Button(style=disnake.ButtonStyle.secondary, emoji=emoji,
+                                  custom_id=f"{BUTTON_ID_PREFIX}{action}:{self.report_id}")
+                for action, emoji in actions]
+
     def commit(self):
-        ddb.reports.put_item(Item=self.to_dict())
+        """
+        Saves this report. If reports are leased, the write is fenced: it's refused if the report was written under a
+        newer lease than the one this copy was loaded (or is held) under, since that holder has changes it doesn't.
+        """
+        if self._lease is not None:
+            if not self._lease.valid:
+                raise ReportException("This report was being changed for too long, try again.")
+            self.lease_token = self._lease.token
+        if self._lease is None and Report.leases is None:
+            ddb.reports.put_item(Item=self.to_dict())
+        else:
+            self._put_fenced()
+        self.update_indexes()
+
+    def _put_fenced(self):
+        fence = Attr("lease_token").not_exists() | Attr("lease_token").lte(self.lease_token)
+        try:
+            ddb.reports.put_item(Item=self.to_dict(), ConditionExpression=fence)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            if self._lease is not None:
+                self._lease.lost = True
+            raise ReportException("This report was changed elsewhere in the meantime, try again.")
+
+    def update_indexes(self):
+        """Brings the in-memory lookups built from reports (GitHub links, the leaderboard) up to date with this one."""
+        report_links[self.report_id] = self.get_link_target()
+        entry = self.get_leaderboard_entry()
+        if entry is None:
+            Report.leaderboard.discard(self.report_id)
+        else:
+            Report.leaderboard.put(entry)
+
+    def get_leaderboard_entry(self):
+        """Returns this report's row on the leaderboard, or None if it isn't an open feature request."""
+        if self.is_bug or self.is_automation or not self.is_open():
+            return None
+        channel_id = self.get_message_channel_id()
+        return LeaderboardEntry(self.report_id, self.title, self.score, channel_id or self.get_channel_id(),
+                                self.message if channel_id else MESSAGE_SENTINEL)
+
+    def embed_version(self, detailed=False):
+        """Returns a fingerprint of everything get_embed renders, which changes whenever the embed would."""
+        version = (self.reporter, self.title, self.severity, self.verification, self.upvotes, self.downvotes,
+                   self.is_bug, self.is_automation, self.repo, self.github_issue, self.attachment_count)
+        if detailed:
+            version += tuple((a.author, a.message, a.veri) for a in self.attachments[:10])
+        return version
 
     def get_embed(self, detailed=False, guild=None):
+        """
+        Returns this report's embed. Embeds are memoized per report version, so repeated views of an unchanged report
+        don't rebuild them; each call returns a new Embed that the caller is free to modify.
+        """
+        if detailed and not guild:
+            raise ValueError("Context not supplied for detailed call.")
+        key = (self.report_id, self.embed_version(detailed), detailed, guild.id if detailed else None)
+        data = Report.embed_cache.get(key)
+        if data is None:
+            Report.embed_cache_misses += 1
+            data = Report.embed_cache[key] = self._build_embed(detailed, guild).to_dict()
+        else:
+            Report.embed_cache_hits += 1
+        # from_dict keeps references to the nested fields, so hand out copies of the ones callers can mutate
+        data = {**data, "fields": [dict(field) for field in data.get("fields", ())]}
+        return disnake.Embed.from_dict(data)
+
+    @classmethod
+    def embed_cache_stats(cls):
+        return {"hits": cls.embed_cache_hits, "misses": cls.embed_cache_misses, "size": len(cls.embed_cache)}
+
+    @classmethod
+    def thread_cache_stats(cls):
+        return {"hits": cls.thread_cache_hits, "misses": cls.thread_cache_misses, "size": len(cls.thread_cache)}
+
+    def _build_embed(self, detailed=False, guild=None):
         embed = disnake.Embed()
         if isinstance(self.reporter, (int, Decimal)):
             embed.add_field(name="Added By", value=f"<@{self.reporter}>")
@@ -304,7 +707,7 @@ class Report:
         if not self.is_bug and not self.is_automation:
             embed.colour = 0x00ff00
             embed.add_field(name="Votes", value="\u2b06" + str(self.upvotes) + "` | `\u2b07" + str(self.downvotes))
-            embed.set_footer(text=f"~report {self.report_id} for details | Vote by reacting")
+            embed.set_footer(text=f"~report {self.report_id} for details | Vote with the buttons below")
         else:
             embed.colour = 0xff0000
             embed.add_field(name="Verification", value=str(self.verification))
@@ -316,11 +719,9 @@ class Report:
             embed.title = f"{embed.title[:250]}..."
         if self.github_issue:
             embed.url = f"{GITHUB_BASE}/{self.repo}/issues/{self.github_issue}"
-        embed.description = f"*{len(self.attachments)} notes*"
+        embed.description = f"*{self.attachment_count} notes*"
         if detailed:
-            if not guild:
-                raise ValueError("Context not supplied for detailed call.")
-            embed.description = f"*{len(self.attachments)} notes, showing first 10*"
+            embed.description = f"*{self.attachment_count} notes, showing first 10*"
             for attachment in self.attachments[:10]:
                 if isinstance(attachment.author, (int, Decimal)) and guild:
                     user = guild.get_member(attachment.author)
@@ -364,6 +765,12 @@ class Report:
 
         return desc
 
+    def get_link_target(self):
+        """Returns the (repo, issue number) this report links to, or None if it isn't on GitHub."""
+        if not self.github_issue:
+            return None
+        return self.repo, self.github_issue
+
     def get_issue_link(self):
         if self.github_issue is GITHUB_ISSUE_SENTINEL:
             return None
@@ -371,6 +778,8 @@ class Report:
 
     async def add_attachment(self, ctx, attachment: Attachment, add_to_github=True, post_to_thread=True):
         self.attachments.append(attachment)
+        if attachment.veri:
+            self.voters.setdefault(str(attachment.author), attachment.veri)
         if add_to_github and self.github_issue:
             if attachment.message:
                 msg = self.get_attachment_message(ctx, attachment)
@@ -392,7 +801,7 @@ class Report:
         return msg
 
     async def canrepro(self, author, msg, ctx):
-        if [a for a in self.attachments if a.author == author and a.veri]:
+        if self.has_voted(author):
             raise ReportException("You have already verified this report.")
         if not self.is_bug:
             raise ReportException("You cannot CR a feature request.")
@@ -402,7 +811,7 @@ class Report:
         await self.notify_subscribers(ctx, f"New CR by <@{author}>: {msg}")
 
     async def upvote(self, author, msg, ctx):
-        if [a for a in self.attachments if a.author == author and a.veri]:
+        if self.has_voted(author):
             raise ReportException("You have already upvoted this report.")
         if self.is_bug:
             raise ReportException("You cannot upvote a bug report.")
@@ -413,7 +822,7 @@ class Report:
             await self.notify_subscribers(ctx, f"New Upvote by <@{author}>: {msg}")
 
     async def cannotrepro(self, author, msg, ctx):
-        if [a for a in self.attachments if a.author == author and a.veri]:
+        if self.has_voted(author):
             raise ReportException("You have already verified this report.")
         if not self.is_bug:
             raise ReportException("You cannot CNR a feature request.")
@@ -423,7 +832,7 @@ class Report:
         await self.notify_subscribers(ctx, f"New CNR by <@{author}>: {msg}")
 
     async def downvote(self, author, msg, ctx):  # lol Dusk was here
-        if [a for a in self.attachments if a.author == author and a.veri]:
+        if self.has_voted(author):
             raise ReportException("You have already downvoted this report.")
         if self.is_bug:
             raise ReportException("You cannot downvote a bug report.")
@@ -458,14 +867,15 @@ class Report:
         if ctx.author.id in self.subscribers:
             self.subscribers.remove(ctx.author.id)
 
-    def get_channel(self, bot):
+    def get_channel_id(self):
         if self.is_bug:
-            chan_id = constants.BUG_TRACKER_CHAN
+            return constants.BUG_TRACKER_CHAN
         # elif self.is_automation: # Uncomment and update the constant if we want to use a separate channel rather than the thread id
-        #     chan_id = constants.AUTOMATION_TRACKER_CHAN
-        else:
-            chan_id = constants.REQ_TRACKER_CHAN
-        return bot.get_channel(chan_id)
+        #     return constants.AUTOMATION_TRACKER_CHAN
+        return constants.REQ_TRACKER_CHAN
+
+    def get_channel(self, bot):
+        return bot.get_channel(self.get_channel_id())
 
     async def create_thread(self, bot, message_id=None):
         """Creates a thread for this report on the given message, or the report's default message."""
@@ -493,6 +903,8 @@ class Report:
                 await thread.add_user(reporter)
         except disnake.HTTPException as e:
             log.warning(f"error in create thread: {e}")
+        if thread is not None:
+            Report.thread_cache[thread.id] = thread
         return thread
 
     async def get_thread(self, bot, unarchive=False, create=False, message_id=None):
@@ -503,67 +915,107 @@ class Report:
         if message_id is MESSAGE_SENTINEL:
             return None
 
-        # get thread channel
-        channel = self.get_channel(bot)
-        thread = channel.get_thread(message_id)
-        if thread is None:
-            try:
-                thread = await bot.fetch_channel(message_id)
-            except disnake.NotFound:
-                pass
+        # threads are created on the tracker message, so they share its ID
+        thread = await Report.resolve_thread(bot, message_id, self.get_channel(bot))
 
         if thread is None and create:
             thread = await self.create_thread(bot, message_id)
 
         # unarchive if it archived
-        if unarchive and thread.archived and not thread.locked:
-            await thread.edit(archived=False)
+        if unarchive and thread is not None and thread.archived and not thread.locked:
+            thread = await thread.edit(archived=False)
+            Report.thread_cache[thread.id] = thread
 
         return thread
 
     async def notify_thread(self, bot, msg):
         """Sends msg to this report's submission thread, resolved directly by thread_id."""
-        channel = bot.get_channel(self.thread_id)
-        if not channel:
-            try:
-                channel = await bot.fetch_channel(self.thread_id)
-            except disnake.NotFound:
-                channel = None
+        if not self.thread_id:
+            return
+        channel = await Report.resolve_thread(bot, self.thread_id)
         if channel:
             await channel.send(msg)
 
+    @classmethod
+    async def resolve_thread(cls, bot, thread_id, channel=None):
+        """
+        Returns the thread with the given ID (in channel, if given), or None if there is none. Threads missing from
+        the gateway cache, like archived ones, are fetched once and then remembered, as are threads that don't exist.
+        """
+        thread = channel.get_thread(thread_id) if channel is not None else bot.get_channel(thread_id)
+        if thread is not None:
+            return thread
+
+        thread = cls.thread_cache.get(thread_id)
+        if thread is not None:
+            cls.thread_cache_hits += 1
+            return None if thread is THREAD_ABSENT else thread
+
+        cls.thread_cache_misses += 1
+        try:
+            thread = await bot.fetch_channel(thread_id)
+        except disnake.NotFound:
+            cls.thread_cache[thread_id] = THREAD_ABSENT
+            return None
+        cls.thread_cache[thread_id] = thread
+        return thread
+
+    @classmethod
+    def remember_thread(cls, thread):
+        """Updates a remembered thread from a gateway event (e.g. when it is archived or unarchived)."""
+        if thread.id in cls.thread_cache:
+            cls.thread_cache[thread.id] = thread
+
+    @classmethod
+    def forget_thread(cls, thread_id):
+        """Records that a remembered thread was deleted."""
+        if thread_id in cls.thread_cache:
+            cls.thread_cache[thread_id] = THREAD_ABSENT
+
     async def get_message(self, ctx):
+        """
+        Returns a partial handle to this report's tracker message, which can be edited, deleted or linked to without
+        fetching it. Returns None if there is no message or it is known to have been deleted.
+        """
+        channel_id = self.get_message_channel_id()
+        if channel_id is None:
+            return None
+        channel = ctx.bot.get_channel(channel_id) or ctx.bot.get_partial_messageable(channel_id)
+        return channel.get_partial_message(self.message)
+
+    def get_message_channel_id(self):
+        """Returns the ID of the channel this report's tracker message is in, or None if there is no message."""
         if self.message is MESSAGE_SENTINEL:
             return None
-        elif self.message in self.message_cache:
-            return self.message_cache[self.message]
-        else:
-            try:
-                msg = await self.get_channel(ctx.bot).fetch_message(self.message)
-            except disnake.HTTPException:
-                msg = None
-            if msg:
-                Report.message_cache[self.message] = msg
-            return msg
+        if self.message in self.message_cache:
+            return self.message_cache[self.message]  # None if the message is known to be gone
+        if self.is_automation and self.thread_id:  # automation tracker messages are posted in the submission thread
+            return self.thread_id
+        return self.get_channel_id()
+
+    @classmethod
+    def forget_message(cls, message_id):
+        """Records that a tracker message no longer exists, so the next update posts a new one."""
+        cls.message_cache[message_id] = None
 
     async def delete_message(self, ctx):
         msg_ = await self.get_message(ctx)
         if msg_:
+            Report.render_scheduler.discard(msg_.id)
             try:
                 await msg_.delete()
-                if self.message in Report.message_cache:
-                    del Report.message_cache[self.message]
             except disnake.HTTPException:
                 pass
             finally:
+                Report.message_cache.pop(self.message, None)
                 self.message = MESSAGE_SENTINEL
 
     async def update(self, ctx):
         msg = await self.get_message(ctx)
         if msg is None and self.is_open() and self.github_issue:
             await self.setup_message(ctx.bot)
-        elif self.is_open():
-            await msg.edit(embed=self.get_embed())
+        elif msg is not None and self.is_open():
+            Report.render_scheduler.schedule(msg, self.get_embed())
 
     async def resolve(self, ctx, msg='', close_github_issue=True, pend=False, ignore_closed=False, author=None):
         if self.severity == -1 and not ignore_closed:
@@ -580,21 +1032,25 @@ class Report:
         await self.delete_message(ctx)
 
         if close_github_issue and self.github_issue:
-            extra_labels = set()
-            if msg.startswith('dupe'):
-                extra_labels.add("duplicate")
-            for label_match in re.finditer(r'\[(.+?)]', msg):
-                label = label_match.group(1)
-                if label in VALID_LABELS:
-                    extra_labels.add(label)
-            if extra_labels:
-                await GitHubClient.get_instance().label_issue(self.repo, self.github_issue,
-                                                              (await self.get_labels()) + list(extra_labels))
-            await GitHubClient.get_instance().close_issue(self.repo, self.github_issue)
+            await self.close_github_issue(msg)
 
         if pend:
             self.pend()
 
+    async def close_github_issue(self, msg=''):
+        """Closes this report's issue, first adding any labels the resolve message asks for (e.g. "[wontfix]")."""
+        extra_labels = set()
+        if msg.startswith('dupe'):
+            extra_labels.add("duplicate")
+        for label_match in re.finditer(r'\[(.+?)]', msg):
+            label = label_match.group(1)
+            if label in VALID_LABELS:
+                extra_labels.add(label)
+        if extra_labels:
+            await GitHubClient.get_instance().label_issue(self.repo, self.github_issue,
+                                                          (await self.get_labels()) + list(extra_labels))
+        await GitHubClient.get_instance().close_issue(self.repo, self.github_issue)
+
     async def unresolve(self, ctx, msg='', open_github_issue=True):
         if not self.severity == -1:
             raise ReportException("This report is still open.")
@@ -615,6 +1071,8 @@ class Report:
             await GitHubClient.get_instance().rename_issue(self.repo, self.github_issue, self.title)
 
         ddb.reports.delete_item(Key={"report_id": self.report_id})
+        report_links.pop(self.report_id, None)
+        Report.leaderboard.discard(self.report_id)
 
     def pend(self):
         self.pending = True
@@ -677,21 +1135,42 @@ def reports_to_issues(text):
     """
     Parses all XYZ-### identifiers and adds a link to their GitHub Issue numbers.
     """
+    links = resolve_report_links(match.group(1) for match in REPORT_ID_RE.finditer(text))
 
     def report_sub(match):
         report_id = match.group(1)
-        try:
-            report = Report.from_id(report_id)
-        except ReportException:
+        link = links.get(report_id.upper())
+        if link is None:
             return report_id
 
-        if report.github_issue:
-            if report.repo:
-                return f"{report_id} ({report.repo}#{report.github_issue})"
-            return f"{report_id} (#{report.github_issue})"
-        return report_id
+        repo, issue_num = link
+        if repo:
+            return f"{report_id} ({repo}#{issue_num})"
+        return f"{report_id} (#{issue_num})"
+
+    return REPORT_ID_RE.sub(report_sub, text)
+
+
+def resolve_report_links(report_ids):
+    """
+    Returns a dict of report ID -> (repo, issue number), or None if the report isn't on GitHub or doesn't exist.
+    IDs not in the link cache are resolved with a single batched read.
+    """
+    report_ids = {report_id.upper() for report_id in report_ids}
+    missing = [report_id for report_id in report_ids if report_id not in report_links]
+    if missing:
+        Report.from_ids(missing)
+    return {report_id: report_links.get(report_id) for report_id in report_ids}
 
-    return re.sub(r"(\w{3,}-\d{3,})", report_sub, text)
+
+def parse_button_id(custom_id):
+    """Returns (action, report ID) for a tracker message button's custom ID, or None if it isn't one."""
+    if not custom_id.startswith(BUTTON_ID_PREFIX):
+        return None
+    action, _, report_id = custom_id[len(BUTTON_ID_PREFIX):].partition(':')
+    if not report_id:
+        return None
+    return action, report_id
 
 
 def identifier_from_repo(repo_name, is_bug=True):
@@ -703,3 +1182,16 @@ def identifier_from_repo(repo_name, is_bug=True):
 
 class ReportException(Exception):
     pass
+
+
+class ReportNotFound(ReportException):
+    pass
+
+
+Report.render_scheduler.on_missing = Report.forget_message
+metrics.register("embed_renders", Report.render_scheduler.stats)
+metrics.register("embed_cache", Report.embed_cache_stats)
+metrics.register("thread_cache", Report.thread_cache_stats)
+metrics.register("leaderboard", lambda: Report.leaderboard.stats())
+metrics.register("report_locks", Report.lock_stats)
+metrics.register("report_leases", lambda: Report.leases.stats() if Report.leases is not None else {})
@@ -0,0 +1,47 @@
+"""Routes incoming messages to listeners by channel, so messages in channels nobody listens to are dropped in O(1)."""
+from collections import namedtuple
+
+Route = namedtuple("Route", "handler config")
+
+
+class MessageRouter:
+    """
+    A map of channel ID -> (handler, config). Routes added with ``threads=True`` match messages in threads
+    (and forum posts) whose parent is that channel, since each thread has its own channel ID.
+    """
+
+    def __init__(self):
+        self._channels = {}
+        self._parents = {}
+        self.routed = 0
+        self.dropped = 0
+
+    def add(self, channel_id, handler, config=None, threads=False):
+        route = Route(handler, config)
+        if threads:
+            self._parents[channel_id] = route
+        else:
+            self._channels[channel_id] = route
+
+    def get(self, channel):
+        """Returns the Route for a channel, or None if no listener cares about it."""
+        route = self._channels.get(channel.id)
+        if route is None and self._parents:
+            route = self._parents.get(getattr(channel, 'parent_id', None))
+        if route is None:
+            self.dropped += 1
+        else:
+            self.routed += 1
+        return route
+
+    async def dispatch(self, message):
+        """Calls the handler routed to by the message's channel with (message, config), if there is one."""
+        route = self.get(message.channel)
+        if route is not None:
+            await route.handler(message, route.config)
+
+    def __len__(self):
+        return len(self._channels) + len(self._parents)
+
+    def stats(self):
+        return {"routes": len(self), "routed": self.routed, "dropped": self.dropped}
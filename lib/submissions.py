@@ -0,0 +1,317 @@
+"""
+Parsing and validation of user-submitted automations: a single automation, a list of them (JSON array or
+multi-document YAML) or a zip of submission files. The work runs in worker processes with size, time and memory
+limits, so a huge or hostile submission (e.g. nested YAML anchors) can't stall the bot's event loop or exhaust the
+host's memory.
+"""
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import aiohttp
+import yaml
+from cachetools import LRUCache
+
+from lib.dedup import content_hash
+
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml, if PyYAML was built with it
+except ImportError:
+    from yaml import SafeLoader
+
+# the largest submission (message content or attachment) we'll parse, in bytes
+MAX_SUBMISSION_BYTES = int(os.environ.get("AUTOMATION_MAX_SUBMISSION_BYTES", 256 * 1024))
+# how long parsing and validating a submission may take before it's rejected, in seconds
+VALIDATION_TIMEOUT = float(os.environ.get("AUTOMATION_VALIDATION_TIMEOUT", 10))
+VALIDATION_WORKERS = int(os.environ.get("AUTOMATION_VALIDATION_WORKERS", 2))
+# the most memory (address space) a validation worker may use, in bytes
+VALIDATION_MEMORY_LIMIT = int(os.environ.get("AUTOMATION_VALIDATION_MEMORY_LIMIT", 512 * 1024 * 1024))
+# how many bytes of validated submissions to remember, so reposts of the same content aren't validated again
+VALIDATION_CACHE_BYTES = 16 * 1024 * 1024
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+# the most automations one message, file or archive may submit at once
+MAX_BATCH_SIZE = 50
+ARCHIVE_MEMBER_EXTENSIONS = ('.json', '.yaml', '.yml')
+# Strips the trailing "(type=...)" machine-readable detail from each validation error line,
+# leaving the human-readable message. Anchored to end-of-line and greedy so nested parens
+# in the error context (e.g. permitted=('a', 'b')) are consumed too.
+VALIDATION_TYPE_RE = re.compile(r"\s*\(type=[^\n]*\)\s*$", re.MULTILINE)
+
+# one automation of a submission. name: its name; file_content: the JSON file to commit
+SubmissionResult = namedtuple("SubmissionResult", "errors name file_content")
+# a whole submission. errors: problems with the submission as a whole; items: a SubmissionResult per automation;
+# parsed_format: "json" or "yaml"
+Submission = namedtuple("Submission", "errors items parsed_format")
+
+log = logging.getLogger(__name__)
+
+
+class SubmissionTooLarge(Exception):
+    pass
+
+
+def _rejected(*errors):
+    return Submission(list(errors), [], None)
+
+
+# ==== worker ====
+def limit_worker_memory(max_bytes):
+    """
+    Pool initializer: caps the worker's address space, so a submission that expands as it's processed (e.g. YAML
+    aliases nested many levels deep) raises MemoryError in the worker instead of exhausting the host.
+    """
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+
+def parse_documents(content, content_source):
+    """
+    Parses a submission into its automation documents: one object, a JSON array of objects, or a multi-document
+    YAML stream. Returns a Submission whose items are the parsed documents rather than SubmissionResults.
+    """
+    try:
+        documents = [doc for doc in yaml.load_all(content, Loader=SafeLoader) if doc is not None]
+    except yaml.YAMLError as exc:
+        return _rejected(f"Submission from {content_source} must be valid JSON or YAML. ({exc})")
+    parsed_format = "json" if content.lstrip().startswith(("{", "[")) else "yaml"
+    if len(documents) == 1 and isinstance(documents[0], list):  # a JSON array (or YAML sequence) of automations
+        documents = documents[0]
+    if not documents:
+        return _rejected(f"Submission from {content_source} is empty.")
+    if len(documents) > MAX_BATCH_SIZE:
+        return _rejected(f"Submission from {content_source} has {len(documents)} automations "
+                         f"(max {MAX_BATCH_SIZE} at once).")
+    for doc in documents:
+        if not isinstance(doc, dict):
+            return _rejected(f"Submission from {content_source} must be valid JSON or YAML that parses to an "
+                             f"object. (Got {type(doc).__name__})")
+    return Submission([], documents, parsed_format)
+
+
+def parse_archive(data, content_source, max_bytes=MAX_SUBMISSION_BYTES):
+    """Parses every submission file in a zip archive, like parse_documents. Refuses archives that unpack too big."""
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        return _rejected(f"Submission from {content_source} is not a valid zip file.")
+    members = [info for info in archive.infolist()
+               if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+               and info.filename.lower().endswith(ARCHIVE_MEMBER_EXTENSIONS)]
+    if not members:
+        return _rejected(f"Submission from {content_source} has no {', '.join(ARCHIVE_MEMBER_EXTENSIONS)} files.")
+
+    documents = []
+    parsed_format = None
+    remaining = max_bytes
+    for info in members:
+        source = f"{content_source}/{info.filename}"
+        with archive.open(info) as f:
+            raw = f.read(remaining + 1)  # don't trust the sizes in the archive's headers
+        remaining -= len(raw)
+        if remaining < 0:
+            return _rejected(f"Submission from {content_source} is too large once unzipped "
+                             f"(max {max_bytes // 1024} KiB).")
+        try:
+            text = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return _rejected(f"Submission from {source} is not UTF-8 text.")
+        parsed = parse_documents(text, source)
+        if parsed.errors:
+            return parsed
+        documents.extend(parsed.items)
+        parsed_format = parsed_format or parsed.parsed_format
+    if len(documents) > MAX_BATCH_SIZE:
+        return _rejected(f"Submission from {content_source} has {len(documents)} automations "
+                         f"(max {MAX_BATCH_SIZE} at once).")
+    return Submission([], documents, parsed_format)
+
+
+def validate_document(data, content_source):
+    """
+    Validates one automation document. Runs in a worker process, so everything it returns must be picklable - the
+    automation is returned as the JSON file content to commit rather than as parsed data.
+    """
+    # Require both name and automation keys
+    errors = []
+    name = data.get("name")
+    if not name:
+        errors.append("Submission must include a 'name' field.")
+    if not data.get("automation"):
+        errors.append("Submission must include an 'automation' field.")
+    if errors:
+        return SubmissionResult(errors, str(name) if name else None, None)
+    name = str(name)
+
+    # imported in the worker, the only place automation-common (and pydantic) are needed
+    from automation_common import validation
+    from automation_common.validation.utils import format_validation_error
+    from pydantic import ValidationError
+
+    # Validate the automation against the avrae automation-common schema
+    try:
+        validation.validate(data["automation"])
+    except ValidationError as exc:
+        formatted = VALIDATION_TYPE_RE.sub("", format_validation_error(exc))
+        return SubmissionResult([f"Submission from {content_source} has invalid automation:\n"
+                                 f"```\n{formatted}\n```"], name, None)
+
+    try:
+        file_content = json.dumps([data], indent=2)
+    except (TypeError, ValueError) as exc:  # e.g. YAML timestamps
+        return SubmissionResult([f"Submission from {content_source} contains values that can't be saved as "
+                                 f"JSON. ({exc})"], name, None)
+    return SubmissionResult([], name, file_content)
+
+
+# ==== pool ====
+class SubmissionValidator:
+    """
+    Parses submissions in a process pool and validates their automations in parallel, replacing the pool if a worker
+    hangs or dies. Results are cached by a hash of the submission content, so an identical repost is answered
+    without parsing it again.
+    """
+
+    def __init__(self, workers=VALIDATION_WORKERS, timeout=VALIDATION_TIMEOUT, max_bytes=MAX_SUBMISSION_BYTES,
+                 cache_bytes=VALIDATION_CACHE_BYTES, memory_limit=VALIDATION_MEMORY_LIMIT):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.memory_limit = memory_limit
+        self._pool = None
+        # (content hash, content source) -> Submission, sized by the JSON each submission holds
+        self._results = LRUCache(maxsize=cache_bytes, getsizeof=lambda submission: sum(
+            len(item.file_content or "") for item in submission.items) + 1)
+        self.timeouts = 0
+        self.crashes = 0
+        self.memory_errors = 0
+        self.resubmits = 0
+        self.cache_hits = 0
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            # don't fork the bot itself: it has gateway threads running that a forked child would inherit mid-state
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                             initializer=limit_worker_memory, initargs=(self.memory_limit,))
+        return self._pool
+
+    async def validate(self, content, content_source="message"):
+        """Parses and validates a submission's text. Returns a Submission."""
+        if len(content.encode()) > self.max_bytes:
+            return _rejected(f"Submission from {content_source} is too large (max {self.max_bytes // 1024} KiB).")
+        return await self._run(content, content_source, parse_documents, content, content_source)
+
+    async def validate_archive(self, data, content_source):
+        """Parses and validates every submission file in a zip archive's bytes. Returns a Submission."""
+        return await self._run(data, content_source, parse_archive, data, content_source, self.max_bytes)
+
+    async def _run(self, content, content_source, parse, *args):
+        key = (content_hash(content), content_source)
+        if (result := self._results.get(key)) is not None:
+            self.cache_hits += 1
+            return result
+
+        try:
+            result = await asyncio.wait_for(self._parse_and_validate(content_source, parse, *args), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            log.warning(f"Validating a submission from {content_source} timed out; restarting validation workers")
+            self.reset()
+            return _rejected(f"Submission from {content_source} took too long to validate.")
+        except BrokenProcessPool:
+            self.crashes += 1
+            log.warning(f"A validation worker died on a submission from {content_source}; restarting workers")
+            self.reset()
+            return _rejected(f"Submission from {content_source} could not be validated.")
+        except MemoryError:
+            self.memory_errors += 1
+            log.warning(f"Validating a submission from {content_source} ran out of memory")
+            return _rejected(f"Submission from {content_source} takes too much memory to validate.")
+        # timeouts, crashes and memory errors aren't cached, they may not happen again
+        self._results[key] = result
+        return result
+
+    async def _submit(self, fn, *args):
+        """
+        Runs fn in the pool. If the pool is replaced before fn finishes (another submission hung or crashed a worker),
+        runs it again in the new one, rather than failing a submission that did nothing wrong.
+        """
+        while True:
+            pool = self.pool
+            future = pool.submit(fn, *args)
+            try:
+                return await asyncio.wrap_future(future)
+            except (asyncio.CancelledError, BrokenProcessPool):
+                if self._pool is pool:  # this submission's own timeout or crash
+                    raise
+                self.resubmits += 1
+
+    async def _parse_and_validate(self, content_source, parse, *args):
+        parsed = await self._submit(parse, *args)
+        if parsed.errors:
+            return parsed
+        if len(parsed.items) == 1:
+            sources = [content_source]
+        else:
+            sources = [f"{content_source}, automation {i}" for i in range(1, len(parsed.items) + 1)]
+        items = await asyncio.gather(*(self._submit(validate_document, doc, source)
+                                       for doc, source in zip(parsed.items, sources)))
+        names = [item.name for item in items if item.name]
+        if len(set(name.strip().lower() for name in names)) < len(names):
+            return _rejected(f"Submission from {content_source} has more than one automation with the same name.")
+        return Submission([], list(items), parsed.parsed_format)
+
+    def reset(self):
+        """Kills the workers (a hung one won't stop on its own) and starts a new pool on next use."""
+        if self._pool is None:
+            return
+        for process in list(getattr(self._pool, "_processes", {}).values()):
+            process.terminate()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {"timeouts": self.timeouts, "crashes": self.crashes, "memory_errors": self.memory_errors,
+                "resubmits": self.resubmits, "cache_hits": self.cache_hits, "cached": len(self._results)}
+
+
+# ==== attachments ====
+async def read_attachment(attachment, max_bytes=MAX_SUBMISSION_BYTES):
+    """
+    Downloads an attachment, streaming it so that an oversized file is abandoned as soon as it passes
+    max_bytes instead of being read into memory in full. Raises SubmissionTooLarge if it's too big.
+    """
+    if attachment.size > max_bytes:
+        raise SubmissionTooLarge()
+    chunks = []
+    received = 0
+    async with aiohttp.ClientSession() as session:
+        async with session.get(attachment.url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise SubmissionTooLarge()
+                chunks.append(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,74 @@
+"""
+Adds the submission_key index to an existing reports table, then sets the submission key of every automation report
+whose PR is still open. Safe to re-run.
+
+Usage: GITHUB_TOKEN=... python -m scripts.backfill_submission_keys
+"""
+import os
+import time
+
+from boto3.dynamodb.conditions import Attr
+
+from lib import db
+from lib.dedup import branch_name
+from lib.github import GitHubClient
+
+
+def create_index():
+    description = db.reports.meta.client.describe_table(TableName=db.reports.name)['Table']
+    if any(index['IndexName'] == db.SUBMISSION_KEY_INDEX['IndexName']
+           for index in description.get('GlobalSecondaryIndexes', [])):
+        print("submission_key index already exists")
+    else:
+        print("creating submission_key index")
+        db.reports.meta.client.update_table(
+            TableName=db.reports.name,
+            AttributeDefinitions=[
+                {'AttributeName': 'submission_key', 'AttributeType': 'S'},
+                {'AttributeName': 'github_repo', 'AttributeType': 'S'},
+            ],
+            GlobalSecondaryIndexUpdates=[{'Create': db.SUBMISSION_KEY_INDEX}]
+        )
+
+    # wait for dynamo to finish building the index before writing keys into it
+    while True:
+        description = db.reports.meta.client.describe_table(TableName=db.reports.name)['Table']
+        index = next(i for i in description['GlobalSecondaryIndexes']
+                     if i['IndexName'] == db.SUBMISSION_KEY_INDEX['IndexName'])
+        if index['IndexStatus'] == 'ACTIVE':
+            break
+        print(f"index is {index['IndexStatus']}, waiting...")
+        time.sleep(10)
+
+
+def backfill():
+    gh = GitHubClient.get_instance()
+    updated = 0
+    for report in db.query_sync(db.reports, Attr('is_automation').eq(True) & Attr('submission_key').not_exists()):
+        if not (report['github_issue'] and report.get('automation_name')):
+            continue
+        pr = gh.get_repo(report['github_repo']).get_pull(int(report['github_issue']))
+        if pr.state != "open":
+            continue
+        key = branch_name(report['thread_id'], report['reporter'], report['automation_name'])
+        if pr.head.ref != key:
+            print(f"{report['report_id']}: PR #{pr.number} is on {pr.head.ref}, not {key}; skipping")
+            continue
+        db.reports.update_item(
+            Key={"report_id": report['report_id']},
+            UpdateExpression="SET submission_key = :key",
+            ExpressionAttributeValues={":key": key}
+        )
+        updated += 1
+        print(f"{report['report_id']}: {key}")
+    print(f"set the submission key of {updated} reports")
+
+
+def run():
+    GitHubClient.initialize(os.environ["GITHUB_TOKEN"], os.environ.get("ORG_NAME", "avrae"))
+    create_index()
+    backfill()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,34 @@
+"""
+Sets the voter index (author -> vote) of every report saved before reports kept one, so their first vote doesn't
+have to rebuild it from the attachments. Safe to re-run.
+
+Usage: python -m scripts.backfill_voters
+"""
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from lib import db
+from lib.reports import Report
+
+
+def backfill():
+    updated = 0
+    for item in db.query_sync(db.reports, Attr('voters').not_exists()):
+        report = Report.from_dict(item)
+        try:
+            db.reports.update_item(
+                Key={"report_id": report.report_id},
+                UpdateExpression="SET voters = :voters",
+                ConditionExpression="attribute_not_exists(voters)",  # don't clobber a vote made while this ran
+                ExpressionAttributeValues={":voters": report.voters}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            continue
+        updated += 1
+    print(f"set the voters of {updated} reports")
+
+
+if __name__ == '__main__':
+    backfill()
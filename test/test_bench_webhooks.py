@@ -0,0 +1,52 @@
+import json
+
+from bench.webhooks import percentile, run_scenario
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0
+
+
+def test_relabel_burst_costs_one_edit_per_issue():
+    result = run_scenario("relabel", n=3)
+    assert result["events"] == 9
+    assert result["errors"] == 0
+    assert result["calls"]["discord.edit_message"] == 3
+    assert result["calls"]["dynamo.put_item"] == 3
+
+
+def test_release_closes_every_report():
+    result = run_scenario("release", n=5)
+    assert result["errors"] == 0
+    assert result["calls"]["dynamo.put_item"] == 5
+    assert set(result["latency_ms"]["issues"]) == {"p50", "p95", "p99"}
+
+
+def test_opened_issue_is_tracked_once():
+    result = run_scenario("open", n=2)
+    assert result["errors"] == 0
+    assert result["calls"]["github.create_comment"] == 2  # "Tracked as" comment
+
+
+def test_comments_and_automation_results():
+    result = run_scenario("comments", n=8)
+    assert result["errors"] == 0
+    assert result["calls"]["dynamo.put_item"] == 8
+    assert result["calls"]["discord.edit_message"] < 8  # comments on the same report share embed edits
+    assert run_scenario("automation", n=2)["calls"]["discord.send"] == 2
+
+
+def test_replay_file(tmp_path):
+    issue = {"number": 42, "title": "Crash on init", "body": "It crashed.", "state": "open",
+             "labels": [{"name": "bug"}], "updated_at": "2021-04-20T12:00:00Z"}
+    payload = {"action": "opened", "issue": issue, "repository": {"full_name": "avrae/avrae"},
+               "sender": {"login": "octocat"}}
+    path = tmp_path / "events.jsonl"
+    path.write_text(json.dumps({"event": "issues", "payload": payload}) + "\n")
+    result = run_scenario(None, replay_path=str(path))
+    assert result["events"] == 1
+    assert result["errors"] == 0
+    assert result["calls"]["github.create_comment"] == 1
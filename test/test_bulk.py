@@ -0,0 +1,72 @@
+import asyncio
+
+from bench.fakes import Sandbox
+from lib.bulk import BulkJob, BulkProgress, Checkpoint
+
+
+def test_bulk_job_bounds_concurrency_per_key():
+    in_flight = {"total": 0, "a": 0, "b": 0}
+    peak = dict(in_flight)
+
+    async def handler(item):
+        key = item[0]
+        for k in ("total", key):
+            in_flight[k] += 1
+            peak[k] = max(peak[k], in_flight[k])
+        await asyncio.sleep(0.001)
+        for k in ("total", key):
+            in_flight[k] -= 1
+
+    async def show_progress(progress):
+        raise RuntimeError("status message was deleted")
+
+    items = [f"a{i}" for i in range(20)] + [f"b{i}" for i in range(20)]
+    with Sandbox() as sandbox:
+        job = BulkJob("bounded", handler, item_id=str, key=lambda item: item[0], concurrency=3, key_concurrency=2,
+                      on_progress=show_progress, progress_interval=0)
+        progress = asyncio.run(job.run(items))
+
+        assert progress.done == 40 and not progress.remaining  # a failing progress report doesn't stop the job
+        assert peak == {"total": 3, "a": 2, "b": 2}
+        # a finished job leaves no checkpoint behind
+        assert not sandbox.checkpoints.items
+
+
+def test_bulk_job_resumes_from_checkpoint():
+    seen = []
+    fail_on = {"r3", "r7"}
+
+    async def handler(item):
+        if item in fail_on:
+            raise RuntimeError("boom")
+        seen.append(item)
+
+    items = [f"r{i}" for i in range(10)]
+    with Sandbox() as sandbox:
+        job = BulkJob("resume", handler, item_id=str)
+        progress = asyncio.run(job.run(items))
+        assert progress.done == 8 and progress.failed == 2
+        assert set(job.failures) == fail_on
+        # e.g. read by the next process, after a redeploy
+        assert Checkpoint("resume").done == set(items) - fail_on
+        assert Checkpoint("other").done == set()
+
+        # the next run only retries what failed
+        seen.clear()
+        fail_on.clear()
+        job = BulkJob("resume", handler, item_id=str)
+        progress = asyncio.run(job.run(items))
+        assert sorted(seen) == ["r3", "r7"]
+        assert progress.resumed == 8 and progress.done == 2 and not progress.failed
+        assert not sandbox.checkpoints.items
+
+
+def test_bulk_progress_format():
+    progress = BulkProgress(100, resumed=10)
+    assert progress.eta is None
+    assert progress.format().startswith("10/100 done (0.0/s")
+    progress.done, progress.failed = 40, 5
+    progress.start -= 9
+    assert progress.remaining == 45
+    assert 8 < progress.eta < 10
+    assert progress.format().startswith("50/100 done, 5 failed (5.0/s, about 9s left")
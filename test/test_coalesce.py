@@ -0,0 +1,76 @@
+import asyncio
+
+from lib.coalesce import EventCoalescer
+
+
+def run_burst(submissions, window=0.05, max_delay=1, settle=0.2):
+    handled = []
+
+    async def handler(key, events):
+        handled.append((key, list(events)))
+
+    async def main():
+        coalescer = EventCoalescer(handler, window=window, max_delay=max_delay)
+        for key, event, delay in submissions:
+            coalescer.submit(key, event)
+            await asyncio.sleep(delay)
+        await asyncio.sleep(settle)
+        return coalescer
+
+    coalescer = asyncio.run(main())
+    return handled, coalescer
+
+
+def test_burst_is_collapsed():
+    handled, coalescer = run_burst([(("avrae/avrae", 1), i, 0) for i in range(3)])
+    assert handled == [(("avrae/avrae", 1), [0, 1, 2])]
+    assert coalescer.events_received == 3
+    assert coalescer.bursts_flushed == 1
+
+
+def test_keys_are_independent():
+    handled, _ = run_burst([(("avrae/avrae", 1), "a", 0), (("avrae/avrae", 2), "b", 0)])
+    assert sorted(handled) == [(("avrae/avrae", 1), ["a"]), (("avrae/avrae", 2), ["b"])]
+
+
+def test_quiet_period_splits_bursts():
+    handled, _ = run_burst([(("avrae/avrae", 1), "a", 0.15), (("avrae/avrae", 1), "b", 0)])
+    assert handled == [(("avrae/avrae", 1), ["a"]), (("avrae/avrae", 1), ["b"])]
+
+
+def test_max_delay_bounds_a_busy_key():
+    # events keep arriving faster than the window, so only max_delay forces the flush
+    handled, _ = run_burst([(("avrae/avrae", 1), i, 0.03) for i in range(10)], window=0.05, max_delay=0.1)
+    assert len(handled) >= 2
+    assert [e for _, events in handled for e in events] == list(range(10))
+
+
+def test_flush_all():
+    handled = []
+
+    async def handler(key, events):
+        handled.append((key, events))
+
+    async def main():
+        coalescer = EventCoalescer(handler, window=60, max_delay=60)
+        coalescer.submit("k", 1)
+        await coalescer.flush_all()
+        assert coalescer.pending == 0
+
+    asyncio.run(main())
+    assert handled == [("k", [1])]
+
+
+def test_submit_returns_the_bursts_outcome():
+    async def handler(key, events):
+        if key == "bad":
+            raise RuntimeError("boom")
+
+    async def main():
+        coalescer = EventCoalescer(handler, window=0.01, max_delay=1)
+        first, second = coalescer.submit("good", 1), coalescer.submit("good", 2)
+        assert first is second  # one outcome per burst
+        assert await first is True
+        assert await coalescer.submit("bad", 1) is False
+
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+import asyncio
+from decimal import Decimal
+
+from bench.fakes import Sandbox
+from lib import db
+from lib.metrics import Histogram
+from lib.reports import Attachment, Report
+
+
+class StubTable:
+    name = "taine.stub"
+
+    def __init__(self):
+        self.requests = []
+
+    def get_item(self, **kwargs):
+        self.requests.append(kwargs)
+        return {"Item": {"report_id": "AVR-001", "upvotes": Decimal(3)},
+                "ConsumedCapacity": {"TableName": self.name, "CapacityUnits": 0.5}}
+
+    def put_item(self, **kwargs):
+        self.requests.append(kwargs)
+        return {"ConsumedCapacity": {"TableName": self.name, "CapacityUnits": 2.0}}
+
+    def scan(self, **kwargs):
+        raise RuntimeError("throttled")
+
+
+def load_report(table):
+    return table.get_item(Key={"report_id": "AVR-001"})
+
+
+def test_storage_calls_are_measured_by_operation():
+    db.usage.reset()
+    stub = StubTable()
+    table = db.InstrumentedTable(stub)
+    assert table.name == "taine.stub"
+
+    for _ in range(3):
+        load_report(table)
+    with db.operation("vote"):
+        table.put_item(Item={"report_id": "AVR-001", "title": "test"})
+    try:
+        table.scan()
+    except RuntimeError:
+        pass
+    assert all(request["ReturnConsumedCapacity"] == "TOTAL" for request in stub.requests)
+
+    stats = db.usage.stats()
+    loads = stats["test.test_db.load_report"]
+    assert loads["calls"] == 3 and loads["read_units"] == 1.5 and loads["write_units"] == 0
+    assert loads["items"] == 3 and loads["bytes"] == 3 * db.item_size({"report_id": "AVR-001", "upvotes": 3})
+    assert loads["latency_s"]["count"] == 3 and loads["by_call"] == {"taine.stub.get_item": 3}
+
+    votes = stats["vote: test.test_db.test_storage_calls_are_measured_by_operation"]
+    assert votes["write_units"] == 2 and votes["capacity_units"]["max"] == 2
+    assert list(stats)[0] == "vote: test.test_db.test_storage_calls_are_measured_by_operation"  # costliest first
+    assert stats["test.test_db.test_storage_calls_are_measured_by_operation"]["errors"] == 1
+
+
+def test_report_loads_keep_their_operation():
+    with Sandbox() as sandbox:
+        Report(1, "AFR-001", "test", 6, 0, [Attachment(1, "Body")], None, is_bug=False).commit()
+        db.reports = db.InstrumentedTable(sandbox.reports)  # the sandbox puts the real table back on exit
+        db.usage.reset()
+
+        async def main():
+            with db.operation("button"):
+                await Report.load("AFR-001")  # read in an executor thread
+
+        asyncio.run(main())
+        assert list(db.usage.stats()) == ["button: lib.reports.Report.load.<locals>._"]
+
+
+def test_histogram_percentiles():
+    histogram = Histogram(bounds=(1, 2, 4, 8))
+    for value in (0.5, 1, 1.5, 3, 3, 3, 3, 3, 7, 20):
+        histogram.observe(value)
+    stats = histogram.to_dict()
+    assert stats["count"] == 10 and stats["max"] == 20 and stats["sum"] == 45
+    assert stats["buckets"] == {"1": 2, "2": 1, "4": 5, "8": 1, "inf": 1}
+    assert stats["p50"] == 4 and stats["p95"] == 20 and histogram.percentile(0.2) == 1
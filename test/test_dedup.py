@@ -1,4 +1,4 @@
-from lib.dedup import branch_name, slugify, submission_hash
+from lib.dedup import batch_branch_name, branch_name, content_hash, slugify, submission_hash
 
 
 def test_slugify_basic():
@@ -70,3 +70,14 @@ def test_branch_name_matches_dedup_key_semantics():
     assert branch_name(1, 2, "  Fire Bolt ") == branch_name(1, 2, "fire bolt")
     # ...while a genuinely different automation in the same thread does not
     assert branch_name(1, 2, "Fire Bolt") != branch_name(1, 2, "Ice Bolt")
+
+
+def test_content_hash_ignores_line_endings_and_surrounding_whitespace():
+    assert content_hash('{"name": "a"}\r\n') == content_hash('  {"name": "a"}')
+    assert content_hash('{"name": "a"}') != content_hash('{"name": "b"}')
+
+
+def test_batch_branch_name_is_stable_per_thread_and_user():
+    assert batch_branch_name(1, 2) == batch_branch_name(1, 2)
+    assert batch_branch_name(1, 2) != batch_branch_name(1, 3)
+    assert batch_branch_name(1, 2).startswith("user-automation/batch-")
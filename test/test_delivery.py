@@ -0,0 +1,47 @@
+from botocore.exceptions import ClientError
+
+from lib.delivery import DeliveryCache
+
+
+class ConditionalTable:
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item, ConditionExpression):
+        if Item["delivery_id"] in self.items:
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+        self.items[Item["delivery_id"]] = Item
+
+    def delete_item(self, Key):
+        self.items.pop(Key["delivery_id"], None)
+
+
+def test_duplicate_is_rejected():
+    cache = DeliveryCache()
+    assert cache.add("a")
+    assert not cache.add("a")
+    assert cache.add("b")
+    assert cache.stats() == {"received": 3, "duplicates": 1, "duplicate_rate": 1 / 3, "size": 2}
+
+
+def test_cache_is_bounded():
+    cache = DeliveryCache(maxsize=2)
+    for delivery_id in "abc":
+        cache.add(delivery_id)
+    assert cache.stats()["size"] == 2
+    assert cache.add("a")  # evicted, so no longer recognized in memory
+
+
+def test_discard_allows_redelivery():
+    cache = DeliveryCache()
+    cache.add("a")
+    cache.discard("a")
+    assert cache.add("a")
+
+
+def test_persisted_deliveries_survive_restart():
+    table = ConditionalTable()
+    assert DeliveryCache(table=table).add("a")
+    restarted = DeliveryCache(table=table)
+    assert not restarted.add("a")
+    assert restarted.duplicates == 1
@@ -0,0 +1,31 @@
+from lib.github import IssueStateCache
+
+
+def issue_payload(number=1, labels=("bug",), updated_at="2021-04-20T12:00:00Z", title="AVR-001 Test"):
+    return {"number": number, "title": title, "state": "open", "labels": [{"name": name} for name in labels],
+            "updated_at": updated_at}
+
+
+def test_hydrate_from_payload():
+    cache = IssueStateCache()
+    cache.hydrate("avrae/avrae", issue_payload(labels=("bug", "P1: Very High")))
+    state = cache.get("avrae/avrae", 1)
+    assert state["labels"] == ["bug", "P1: Very High"]
+    assert state["title"] == "AVR-001 Test"
+    assert cache.get("avrae/avrae", 2) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_stale_payload_does_not_overwrite():
+    cache = IssueStateCache()
+    cache.hydrate("avrae/avrae", issue_payload(labels=("bug", "P2: High"), updated_at="2021-04-20T12:00:05Z"))
+    cache.hydrate("avrae/avrae", issue_payload(labels=("bug",), updated_at="2021-04-20T12:00:00Z"))
+    assert cache.get("avrae/avrae", 1)["labels"] == ["bug", "P2: High"]
+
+
+def test_invalidate():
+    cache = IssueStateCache()
+    cache.hydrate("avrae/avrae", issue_payload())
+    cache.invalidate("avrae/avrae", 1)
+    assert cache.get("avrae/avrae", 1) is None
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import hmac
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from bench.fakes import Sandbox
+from bench.webhooks import BUG_REPO, issue_event, seed_report
+from lib.eventqueue import EventQueue
+from lib.reports import Report
+from web.ingest import Ingest, is_valid_signature
+from web.web import Web
+
+HEADERS = {"User-Agent": "GitHub-Hookshot/abc123", "X-GitHub-Event": "issues"}
+
+
+def post_all(queue, requests):
+    """POSTs each (headers, body) to a fresh ingest app and returns the response statuses."""
+
+    async def main():
+        async with TestClient(TestServer(Ingest(queue).build_app())) as client:
+            statuses = []
+            for headers, body in requests:
+                resp = await client.post("/github", data=body, headers=headers)
+                statuses.append(resp.status)
+            health = await client.get("/health")
+            return statuses, health.status, await health.json()
+
+    return asyncio.run(main())
+
+
+def test_queue_roundtrip(tmp_path):
+    queue = EventQueue(str(tmp_path / "q.sqlite3"))
+    assert queue.put("issues", json.dumps({"action": "opened"}), "d1")
+    assert not queue.put("issues", "{}", "d1")  # already queued
+    assert queue.depth() == 1
+    event, = queue.get()
+    assert event.event_type == "issues"
+    assert event.data == {"action": "opened"}
+    queue.ack(event.id)
+    assert queue.depth() == 0
+    assert queue.lag() == 0
+
+
+def test_queue_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "q.sqlite3")
+    producer, consumer = EventQueue(path), EventQueue(path)
+    producer.put("issues", "{}")
+    assert [e.event_type for e in consumer.get()] == ["issues"]
+
+
+def test_queue_dead_letters(tmp_path):
+    queue = EventQueue(str(tmp_path / "q.sqlite3"))
+    for i in range(3):
+        queue.put("issues", json.dumps({"n": i}), f"d{i}")
+    first, second, third = queue.get()
+    assert [e.data for e in queue.get(after=first.id)] == [{"n": 1}, {"n": 2}]
+    queue.fail(second.id, "boom")
+    assert queue.depth() == 2 and queue.dead_count() == 1
+    assert [e.id for e in queue.get()] == [first.id, third.id]
+
+
+def test_queued_events_are_acked_once_handled(tmp_path):
+    with Sandbox() as sandbox:
+        issues = [seed_report(sandbox, "AVR-001"), seed_report(sandbox, "AVR-002")]
+        cog = Web(sandbox.bot)
+        cog.queue = EventQueue(str(tmp_path / "q.sqlite3"))
+        cog.issue_events.window = 0.05
+        reconcile = cog.issue_events.handler
+
+        async def flaky_reconcile(key, events):
+            if key[1] == issues[1]['number']:
+                raise RuntimeError("GitHub is down")
+            await reconcile(key, events)
+
+        cog.issue_events.handler = flaky_reconcile
+        for issue in issues:
+            issue['state'] = "closed"
+            event_type, payload = issue_event(sandbox, BUG_REPO, issue['number'], "closed")
+            cog.queue.put(event_type, json.dumps(payload))
+        cog.queue.put("pull_request", json.dumps({"action": "closed"}))  # malformed
+
+        async def main():
+            consumer = asyncio.ensure_future(cog.consume_queue())
+            await asyncio.sleep(0.01)
+            # the issues events are waiting on their reconciliation; the malformed event is dead-lettered
+            assert cog.queue.depth() == 2 and cog.queue.dead_count() == 1
+            await asyncio.sleep(0.2)
+            consumer.cancel()
+
+        asyncio.run(main())
+        assert cog.queue.depth() == 0 and cog.queue.dead_count() == 2
+        assert not Report.from_id("AVR-001").is_open()
+
+
+def test_failed_reconciliations_can_be_redelivered():
+    with Sandbox() as sandbox:
+        issue = seed_report(sandbox, "AVR-001")
+        cog = Web(sandbox.bot)
+        cog.issue_events.window = 0.05
+        reconcile = cog.issue_events.handler
+        failures = [RuntimeError("GitHub is down")]
+
+        async def flaky_reconcile(key, events):
+            if failures:
+                raise failures.pop()
+            await reconcile(key, events)
+
+        cog.issue_events.handler = flaky_reconcile
+        issue['state'] = "closed"
+        _, payload = issue_event(sandbox, BUG_REPO, issue['number'], "closed")
+        headers = dict(HEADERS, **{"X-GitHub-Delivery": "d1"})
+
+        async def main():
+            async with TestClient(TestServer(cog.app)) as client:
+                statuses = []
+                for _ in range(3):  # the delivery, then GitHub's redelivery of it, then a duplicate
+                    resp = await client.post("/github", data=json.dumps(payload), headers=headers)
+                    statuses.append((resp.status, await resp.text()))
+                    await asyncio.sleep(0.1)
+                return statuses
+
+        statuses = asyncio.run(main())
+        assert statuses == [(200, ""), (200, ""), (200, "Duplicate delivery")]
+        assert not Report.from_id("AVR-001").is_open()
+
+
+def test_labels_changed_in_a_closing_burst_are_applied():
+    with Sandbox() as sandbox:
+        issue = seed_report(sandbox, "AVR-001")
+        untracked = sandbox.add_issue(BUG_REPO, "Not tracked", "Body", [])
+        cog = Web(sandbox.bot)
+
+        async def main():
+            issue['labels'] = [{"name": "featurereq"}]
+            labeled = issue_event(sandbox, BUG_REPO, issue['number'], "labeled")[1]
+            issue['state'] = "closed"
+            closed = issue_event(sandbox, BUG_REPO, issue['number'], "closed")[1]
+            await cog.reconcile_issue((BUG_REPO, issue['number']), [labeled, closed])
+
+            issue['labels'].append({"name": "P1"})
+            labeled = issue_event(sandbox, BUG_REPO, issue['number'], "labeled")[1]
+            await cog.reconcile_issue((BUG_REPO, issue['number']), [labeled])
+
+            untracked['state'] = "closed"
+            untracked['labels'].append({"name": "P2"})
+            labeled = issue_event(sandbox, BUG_REPO, untracked['number'], "labeled")[1]
+            await cog.reconcile_issue((BUG_REPO, untracked['number']), [labeled])
+
+        asyncio.run(main())
+        report = Report.from_id("AVR-001")
+        assert not report.is_bug and not report.is_open()  # and the priority label doesn't reopen it
+        assert len(sandbox.reports.items) == 1  # a closed issue isn't tracked just for being labeled
+
+
+def test_ingest_enqueues_and_dedups(tmp_path):
+    queue = EventQueue(str(tmp_path / "q.sqlite3"))
+    body = json.dumps({"action": "opened"})
+    statuses, health_status, health = post_all(queue, [
+        ({**HEADERS, "X-GitHub-Delivery": "d1"}, body),
+        ({**HEADERS, "X-GitHub-Delivery": "d1"}, body),
+        ({"User-Agent": "curl/7.0", "X-GitHub-Event": "issues"}, body),
+        ({**HEADERS, "X-GitHub-Event": "push"}, body),
+    ])
+    assert statuses == [202, 200, 403, 200]
+    assert health_status == 200
+    assert health["depth"] == 1
+
+
+def test_ingest_backpressure(tmp_path):
+    queue = EventQueue(str(tmp_path / "q.sqlite3"), maxsize=1)
+    statuses, health_status, _ = post_all(queue, [
+        ({**HEADERS, "X-GitHub-Delivery": "d1"}, "{}"),
+        ({**HEADERS, "X-GitHub-Delivery": "d2"}, "{}"),
+    ])
+    assert statuses == [202, 503]
+    assert health_status == 503
+
+
+def test_signature():
+    body = b'{"zen": "Keep it logically awesome."}'
+    signature = "sha256=" + hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    assert is_valid_signature(body, signature, secret="secret")
+    assert not is_valid_signature(body, signature, secret="other")
+    assert not is_valid_signature(body, None, secret="secret")
+    assert is_valid_signature(body, None, secret=None)
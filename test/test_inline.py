@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+
+from bench.fakes import Sandbox
+from cogs.inline import Inline
+from lib.reports import Attachment, Report, reports_to_issues
+
+
+def add_report(report_id, github_issue=None):
+    Report(1, report_id, "test", 6, 0, [Attachment(1, f"{report_id} body")], None, github_issue=github_issue).commit()
+
+
+def test_reports_to_issues_batches_lookups():
+    with Sandbox() as sandbox:
+        add_report("AVR-001", github_issue=10)
+        add_report("AVR-002")
+        sandbox.reset_counts()
+        text = "See AVR-001, avr-001, AVR-002 and AVR-404."
+        assert reports_to_issues(text) == \
+               "See AVR-001 (avrae/avrae#10), avr-001 (avrae/avrae#10), AVR-002 and AVR-404."
+        assert sandbox.calls["dynamo.batch_get_item"] == 1
+        assert sandbox.calls["dynamo.get_item"] == 0
+
+        reports_to_issues(text)  # served from the link cache
+        assert sandbox.calls["dynamo.batch_get_item"] == 1
+
+
+def test_inline_sends_one_message():
+    with Sandbox() as sandbox:
+        add_report("AVR-001")
+        add_report("AVR-002", github_issue=1127)
+        channel = sandbox.bot.get_channel(next(sandbox.ids))
+        message = SimpleNamespace(author=SimpleNamespace(bot=False), channel=channel,
+                                  content="#AVR-001 #AVR-404 ##1127 #AVR-002")
+        asyncio.run(Inline(sandbox.bot).on_message(message))
+
+        assert sandbox.calls["discord.send"] == 1
+        assert sandbox.calls["dynamo.batch_get_item"] == 1 and sandbox.calls["dynamo.execute_statement"] == 1
+        sent, = channel.messages.values()
+        assert [embed.description for embed in sent.embed] == ["AVR-001 body", "AVR-002 body"]
+
+
+def test_issue_mentions_are_batched():
+    with Sandbox():
+        add_report("AVR-001", github_issue=10)
+        add_report("AVR-002", github_issue=11)
+        Report(1, "ATR-001", "test", 6, 0, [], None, github_issue=12, github_repo="avrae/taine").commit()
+        reports = Inline.find_reports("##11 ##404 ##10 ##12 #AVR-001 ##11")
+        assert [report.report_id for report in reports] == ["AVR-001", "AVR-002"]
@@ -0,0 +1,56 @@
+import asyncio
+
+from bench.fakes import Sandbox
+from bench.webhooks import seed_report
+from lib.leaderboard import Leaderboard, LeaderboardEntry
+from lib.misc import ContextProxy
+from lib.reports import Report
+
+
+def entry(report_id, score):
+    return LeaderboardEntry(report_id, "title", score, 1, 2)
+
+
+def test_leaderboard_ranks_by_score():
+    board = Leaderboard()
+    assert not board.loaded
+    board.load([entry("AFR-1", 3), entry("AFR-2", 5), entry("AFR-3", 3)])
+    assert board.loaded
+    assert [e.report_id for e in board.top(10)] == ["AFR-2", "AFR-1", "AFR-3"]
+
+    board.put(entry("AFR-3", 6))  # moves up
+    board.put(entry("AFR-4", 4))  # new
+    board.put(entry("AFR-1", 3)._replace(title="renamed"))  # same score, new details
+    board.discard("AFR-2")
+    board.discard("AFR-9")  # not on the board
+    assert [(e.report_id, e.score) for e in board.top(10)] == [("AFR-3", 6), ("AFR-4", 4), ("AFR-1", 3)]
+    assert board.top(1)[0].report_id == "AFR-3" and board.top(10)[2].title == "renamed"
+    assert len(board) == 3
+
+    board.refresh = 0
+    assert not board.loaded
+
+
+def test_commits_keep_the_leaderboard_current():
+    async def run():
+        with Sandbox() as sandbox:
+            Report.leaderboard.load([])
+            for i in range(1, 4):
+                seed_report(sandbox, f"AFR-{i}", is_bug=False, labels=("featurereq",))
+            seed_report(sandbox, "AVR-1")
+
+            for report_id, upvotes in (("AFR-1", 2), ("AFR-2", 7), ("AVR-1", 9)):
+                report = Report.from_id(report_id)
+                report.upvotes = upvotes
+                report.commit()
+            assert [(e.report_id, e.score) for e in Report.leaderboard.top(2)] == [("AFR-2", 7), ("AFR-1", 2)]
+
+            top = Report.leaderboard.top(1)[0]
+            report = Report.from_id("AFR-2")
+            assert (top.channel_id, top.message_id) == (report.get_channel_id(), report.message)
+
+            await report.resolve(ContextProxy(sandbox.bot))
+            report.commit()
+            assert [e.report_id for e in Report.leaderboard.top(10)] == ["AFR-1", "AFR-3"]
+
+    asyncio.run(run())
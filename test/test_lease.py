@@ -0,0 +1,114 @@
+import asyncio
+
+from bench.fakes import Sandbox
+from lib.lease import DynamoLeaseStore, LeaseManager, LeaseTimeout, MemoryLeaseStore
+from lib.misc import ContextProxy
+from lib.reports import Attachment, Report, ReportException
+
+
+def test_lease_stores():
+    with Sandbox() as sandbox:
+        for store in (MemoryLeaseStore(), DynamoLeaseStore(sandbox.leases)):
+            check_lease_store(store)
+
+
+def check_lease_store(store):
+    first = store.acquire("report:AFR-001", "a", 30)
+    assert first == 1
+    assert store.acquire("report:AFR-001", "b", 30) is None  # held
+    assert store.acquire("report:AFR-002", "b", 30) == 1  # leases are independent
+    assert store.renew("report:AFR-001", "a", first, 30)
+    assert not store.renew("report:AFR-001", "b", first, 30)
+
+    store.release("report:AFR-001", "a", first)
+    second = store.acquire("report:AFR-001", "b", 0)  # lapses at once
+    assert second > first  # tokens keep growing across holders
+    third = store.acquire("report:AFR-001", "a", 30)
+    assert third > second
+    assert not store.renew("report:AFR-001", "b", second, 30)  # b's lease was taken over
+    store.release("report:AFR-001", "b", second)  # and can't release a's
+    assert store.acquire("report:AFR-001", "b", 30) is None
+
+
+def test_waiting_for_a_held_lease_times_out():
+    async def main():
+        store = MemoryLeaseStore()
+        holder = LeaseManager(store, owner="a")
+        waiter = LeaseManager(store, owner="b", timeout=0.2)
+        async with holder.hold("report:AFR-001") as lease:
+            assert lease.valid
+            try:
+                await waiter.acquire("report:AFR-001")
+            except LeaseTimeout:
+                pass
+            else:
+                raise AssertionError("took a held lease")
+        assert not lease.valid  # released
+        assert waiter.retries and waiter.timeouts == 1
+        async with waiter.hold("report:AFR-001") as lease:
+            assert lease.token == 2
+
+    asyncio.run(main())
+
+
+def test_stale_lease_holders_cannot_overwrite_reports():
+    with Sandbox() as sandbox:
+        ctx = ContextProxy(sandbox.bot)
+        Report(1, "AFR-001", "test", 6, 0, [Attachment(1, "Body")], None, is_bug=False).commit()
+        Report.leases = LeaseManager(DynamoLeaseStore(sandbox.leases), owner="a")
+        other_process = LeaseManager(DynamoLeaseStore(sandbox.leases), owner="b")
+
+        async def main():
+            async with Report.locked("AFR-001") as report:
+                await report.upvote(2, '', ctx)
+                report.commit()
+            assert Report.from_id("AFR-001").lease_token == 1
+
+            try:
+                async with Report.locked("AFR-001") as report:
+                    await report.upvote(3, '', ctx)
+                    # this process stalls past its lease as far as the table is concerned, and another takes over
+                    sandbox.leases.items["report:AFR-001"]["expires"] = 0
+                    async with other_process.hold("report:AFR-001") as lease:
+                        theirs = Report.from_id("AFR-001")
+                        theirs._lease = lease
+                        await theirs.downvote(4, '', ctx)
+                        theirs.commit()
+                    report.commit()  # refused: the report was written under a newer lease
+            except ReportException:
+                pass
+            else:
+                raise AssertionError("overwrote a report written under a newer lease")
+
+        asyncio.run(main())
+        stored = Report.from_id("AFR-001")
+        assert (stored.upvotes, stored.downvotes, stored.lease_token) == (1, 1, 3)
+        assert set(stored.voters) == {"2", "4"}
+
+
+def test_unleased_writes_are_fenced_too():
+    with Sandbox() as sandbox:
+        ctx = ContextProxy(sandbox.bot)
+        Report(1, "AFR-001", "test", 6, 0, [Attachment(1, "Body")], None, is_bug=False).commit()
+        Report.leases = LeaseManager(DynamoLeaseStore(sandbox.leases), owner="a")
+        stale = Report.from_id("AFR-001")  # e.g. loaded by a script, without a lease
+
+        async def main():
+            async with Report.locked("AFR-001") as report:
+                await report.upvote(2, '', ctx)
+                report.commit()
+
+        asyncio.run(main())
+        stale.title = "renamed"
+        try:
+            stale.commit()
+        except ReportException:
+            pass
+        else:
+            raise AssertionError("an unleased write overwrote a report written under a lease")
+        stored = Report.from_id("AFR-001")
+        assert (stored.title, stored.upvotes) == ("test", 1)
+
+        stored.title = "renamed"  # loaded after the leased write, so it has its changes
+        stored.commit()
+        assert Report.from_id("AFR-001").title == "renamed"
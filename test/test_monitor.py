@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+from lib.monitor import LoopMonitor, UNATTRIBUTED
+
+
+def block(seconds):
+    time.sleep(seconds)
+
+
+def test_stalls_are_attributed_to_the_blocking_line():
+    monitor = LoopMonitor(interval=0.02, threshold=0.05)
+
+    async def main():
+        monitor.start()
+        try:
+            await asyncio.sleep(0.1)
+            block(0.3)
+            await asyncio.sleep(0.1)
+        finally:
+            monitor.stop()
+
+    asyncio.run(main())
+    stats = monitor.stats()
+    assert monitor.samples > 5 and stats["stalls"] >= 1 and stats["lag_max_s"] >= 0.25
+    site = monitor.top_sites(1)[0]
+    assert site.site.startswith("test/test_monitor.py:") and site.site.endswith(" in block")
+    assert site.count == 1 and site.total >= 0.25
+    assert any(" in main" in frame for frame in site.stack)  # and what called it
+
+    monitor.record(0.2)  # a stall the watchdog didn't see
+    assert UNATTRIBUTED in monitor.sites
+    monitor.reset()
+    assert monitor.stats()["stalls"] == 0 and not monitor.sites
@@ -0,0 +1,100 @@
+import asyncio
+from types import SimpleNamespace
+
+from bench.fakes import Sandbox
+from cogs.reactions import Reactions
+from lib.lease import LeaseManager, MemoryLeaseStore
+from lib.reports import Attachment, Report, parse_button_id
+
+
+class FakeInteraction:
+    def __init__(self, custom_id, author, message_id):
+        self.component = SimpleNamespace(custom_id=custom_id)
+        self.author = author
+        self.guild = author.guild
+        self.message = SimpleNamespace(id=message_id)
+        self.replies = []
+        self.response = SimpleNamespace(send_message=self.reply, defer=self.defer)
+        self.followup = SimpleNamespace(send=self.reply)
+
+    async def reply(self, content=None, embed=None, ephemeral=False):
+        self.replies.append((content, embed, ephemeral))
+
+    async def defer(self, ephemeral=False):
+        pass
+
+
+def test_tracker_message_buttons():
+    with Sandbox() as sandbox:
+        voter = sandbox.add_member(next(sandbox.ids))
+        report = Report(1, "AFR-001", "test", 6, 0, [Attachment(1, "Body")], None, is_bug=False)
+        cog = Reactions(sandbox.bot)
+
+        async def main():
+            message = await report.setup_message(sandbox.bot)
+            report.commit()
+            sandbox.reset_counts()
+            upvote, downvote, info, thread = (button.custom_id for button in message.components)
+            assert parse_button_id(upvote) == ("upvote", "AFR-001")
+
+            # clicks on other bots' or commands' buttons are ignored without any lookups
+            other = FakeInteraction("poll:yes", voter, message.id)
+            await cog.on_button_click(other)
+            assert not other.replies and not sandbox.calls
+
+            click = FakeInteraction(upvote, voter, message.id)
+            await cog.on_button_click(click)
+            await cog.on_button_click(click)
+            await cog.on_button_click(FakeInteraction(info, voter, message.id))
+            await Report.render_scheduler.flush_all()
+            return message, click
+
+        message, click = asyncio.run(main())
+        # one send and no reactions to set up the message
+        assert len(message.components) == 4
+        assert [reply[0] for reply in click.replies] == ["Upvoted `AFR-001`.", "You have already upvoted this report."]
+        assert all(reply[2] for reply in click.replies)
+        assert sandbox.calls["dynamo.query"] == 0  # routed by report ID, not the message index
+
+        saved = Report.from_id("AFR-001")
+        assert saved.upvotes == 1
+        assert voter.id in saved.subscribers
+
+
+def test_button_failures(monkeypatch):
+    with Sandbox() as sandbox:
+        voter = sandbox.add_member(next(sandbox.ids))
+        report = Report(1, "AFR-001", "test", 6, 0, [Attachment(1, "Body")], None, is_bug=False)
+        cog = Reactions(sandbox.bot)
+        store = MemoryLeaseStore()
+        Report.leases = LeaseManager(store, owner="a", timeout=0.1)
+
+        async def no_thread(*args, **kwargs):
+            return None
+
+        async def main():
+            message = await report.setup_message(sandbox.bot)
+            report.commit()
+            upvote, _, _, thread = (button.custom_id for button in message.components)
+
+            store.acquire("report:AFR-001", "b", 30)  # another process is changing it
+            busy = FakeInteraction(upvote, voter, message.id)
+            await cog.on_button_click(busy)
+
+            monkeypatch.setattr(Report, "get_thread", no_thread)  # e.g. Discord refused to create it
+            no_discussion = FakeInteraction(thread, voter, message.id)
+            await cog.on_button_click(no_discussion)
+
+            gone = FakeInteraction(upvote.replace("AFR-001", "AFR-002"), voter, message.id)
+            await cog.on_button_click(gone)
+            return busy, no_discussion, gone
+
+        busy, no_discussion, gone = asyncio.run(main())
+        assert busy.replies[0][0] == "This report is being changed elsewhere, try again in a moment."
+        assert no_discussion.replies[0][0] == "Couldn't open a thread for `AFR-001`, try again later."
+        assert gone.replies[0][0] == "This report no longer exists."
+
+
+def test_bug_report_buttons():
+    report = Report(1, "AVR-001", "test", 6, 0, [], None)
+    assert [parse_button_id(button.custom_id)[0] for button in report.get_components()] == ["info", "thread"]
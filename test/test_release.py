@@ -0,0 +1,45 @@
+import asyncio
+
+from bench.fakes import Sandbox
+from bench.webhooks import BUG_REPO, seed_report
+from lib.misc import ContextProxy
+from lib.release import release_reports
+from lib.reports import Report
+
+
+def test_release_closes_pending_reports():
+    with Sandbox() as sandbox:
+        issues = {}
+        for i in range(30):
+            report_id = f"AVR-{i + 1:03}"
+            issues[report_id] = seed_report(sandbox, report_id)
+            sandbox.reports.items[report_id]['pending'] = True
+        # a report whose issue is gone can't be closed
+        del sandbox.issues[(BUG_REPO, issues["AVR-007"]['number'])]
+
+        reports = [Report.from_id(report_id) for report_id in issues]
+        sandbox.reports.items["AVR-010"]['pending'] = False  # unpended after the release was started
+        ctx = ContextProxy(sandbox.bot)
+        sandbox.reset_counts()
+
+        async def run():
+            result = await release_reports(ctx, reports)
+            await result.notifying
+            return result
+
+        result = asyncio.run(run())
+
+        assert list(result.failures) == ["AVR-007"]
+        assert len(result.released) == 28
+        for report_id, issue in issues.items():
+            saved = Report.from_id(report_id)
+            if report_id == "AVR-007":
+                assert saved.pending and saved.severity != -1
+            elif report_id == "AVR-010":
+                assert issue['state'] == "open" and saved.severity != -1
+            else:
+                assert issue['state'] == "closed"
+                assert not saved.pending and saved.severity == -1
+        assert sandbox.calls["dynamo.put_item"] == 28
+        assert sandbox.calls["discord.delete_message"] == 28
+        assert sandbox.calls["discord.dm"] == 28
@@ -0,0 +1,62 @@
+import asyncio
+
+from lib.render import EmbedRenderScheduler
+
+
+class Message:
+    def __init__(self, message_id):
+        self.id = message_id
+        self.edits = []
+
+    async def edit(self, embed):
+        self.edits.append(embed)
+
+
+def test_burst_is_coalesced_to_latest_embed():
+    async def main():
+        scheduler = EmbedRenderScheduler(interval=0.05)
+        message = Message(1)
+        for embed in range(5):
+            scheduler.schedule(message, embed)
+        await asyncio.sleep(0)
+        for embed in range(5, 10):
+            scheduler.schedule(message, embed)
+        await asyncio.sleep(0.1)
+        return scheduler, message
+
+    scheduler, message = asyncio.run(main())
+    # the first edit goes out at once, the rest of the burst collapses into one trailing edit
+    assert message.edits == [4, 9]
+    assert scheduler.stats()["edits_saved"] == 8
+
+
+def test_messages_are_independent():
+    async def main():
+        scheduler = EmbedRenderScheduler(interval=10)
+        a, b = Message(1), Message(2)
+        scheduler.schedule(a, "a")
+        scheduler.schedule(b, "b")
+        await asyncio.sleep(0)
+        return a, b
+
+    a, b = asyncio.run(main())
+    assert a.edits == ["a"]
+    assert b.edits == ["b"]
+
+
+def test_flush_all_and_discard():
+    async def main():
+        scheduler = EmbedRenderScheduler(interval=10)
+        a, b = Message(1), Message(2)
+        scheduler.schedule(a, "first")
+        await asyncio.sleep(0)
+        scheduler.schedule(a, "second")  # within the interval: deferred
+        scheduler.schedule(b, "deleted")
+        scheduler.discard(b.id)
+        await scheduler.flush_all()
+        return scheduler, a, b
+
+    scheduler, a, b = asyncio.run(main())
+    assert a.edits == ["first", "second"]
+    assert b.edits == []
+    assert scheduler.stats()["pending"] == 0
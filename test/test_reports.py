@@ -1,4 +1,12 @@
-from lib.reports import Report
+import asyncio
+from decimal import Decimal
+from types import SimpleNamespace
+
+from bench.fakes import Sandbox
+from lib import dedup
+from lib.misc import ContextProxy
+from lib.reports import Attachment, Report, ReportException
+from web.web import Web
 
 
 def test_create():
@@ -13,4 +21,213 @@ def test_create():
 
     report_dict = report.to_dict()
     new_report = Report.from_dict(report_dict)
-    assert report.__dict__ == new_report.__dict__
+    assert report.to_dict() == new_report.to_dict()
+
+
+def test_stored_reports_load_lazily():
+    stored = {
+        'reporter': Decimal(1), 'report_id': "AVR-001", 'title': "test", 'severity': Decimal(6),
+        'verification': Decimal(0), 'upvotes': Decimal(2), 'downvotes': Decimal(1), 'message': Decimal(5),
+        'attachments': [{'author': Decimal(1), 'message': "Body", 'veri': Decimal(0)}],
+        'github_issue': Decimal(0), 'github_repo': "avrae/avrae", 'subscribers': [Decimal(1)], 'is_bug': True,
+        'is_automation': False, 'pending': False, 'thread_id': Decimal(0), 'automation_name': None,
+    }
+    report = Report.from_dict(stored)
+    assert type(stored['attachments'][0]) is dict and type(stored['upvotes']) is Decimal  # left alone
+    assert type(report.upvotes) is int and type(report.reporter) is int and type(report.subscribers[0]) is int
+    assert report.attachment_count == 1 and report.score == 1
+    assert report.to_dict() == {**stored, 'voters': {}}  # without ever building the attachments
+    assert report.attachments[0].message == "Body" and type(report.attachments[0].author) is int
+    report.attachments.append(Attachment(2, "Note"))
+    assert report.to_dict()['attachments'][1] == {'author': 2, 'message': "Note", 'veri': 0}
+
+
+def test_tracker_updates_do_not_fetch_messages():
+    with Sandbox() as sandbox:
+        report = Report(1, "AVR-001", "test", 6, 0, [], None, github_issue=5)
+        ctx = ContextProxy(sandbox.bot)
+
+        async def main():
+            await report.setup_message(sandbox.bot)
+            first = report.message
+            await report.update(ctx)
+            await Report.render_scheduler.flush_all()
+            Report.forget_message(first)  # e.g. an edit found it deleted
+            await report.update(ctx)
+            return first
+
+        first = asyncio.run(main())
+        assert report.message != first  # reposted
+        assert sandbox.calls["discord.send"] == 2
+        assert sandbox.calls["discord.fetch_message"] == 0
+
+
+
+def test_embeds_are_memoized_per_version():
+    with Sandbox() as sandbox:
+        guild = sandbox.bot.get_guild(1)
+        report = Report(1, "AVR-001", "test", 6, 0, [Attachment(1, "Body")], None)
+        misses = Report.embed_cache_misses
+
+        report.get_embed().add_field(name="Extra", value="callers can modify their copy")
+        assert len(report.get_embed().fields) == 3
+        report.get_embed(detailed=True, guild=guild)
+        report.get_embed(detailed=True, guild=guild)
+        assert Report.embed_cache_misses == misses + 2
+
+        # any change to the report is a new version
+        report.verification += 1
+        assert report.get_embed().fields[2].value == "1"
+        report.attachments.append(Attachment(2, "CR", 1))
+        assert report.get_embed(detailed=True, guild=guild).fields[-1].value == "CR"
+        assert Report.embed_cache_misses == misses + 4
+
+
+def test_submission_key_follows_pr_state():
+    repo = "avrae/avrae-data-entry"
+    with Sandbox() as sandbox:
+        branch = dedup.branch_name(10, 1, "Fire Bolt")
+        Report(1, "AUT-001", "test", 6, 0, [], None, github_issue=3, github_repo=repo, is_bug=False,
+               is_automation=True, thread_id=10, automation_name="Fire Bolt", submission_key=branch).commit()
+        cog = Web(sandbox.bot)
+
+        def pr_event(action):
+            return {"action": action, "repository": {"full_name": repo},
+                    "pull_request": {"number": 3, "head": {"ref": branch}}}
+
+        async def main():
+            found = await Report.find_existing_submission(repo, branch)
+            await cog.handle_event("pull_request", pr_event("closed"))
+            after_close = await Report.find_existing_submission(repo, branch)
+            await cog.handle_event("pull_request", pr_event("reopened"))
+            after_reopen = await Report.find_existing_submission(repo, branch)
+            return found, after_close, after_reopen
+
+        found, after_close, after_reopen = asyncio.run(main())
+        assert found.report_id == "AUT-001"
+        assert after_close is None
+        assert after_reopen.report_id == "AUT-001"
+        assert "submission_key" not in Report(1, "AVR-001", "test", 6, 0, [], None).to_dict()
+        assert not any(call.startswith("github") for call in sandbox.calls)
+
+
+def test_submissions_know_their_automations():
+    repo = "avrae/avrae-data-entry"
+    batch = Report(1, "AUT-002", "test", 6, 0, [], None, github_repo=repo, is_bug=False, is_automation=True,
+                   thread_id=10, automation_names=["Fire Bolt", "Ice Knife"])
+    single = Report(1, "AUT-001", "test", 6, 0, [], None, github_repo=repo, is_bug=False, is_automation=True,
+                    thread_id=10, automation_name="Fire Bolt")
+    assert batch.has_automation(" fire bolt") and batch.has_automation("Ice Knife")
+    assert single.has_automation("FIRE BOLT") and not single.has_automation("Ice Knife")
+    # an automation's file is at the same path whether it went out on its own or in a batch
+    assert batch.get_submission_path("Fire Bolt") == single.get_submission_path("Fire Bolt")
+
+
+def test_thread_lookups_are_remembered():
+    with Sandbox() as sandbox:
+        report = Report(1, "AFR-001", "test", 6, 0, [], None, is_bug=False)
+        ctx = ContextProxy(sandbox.bot)
+
+        async def main():
+            await report.setup_message(sandbox.bot)
+            for i in range(3):
+                await report.addnote(1, f"note {i}", ctx)
+            assert sandbox.calls["discord.fetch_channel"] == 1  # the report has no thread, and that's remembered
+
+            # someone opens a thread on the tracker message
+            sent = []
+
+            async def send(msg):
+                sent.append(msg)
+
+            thread = SimpleNamespace(id=report.message, archived=False, locked=False, send=send)
+            Report.remember_thread(thread)
+            await report.addnote(1, "in the thread", ctx)
+            assert sent and sent[-1].endswith("in the thread")
+
+            Report.forget_thread(thread.id)
+            assert await report.get_thread(sandbox.bot) is None
+            assert sandbox.calls["discord.fetch_channel"] == 1
+
+        asyncio.run(main())
+
+
+def test_repeat_votes_are_caught_by_the_voter_index():
+    with Sandbox() as sandbox:
+        ctx = ContextProxy(sandbox.bot)
+        stored = Report(1, "AFR-001", "test", 6, 0, [Attachment(1, "Body"), Attachment.upvote(2)], None,
+                        is_bug=False, upvotes=1).to_dict()
+        del stored['voters']  # saved before reports kept voters
+        report = Report.from_dict(stored)
+        assert report.has_voted(2) and not report.has_voted(3)
+        assert report._stored_attachments is not None  # built without loading the attachments
+        assert report.get_embed().description == "*2 notes*"
+        assert report._stored_attachments is not None  # nor does the tracker embed load them
+
+        async def main():
+            await report.upvote(3, '', ctx)
+            for author in (2, 3):
+                try:
+                    await report.upvote(author, '', ctx)
+                except ReportException:
+                    continue
+                raise AssertionError(f"{author} voted twice")
+
+        asyncio.run(main())
+        report.commit()
+        assert Report.from_id("AFR-001").voters == {"2": 2, "3": 2}
+
+
+def test_concurrent_changes_to_a_report_apply_in_turn():
+    with Sandbox() as sandbox:
+        ctx = ContextProxy(sandbox.bot)
+        Report(1, "AFR-001", "test", 6, 0, [Attachment(1, "Body")], None, is_bug=False).commit()
+        sandbox.reset_counts()
+
+        async def vote(author):
+            async with Report.locked("afr-001") as report:
+                await asyncio.sleep(0)  # let the other voters queue up
+                await report.upvote(author, '', ctx)
+                report.commit()
+
+        async def main():
+            await asyncio.gather(*(vote(author) for author in (2, 3, 4)))
+            assert len(Report.locks) == 0  # dropped once nobody holds them
+            assert sandbox.calls["dynamo.get_item"] == 1  # the voters shared the first one's load
+
+            reports = await asyncio.gather(*(Report.load("AFR-001") for _ in range(3)))
+            assert sandbox.calls["dynamo.get_item"] == 2  # concurrent loads share one read...
+            assert len({id(report) for report in reports}) == 3  # ...but not the Report
+
+            try:
+                async with Report.locked("AFR-404"):
+                    raise AssertionError("loaded a missing report")
+            except ReportException:
+                pass
+
+        asyncio.run(main())
+        stored = Report.from_id("AFR-001")
+        assert stored.upvotes == 3 and set(stored.voters) == {"2", "3", "4"}
+        assert Report.locks.contended >= 2
+
+
+def test_changes_to_a_new_report_wait_until_it_is_saved():
+    with Sandbox() as sandbox:
+        ctx = ContextProxy(sandbox.bot)
+        report = Report(1, "AFR-001", "test", 6, 0, [Attachment(1, "Body")], None, is_bug=False)
+
+        async def create():
+            async with Report.locked("AFR-001", new=report):
+                await asyncio.sleep(0)  # e.g. posting its tracker message, which can be clicked right away
+                report.commit()
+
+        async def vote():
+            async with Report.locked("AFR-001") as voted:
+                await voted.upvote(2, '', ctx)
+                voted.commit()
+
+        async def main():
+            await asyncio.gather(create(), vote())
+
+        asyncio.run(main())
+        assert Report.from_id("AFR-001").upvotes == 1
@@ -0,0 +1,28 @@
+import asyncio
+from types import SimpleNamespace
+
+from lib.routing import MessageRouter
+
+
+def test_routes_by_channel_and_thread_parent():
+    received = []
+
+    async def handler(message, config):
+        received.append((message.content, config))
+
+    router = MessageRouter()
+    router.add(1, handler, "bugs")
+    router.add(2, handler, "automation", threads=True)
+
+    async def main():
+        for channel, content in (
+                (SimpleNamespace(id=1), "bug channel"),
+                (SimpleNamespace(id=10, parent_id=1), "thread in bug channel"),
+                (SimpleNamespace(id=11, parent_id=2), "forum post"),
+                (SimpleNamespace(id=3), "elsewhere"),
+        ):
+            await router.dispatch(SimpleNamespace(channel=channel, content=content))
+
+    asyncio.run(main())
+    assert received == [("bug channel", "bugs"), ("forum post", "automation")]
+    assert router.stats() == {"routes": 2, "routed": 2, "dropped": 2}
@@ -0,0 +1,149 @@
+import asyncio
+import importlib.util
+import io
+import time
+import zipfile
+
+import pytest
+
+from lib.submissions import Submission, SubmissionValidator, parse_archive, parse_documents, validate_document
+
+needs_automation_common = pytest.mark.skipif(importlib.util.find_spec("automation_common") is None,
+                                             reason="automation-common is not installed")
+
+
+def validate(content):
+    validator = SubmissionValidator(workers=1)
+    try:
+        return asyncio.run(validator.validate(content))
+    finally:
+        validator.shutdown()
+
+
+def test_parse_errors():
+    assert "must be valid JSON or YAML" in parse_documents("{unclosed", "message").errors[0]
+    assert "parses to an object" in parse_documents("just a string", "message").errors[0]
+    assert validate_document({"automation": [{"type": "text", "text": "hi"}]}, "message").errors == \
+           ["Submission must include a 'name' field."]
+
+
+@needs_automation_common
+def test_valid_submission_is_serialized():
+    submission = validate("name: Fire Bolt\nautomation:\n  - type: text\n    text: Hello\n")
+    assert submission.errors == []
+    assert submission.parsed_format == "yaml"
+    item, = submission.items
+    assert item.errors == []
+    assert item.name == "Fire Bolt"
+    assert '"name": "Fire Bolt"' in item.file_content
+
+
+@needs_automation_common
+def test_batches_are_validated_per_automation():
+    submission = validate('[{"name": "A", "automation": [{"type": "text", "text": "a"}]},'
+                          ' {"name": "B"}]')
+    assert submission.errors == []
+    assert [item.name for item in submission.items] == ["A", "B"]
+    assert submission.items[0].errors == []
+    assert submission.items[1].errors == ["Submission must include an 'automation' field."]
+
+    multi_doc = "name: A\nautomation: [{type: text, text: a}]\n---\nname: B\nautomation: [{type: text, text: b}]\n"
+    assert [item.name for item in validate(multi_doc).items] == ["A", "B"]
+    assert "same name" in validate("name: A\nautomation: [1]\n---\nname: a\nautomation: [1]\n").errors[0]
+
+
+def test_archives():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        archive.writestr("a.json", '{"name": "A", "automation": [{"type": "text", "text": "a"}]}')
+        archive.writestr("more/b.yaml", "name: B\nautomation: [{type: text, text: b}]\n")
+        archive.writestr("README.md", "ignored")
+    parsed = parse_archive(buf.getvalue(), "attachment")
+    assert [doc["name"] for doc in parsed.items] == ["A", "B"]
+    assert "too large once unzipped" in parse_archive(buf.getvalue(), "attachment", max_bytes=20).errors[0]
+    assert "not a valid zip" in parse_archive(b"nope", "attachment").errors[0]
+
+
+def test_oversized_submissions_are_rejected_without_parsing():
+    validator = SubmissionValidator(max_bytes=10)
+    result = asyncio.run(validator.validate("name: " + "x" * 100))
+    assert "too large" in result.errors[0]
+    assert validator._pool is None
+
+
+def test_timeout_restarts_workers():
+    validator = SubmissionValidator(workers=1, timeout=0.001)
+
+    async def main():
+        timed_out = await validator.validate('{"name": "a", "automation": []}')
+        validator.timeout = 30
+        return timed_out, await validator.validate("not an object")
+
+    try:
+        timed_out, result = asyncio.run(main())
+    finally:
+        validator.shutdown()
+    assert "took too long" in timed_out.errors[0]
+    assert validator.timeouts == 1
+    assert "parses to an object" in result.errors[0]
+
+
+@needs_automation_common
+def test_identical_resubmissions_are_not_validated_again():
+    validator = SubmissionValidator(workers=1)
+
+    async def main():
+        first = await validator.validate("name: Fire Bolt\nautomation: [{type: text, text: Hi}]")
+        again = await validator.validate("name: Fire Bolt\r\nautomation: [{type: text, text: Hi}]\n")
+        return first, again
+
+    try:
+        first, again = asyncio.run(main())
+    finally:
+        validator.shutdown()
+    assert again is first
+    assert validator.cache_hits == 1
+
+
+# run in the workers, like parse_documents
+def allocate(n_bytes):
+    return Submission([f"allocated {len(bytearray(n_bytes))} bytes"], [], None)
+
+
+def hang(seconds):
+    time.sleep(seconds)
+
+
+def test_workers_memory_is_limited():
+    validator = SubmissionValidator(workers=1, memory_limit=256 * 1024 * 1024)
+
+    async def main():
+        too_big = await validator._run("big", "message", allocate, 1024 * 1024 * 1024)
+        return too_big, await validator._run("small", "message", allocate, 1024)
+
+    try:
+        too_big, small = asyncio.run(main())
+    finally:
+        validator.shutdown()
+    assert "too much memory" in too_big.errors[0]
+    assert small.errors == ["allocated 1024 bytes"]  # the worker survived
+    assert validator.memory_errors == 1
+
+
+def test_other_submissions_survive_a_restart():
+    validator = SubmissionValidator(workers=1, timeout=2)
+
+    async def main():
+        hung = asyncio.ensure_future(validator._run("hung", "message", hang, 30))
+        await asyncio.sleep(1)
+        # queued behind the hung one, so the restart cancels it before it starts
+        queued = asyncio.ensure_future(validator.validate("not an object"))
+        return await hung, await queued
+
+    try:
+        hung, queued = asyncio.run(main())
+    finally:
+        validator.shutdown()
+    assert "took too long" in hung.errors[0]
+    assert "parses to an object" in queued.errors[0]
+    assert validator.timeouts == 1 and validator.resubmits == 1
@@ -0,0 +1,112 @@
+"""
+Standalone GitHub webhook ingest. Validates incoming webhooks and enqueues them into the shared event queue,
+which the bot consumes (see web.web). Run with ``python -m web.ingest``.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+
+from aiohttp import web
+
+from lib import metrics
+from lib.delivery import DeliveryCache, PERSIST_DELIVERIES
+from lib.eventqueue import EventQueue
+
+QUEUE_PATH = os.environ.get("WEBHOOK_QUEUE_PATH", "webhooks.sqlite3")
+QUEUE_MAX_DEPTH = int(os.environ.get("WEBHOOK_QUEUE_MAX_DEPTH", 10000))
+# the ingest reports itself not ready once the bot is this many seconds behind
+MAX_READY_LAG = int(os.environ.get("WEBHOOK_MAX_READY_LAG", 300))
+WEBHOOK_SECRET = os.environ.get("GITHUB_WEBHOOK_SECRET")
+PORT = int(os.environ.get("WEBHOOK_PORT", 8378))  # taine's discrim, lol
+HANDLED_EVENTS = ("ping", "issues", "issue_comment", "pull_request")
+
+
+def is_valid_signature(body, signature, secret=WEBHOOK_SECRET):
+    """Checks the X-Hub-Signature-256 header against the raw body. Always valid if no secret is configured."""
+    if not secret:
+        return True
+    if not signature:
+        return False
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class Ingest:
+    def __init__(self, queue, deliveries=None, max_ready_lag=MAX_READY_LAG):
+        self.queue = queue
+        self.deliveries = deliveries or DeliveryCache()
+        self.max_ready_lag = max_ready_lag
+        self.enqueued = 0
+        self.rejected_full = 0
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post('/github', self.github_handler)
+        app.router.add_get('/github', self.health_check)
+        app.router.add_get('/health', self.readiness_check)
+        app.router.add_get('/metrics', self.metrics_handler)
+        app.on_shutdown.append(self.on_shutdown)
+        metrics.register("webhook_deliveries", self.deliveries.stats)
+        metrics.register("webhook_ingest", self.stats)
+        return app
+
+    async def github_handler(self, request):
+        if not request.headers.get("User-Agent", "").startswith("GitHub-Hookshot/"):
+            return web.Response(status=403)
+        body = await request.read()
+        if not is_valid_signature(body, request.headers.get("X-Hub-Signature-256")):
+            return web.Response(status=401)
+        event_type = request.headers.get("X-GitHub-Event")
+        if event_type not in HANDLED_EVENTS:
+            return web.Response(body="Ignored")
+        try:
+            json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+
+        delivery_id = request.headers.get("X-GitHub-Delivery")
+        if delivery_id is not None and not self.deliveries.add(delivery_id):
+            return web.Response(body="Duplicate delivery")
+
+        # backpressure: if the bot has fallen this far behind, make GitHub show the delivery as failed
+        if self.queue.is_full():
+            self.rejected_full += 1
+            if delivery_id is not None:
+                self.deliveries.discard(delivery_id)
+            return web.Response(status=503, headers={"Retry-After": "60"})
+
+        self.queue.put(event_type, body.decode(), delivery_id)
+        self.enqueued += 1
+        return web.Response(status=202)
+
+    async def health_check(self, _):
+        return web.Response(body="Healthy")
+
+    async def readiness_check(self, _):
+        stats = self.queue.stats()
+        ready = stats['lag_seconds'] <= self.max_ready_lag and stats['depth'] < stats['maxsize']
+        return web.json_response({"ready": ready, **stats}, status=200 if ready else 503)
+
+    async def metrics_handler(self, _):
+        return web.json_response(metrics.snapshot())
+
+    async def on_shutdown(self, _):
+        self.queue.close()
+
+    def stats(self):
+        return {"enqueued": self.enqueued, "rejected_full": self.rejected_full, **self.queue.stats()}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(levelname)s:%(name)s: %(message)s')
+    deliveries_table = None
+    if PERSIST_DELIVERIES:
+        from lib import db
+
+        deliveries_table = db.deliveries
+    ingest = Ingest(EventQueue(QUEUE_PATH, maxsize=QUEUE_MAX_DEPTH), DeliveryCache(table=deliveries_table))
+    # run_app stops accepting on SIGINT/SIGTERM and lets in-flight requests finish before on_shutdown
+    web.run_app(ingest.build_app(), host="0.0.0.0", port=PORT)
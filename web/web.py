@@ -1,18 +1,39 @@
 import asyncio
+import json
+import logging
+import os
 import re
 
 from aiohttp import web
 from disnake.ext import commands
 
 import constants
+from lib import db, metrics
+from lib.coalesce import EventCoalescer
+from lib.delivery import DeliveryCache, PERSIST_DELIVERIES
+from lib.eventqueue import EventQueue
 from lib.github import GitHubClient
 from lib.misc import ContextProxy
 from lib.reports import Report, ReportException
+from web.ingest import is_valid_signature
 
 PRI_LABEL_NAMES = ("P0", "P1", "P2", "P3", "P4", "P5")
 BUG_LABEL = "bug"
 FEATURE_LABEL = "featurereq"
 EXEMPT_LABEL = "enhancement"
+# how long an issue must be quiet before a burst of issues events on it is reconciled
+ISSUE_EVENT_WINDOW = 5
+ISSUE_EVENT_MAX_DELAY = 30
+# if set, webhooks are received by the standalone ingest process (web.ingest) and consumed from this queue
+# instead of by a server in the bot process
+WEBHOOK_QUEUE_PATH = os.environ.get("WEBHOOK_QUEUE_PATH")
+QUEUE_POLL_INTERVAL = 1
+QUEUE_BATCH_SIZE = 10
+WEBHOOK_PORT = 8378  # taine's discrim, lol
+# in queue mode the bot only serves health and metrics, so it doesn't collide with the ingest's port
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 8379))
+
+log = logging.getLogger(__name__)
 
 # structured CI-result comment posted by avrae-data-entry's automation-test workflow (producer side of this contract)
 AUTOMATION_RESULT_RE = re.compile(
@@ -50,49 +71,178 @@ def parse_automation_resolution_failed(body):
 
 
 class Web(commands.Cog):
-    # this is probably a really hacky way to run a webhook handler, but eh
     def __init__(self, bot):
         self.bot = bot
-        loop = self.bot.loop
-        app = web.Application(loop=loop)
-        app.router.add_post('/github', self.github_handler)
+        self.issue_events = EventCoalescer(self.reconcile_issue, window=ISSUE_EVENT_WINDOW,
+                                           max_delay=ISSUE_EVENT_MAX_DELAY)
+        self.deliveries = DeliveryCache(table=db.deliveries if PERSIST_DELIVERIES else None)
+        metrics.register("webhook_deliveries", self.deliveries.stats)
+        metrics.register("issue_events", self.issue_events.stats)
+        metrics.register("issue_state_cache", GitHubClient.get_instance().issue_cache.stats)
+
+        self.queue = None
+        self.consumer = None
+        self._settling = set()  # tasks acking queued events once the coalesced work they were handed to is done
+        self.runner = None
+        if WEBHOOK_QUEUE_PATH:
+            self.queue = EventQueue(WEBHOOK_QUEUE_PATH)
+            metrics.register("webhook_queue", self.queue.stats)
+        self.app = self.build_app()
+
+    def build_app(self):
+        app = web.Application()
         app.router.add_get('/github', self.health_check)
-        self.run_app(app, host="0.0.0.0", port=8378)  # taine's discrim, lol
+        app.router.add_get('/metrics', self.metrics_handler)
+        if self.queue is None:
+            app.router.add_post('/github', self.github_handler)
+        return app
+
+    async def cog_load(self):
+        if self.queue is not None:
+            self.consumer = self.bot.loop.create_task(self.consume_queue())
+            await self.start_server(self.app, host="0.0.0.0", port=METRICS_PORT)
+        else:
+            await self.start_server(self.app, host="0.0.0.0", port=WEBHOOK_PORT)
+
+    def cog_unload(self):
+        if self.consumer is not None:
+            self.consumer.cancel()
+        self.bot.loop.create_task(self.shutdown())
+
+    async def shutdown(self):
+        await self.issue_events.flush_all()
+        if self._settling:
+            await asyncio.wait(self._settling)
+        if self.runner is not None:
+            await self.runner.cleanup()
+        if self.queue is not None:
+            self.queue.close()
+
+    async def start_server(self, app, host, port):
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        print(f"======== Running on http://{host}:{port}/ ========")
 
     async def github_handler(self, request):
         if not request.headers.get("User-Agent", "").startswith("GitHub-Hookshot/"):
             return web.Response(status=403)
-        event_type = request.headers["X-GitHub-Event"]
-        data = await request.json()
+        body = await request.read()
+        if not is_valid_signature(body, request.headers.get("X-Hub-Signature-256")):
+            return web.Response(status=401)
+        # GitHub redelivers on timeouts; acknowledge anything we've already seen without processing it again
+        delivery_id = request.headers.get("X-GitHub-Delivery")
+        if delivery_id is not None and not self.deliveries.add(delivery_id):
+            return web.Response(body="Duplicate delivery")
 
-        if event_type == "ping":
-            print(f"Pinged by GitHub. {data['zen']}")
-        elif event_type == "issues":
-            await self.issues_handler(data)
-        elif event_type == "issue_comment":
-            await self.issue_comment_handler(data)
+        event_type = request.headers["X-GitHub-Event"]
+        try:
+            handed_off = await self.handle_event(event_type, json.loads(body))
+        except Exception:
+            if delivery_id is not None:  # let a redelivery try again
+                self.deliveries.discard(delivery_id)
+            raise
+        if handed_off is not None and delivery_id is not None:
+            handed_off.add_done_callback(lambda done: self.forget_failed_delivery(delivery_id, done))
 
         return web.Response()
 
+    def forget_failed_delivery(self, delivery_id, handed_off):
+        """Lets a delivery whose handed-off work failed be redelivered, once that work is done."""
+        if handed_off.cancelled() or handed_off.exception() is not None or not handed_off.result():
+            self.deliveries.discard(delivery_id)
+
+    async def consume_queue(self):
+        """
+        Processes the events enqueued by the standalone ingest process. Each is acked only once it has been handled
+        completely - for an issues event, once the coalesced reconciliation it joined has run - so whatever is still
+        in flight when the bot stops is delivered again. Events whose handling failed go to the dead-letter table.
+        """
+        last_taken = 0
+        while True:
+            events = self.queue.get(limit=QUEUE_BATCH_SIZE, after=last_taken)
+            if not events:
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+                continue
+            for event in events:
+                last_taken = event.id
+                try:
+                    handed_off = await self.handle_event(event.event_type, event.data)
+                except Exception as e:
+                    log.exception(f"Error handling queued {event.event_type} event {event.delivery_id}")
+                    self.queue.fail(event.id, repr(e))
+                    continue
+                if handed_off is None:
+                    self.queue.ack(event.id)
+                else:
+                    settling = asyncio.ensure_future(self.settle_event(event, handed_off))
+                    self._settling.add(settling)
+                    settling.add_done_callback(self._settling.discard)
+
+    async def settle_event(self, event, handed_off):
+        if await handed_off:
+            self.queue.ack(event.id)
+        else:
+            self.queue.fail(event.id, "coalesced reconciliation failed")
+
+    async def handle_event(self, event_type, data):
+        """
+        Handles a webhook event. Returns None once it has been handled, or a future of whether the work it was handed
+        off to (see issues_handler) succeeded.
+        """
+        with db.operation(f"webhook.{event_type}"):
+            if event_type == "ping":
+                print(f"Pinged by GitHub. {data['zen']}")
+            elif event_type == "issues":
+                return await self.issues_handler(data)
+            elif event_type == "issue_comment":
+                await self.issue_comment_handler(data)
+            elif event_type == "pull_request":
+                await self.pull_request_handler(data)
+
     async def health_check(self, _):
         return web.Response(body="Healthy")
 
+    async def metrics_handler(self, _):
+        return web.json_response(metrics.snapshot())
+
     # ===== github: issue event =====
     async def issues_handler(self, data):
         repo_name = data['repository']['full_name']
         action = data['action']
         if repo_name not in constants.REPO_ID_MAP:  # this issue is on a repo we don't listen to
             return
+        GitHubClient.get_instance().issue_cache.hydrate(repo_name, data['issue'])
         if data['sender']['login'] == constants.MY_GITHUB:  # don't react to my own changes
             return
 
-        # we only really care about opened or closed
-        if action == "closed":
-            await self.report_closed(data)
-        elif action in ("opened", "reopened"):
-            await self.report_opened(data)
-        elif action in ("labeled", "unlabeled"):
-            await self.report_labeled(data)
+        # we only really care about opened, closed, or labels; collapse bursts on the same issue into one pass
+        if action in ("closed", "opened", "reopened", "labeled", "unlabeled"):
+            return self.issue_events.submit((repo_name, data['issue']['number']), data)
+
+    async def reconcile_issue(self, key, events):
+        """
+        Applies a burst of issues events for one issue against the final payload: at most one open/close
+        transition and one label reconciliation. Labels changed on a closed issue are applied to its report, but don't
+        start tracking an issue that has none.
+        """
+        data = events[-1]
+        actions = {e['action'] for e in events}
+        if data['issue']['state'] == "closed":
+            if actions & {"labeled", "unlabeled"}:
+                await self.report_labeled(data, track=False)
+            if "closed" in actions:
+                await self.report_closed(data)
+            return
+
+        report = None
+        if actions & {"opened", "reopened"}:
+            report = await self.report_opened(data)
+            if report is None:  # exempt from tracking
+                return
+        if actions & {"labeled", "unlabeled"}:
+            await self.report_labeled(data, report)
 
     async def report_closed(self, data):
         issue = data['issue']
@@ -105,8 +255,9 @@ class Web(commands.Cog):
 
         pend = data['sender']['login'] == constants.OWNER_GITHUB
 
-        await report.resolve(ContextProxy(self.bot), close_github_issue=False, pend=pend)
-        report.commit()
+        async with Report.locked(report.report_id) as report:
+            await report.resolve(ContextProxy(self.bot), close_github_issue=False, pend=pend)
+            report.commit()
 
     async def report_opened(self, data):
         issue = data['issue']
@@ -129,14 +280,18 @@ class Web(commands.Cog):
             await GitHubClient.get_instance().add_issue_comment(repo_name, issue['number'],
                                                                 f"Tracked as `{report.report_id}`.")
             await report.update_labels()
-
-        await report.unresolve(ContextProxy(self.bot), open_github_issue=False)
-        report.commit()
-
+            async with Report.locked(report.report_id, new=report):
+                await report.unresolve(ContextProxy(self.bot), open_github_issue=False)
+                report.commit()
+            return report
+
+        async with Report.locked(report.report_id) as report:
+            if not report.is_open():  # a close/reopen burst leaves the report open
+                await report.unresolve(ContextProxy(self.bot), open_github_issue=False)
+                report.commit()
         return report
 
-    async def report_labeled(self, data):
-        await asyncio.sleep(10)  # prevent a race condition when an issue is newly created
+    async def report_labeled(self, data, report=None, track=True):
         issue = data['issue']
         issue_num = issue['number']
         repo_name = data['repository']['full_name']
@@ -147,28 +302,33 @@ class Web(commands.Cog):
         if len([l for l in label_names if l in (BUG_LABEL, FEATURE_LABEL, EXEMPT_LABEL)]) > 1:
             return  # multiple type labels
 
-        try:
-            report = Report.from_github(repo_name, issue_num)
-        except ReportException:  # report not found
-            report = await self.report_opened(data)
+        if report is None:
+            try:
+                report = Report.from_github(repo_name, issue_num)
+            except ReportException:  # report not found
+                if not track:
+                    return
+                report = await self.report_opened(data)
 
         if report is None:  # this only happens if we try to create a report off an enhancement label
             return  # we don't want to track it anyway
 
         ctx = ContextProxy(self.bot)
 
-        if EXEMPT_LABEL in label_names:  # issue changed from bug/fr to enhancement
-            await report.untrack(ctx)
-        else:
-            priority = report.severity
-            for i, pri in enumerate(PRI_LABEL_NAMES):
-                if any(pri in n for n in label_names):
-                    priority = i
-                    break
-            report.severity = priority
-            report.is_bug = FEATURE_LABEL not in label_names
-            await report.update(ctx)
-            report.commit()
+        async with Report.locked(report.report_id) as report:
+            if EXEMPT_LABEL in label_names:  # issue changed from bug/fr to enhancement
+                await report.untrack(ctx)
+            else:
+                priority = report.severity
+                for i, pri in enumerate(PRI_LABEL_NAMES):
+                    if any(pri in n for n in label_names):
+                        priority = i
+                        break
+                if report.is_open():  # a closed report's severity marks it closed
+                    report.severity = priority
+                report.is_bug = FEATURE_LABEL not in label_names
+                await report.update(ctx)
+                report.commit()
 
     # ===== github: issue_comment event (also fires for PR comments) =====
     async def issue_comment_handler(self, data):
@@ -178,6 +338,7 @@ class Web(commands.Cog):
         comment = data['comment']
         action = data['action']
         username = comment['user']['login']
+        GitHubClient.get_instance().issue_cache.hydrate(repo_name, issue)
         if username == constants.MY_GITHUB:
             return  # don't infinitely add comments
 
@@ -193,8 +354,28 @@ class Web(commands.Cog):
                 await self.relay_automation_result(report, comment['body'])
                 return
 
-            await report.addnote(f"GitHub - {username}", comment['body'], ContextProxy(self.bot), add_to_github=False)
-            await report.update(ContextProxy(self.bot))
+            async with Report.locked(report.report_id) as report:
+                await report.addnote(f"GitHub - {username}", comment['body'], ContextProxy(self.bot),
+                                     add_to_github=False)
+                await report.update(ContextProxy(self.bot))
+                report.commit()
+
+    # ===== github: pull request event =====
+    async def pull_request_handler(self, data):
+        """Keeps automation reports' submission keys in sync with whether their PR is open."""
+        if data['action'] not in ("closed", "reopened"):
+            return
+        repo_name = data['repository']['full_name']
+        pr = data['pull_request']
+        try:
+            report = Report.from_github(repo_name, pr['number'])
+        except ReportException:
+            return
+        if not report.is_automation:
+            return
+        # a closed PR's branch takes no more updates, so a resubmission should open a new one
+        async with Report.locked(report.report_id) as report:
+            report.submission_key = pr['head']['ref'] if data['action'] == "reopened" else None
             report.commit()
 
     async def relay_automation_result(self, report, body):
@@ -227,24 +408,6 @@ class Web(commands.Cog):
 
         return False
 
-    def run_app(self, app, *, host='0.0.0.0', port=None, ssl_context=None, backlog=128):
-        """Run an app"""
-        if port is None:
-            if not ssl_context:
-                port = 8080
-            else:
-                port = 8443
-
-        loop = app.loop
-
-        handler = app.make_handler()
-        server = loop.create_server(handler, host, port, ssl=ssl_context,
-                                    backlog=backlog)
-        loop.run_until_complete(asyncio.gather(server, app.startup()))
-
-        scheme = 'https' if ssl_context else 'http'
-        print("======== Running on {scheme}://{host}:{port}/ ========".format(scheme=scheme, host=host, port=port))
-
 
 def setup(bot):
     bot.add_cog(Web(bot))